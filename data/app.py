@@ -2,9 +2,28 @@ import streamlit as st
 import pandas as pd
 import sqlite3
 import os
+import sys
 from datetime import datetime, date
 import traceback
 
+# 共通モジュール(washi)を読み込めるようにルートディレクトリをパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from washi.bulkload import TARGET_ROWS_PER_SEC, bulk_load, iter_frame_chunks
+from washi.columnar import ANALYTICS_TABLES, ParquetDatasetWriter, export_table_to_dataset, remove_dataset
+from washi.cube import (
+    CUBE_SOURCE_TABLE, CUBE_TABLE, MonthCollector, drop_stats_cube, update_stats_cube
+)
+from washi.dedup import NATURAL_KEYS, append_new_rows
+from washi.equipment import (
+    DIFF_ADDED, DIFF_CHANGED, DIFF_REMOVED, drop_capability_index, iter_snapshot_diff, save_capability_index
+)
+from washi.indexes import run_index_advisor
+from washi.ingest import peek_csv, stream_csv_to_table
+from washi.schema import (
+    TYPED_TABLES, convert_table_to_typed, decoded_view_name, is_typed_table,
+    refresh_decoded_view, typed_load_options
+)
+
 st.set_page_config(
     page_title="データ読み込み - DB管理システム",
     page_icon="📊",
@@ -18,13 +37,13 @@ if 'file_upload_error' not in st.session_state:
 # データベースパス
 DB_PATH = "./load/SONY.db"
 
+# 品質基準表の比較で画面に表示する差分の行数（全件はCSVで出力）
+DIFF_PREVIEW_ROWS = 1_000
+
 def safe_read_csv(uploaded_file):
     """安全にCSVファイルを読み込む"""
     try:
-        # ファイルを一度バイト形式で読み込む
         if uploaded_file is not None:
-            file_content = uploaded_file.read()
-            
             # ファイルポインタを先頭に戻す
             uploaded_file.seek(0)
             
@@ -64,65 +83,151 @@ def init_database():
     
     return db_file
 
-def create_indexes_for_log_table():
-    """LOGテーブルにインデックスを作成"""
+# LOGテーブルのインデックス（データ投入後にまとめて作成する）
+LOG_INDEX_SQLS = [
+    "CREATE INDEX IF NOT EXISTS idx_log_sub_lot_type ON LOG(SUB_LOT_TYPE)",
+    "CREATE INDEX IF NOT EXISTS idx_log_lot_id ON LOG(LOT_ID)",
+    "CREATE INDEX IF NOT EXISTS idx_log_eqp_id ON LOG(EQP_ID)",
+    "CREATE INDEX IF NOT EXISTS idx_log_stime ON LOG(STIME)",
+    "CREATE INDEX IF NOT EXISTS idx_log_prod_grp_id ON LOG(PROD_GRP_ID)",
+    "CREATE INDEX IF NOT EXISTS idx_log_prod_type ON LOG(PROD_TYPE)",
+    "CREATE INDEX IF NOT EXISTS idx_log_ope_no ON LOG(OPE_NO)",
+    "CREATE INDEX IF NOT EXISTS idx_log_run_time ON LOG(RUN_TIME)",
+    "CREATE INDEX IF NOT EXISTS idx_log_wait_time ON LOG(WAIT_TIME)"
+]
+
+def get_log_index_sqls(columns):
+    """存在するカラムに対するLOGインデックスのみを返す"""
+    return [
+        index_sql for index_sql in LOG_INDEX_SQLS
+        if index_sql[index_sql.rindex("(") + 1:-1] in columns
+    ]
+
+def show_load_result(table_name, result):
+    """一括書き込みの結果（件数と書き込み速度）を表示"""
+    st.success(f"✅ データベース保存成功: {table_name} ({result['rows']:,}行)")
+    speed_msg = (
+        f"⚡ 書き込み速度: {result['rows_per_sec']:,.0f} 行/秒 "
+        f"({result['seconds']:.1f}秒, 目標 {TARGET_ROWS_PER_SEC:,} 行/秒)"
+    )
+    if result['target_met']:
+        st.info(speed_msg)
+    else:
+        st.warning(speed_msg)
+
+def show_parquet_result(table_name, saved):
+    """Parquetデータセットへの保存結果を表示（失敗してもDB保存は有効）"""
+    if saved:
+        st.info(f"🗂️ 分析用Parquetデータセットを更新しました: {table_name}")
+    else:
+        st.warning(f"⚠️ Parquetデータセットの保存に失敗しました（DBへの保存は完了しています）: {table_name}")
+
+def refresh_stats_cube(table_name, replace=True, months=None):
+    """集計元テーブルの保存後に統計キューブを更新（置換時は全月、追加時は追加された月のみ）"""
+    if table_name != CUBE_SOURCE_TABLE:
+        return
     try:
         db_file = os.path.abspath(DB_PATH)
-        conn = sqlite3.connect(db_file)
-        cursor = conn.cursor()
-        
-        # インデックス作成（存在しない場合のみ）
-        indexes = [
-            "CREATE INDEX IF NOT EXISTS idx_log_sub_lot_type ON LOG(SUB_LOT_TYPE)",
-            "CREATE INDEX IF NOT EXISTS idx_log_lot_id ON LOG(LOT_ID)", 
-            "CREATE INDEX IF NOT EXISTS idx_log_eqp_id ON LOG(EQP_ID)",
-            "CREATE INDEX IF NOT EXISTS idx_log_stime ON LOG(STIME)",
-            "CREATE INDEX IF NOT EXISTS idx_log_prod_grp_id ON LOG(PROD_GRP_ID)",
-            "CREATE INDEX IF NOT EXISTS idx_log_prod_type ON LOG(PROD_TYPE)",
-            "CREATE INDEX IF NOT EXISTS idx_log_ope_no ON LOG(OPE_NO)",
-            "CREATE INDEX IF NOT EXISTS idx_log_run_time ON LOG(RUN_TIME)",
-            "CREATE INDEX IF NOT EXISTS idx_log_wait_time ON LOG(WAIT_TIME)"
-        ]
-        
-        for index_sql in indexes:
-            cursor.execute(index_sql)
-        
-        conn.commit()
-        conn.close()
-        return True
+        status_text = st.empty()
+
+        def on_progress(done, total):
+            status_text.text(f"📦 統計キューブを更新中... {done}/{total}ヶ月")
+
+        updated = update_stats_cube(db_file, None if replace else months, progress_callback=on_progress)
+        status_text.empty()
+        if updated is not None:
+            st.info(f"📦 統計キューブを更新しました: {updated}ヶ月分")
     except Exception as e:
-        st.error(f"インデックス作成エラー: {str(e)}")
-        return False
+        print(f"[DEBUG] 統計キューブ更新エラー: {e}")
+        st.warning(f"⚠️ 統計キューブの更新に失敗しました（DBへの保存は完了しています）: {str(e)}")
 
-def save_data_to_db(df, table_name, replace=True):
-    """データをSQLiteに保存"""
+def refresh_capability_index(table_name):
+    """FlowInfo の保存後に装置索引（装置×TYPE×OPE_NO×INHIBIT、設備グループ）を作成
+
+    保存後に st.rerun() するため、結果のメッセージはセッションに残して再表示後に表示する。
+    """
+    messages = [("success", f"✅ テーブル '{table_name}' に保存しました")]
+    try:
+        with st.spinner("🗂️ 装置索引を作成中..."):
+            rows = save_capability_index(os.path.abspath(DB_PATH), table_name)
+        if rows is not None:
+            messages.append(("info", f"🗂️ 装置索引を保存しました: {table_name} ({rows:,}行)"))
+    except Exception as e:
+        print(f"[DEBUG] 装置索引作成エラー: {e}")
+        messages.append(("warning", f"⚠️ 装置索引の作成に失敗しました（DBへの保存は完了しています）: {str(e)}"))
+    st.session_state.flowinfo_messages = messages
+
+def show_flowinfo_messages():
+    """前回の FlowInfo 保存時のメッセージを表示（1回のみ）"""
+    for level, message in st.session_state.pop('flowinfo_messages', []):
+        getattr(st, level)(message)
+
+def show_dedup_result(table_name, result):
+    """差分追加の結果（追加件数とスキップ件数）を表示"""
+    st.success(f"✅ 差分追加: {table_name} に {result['inserted']:,}行を追加、取り込み済みの {result['skipped']:,}行をスキップ")
+    st.info(f"⚡ 処理時間: {result['seconds']:.1f}秒")
+
+def save_data_to_db(df, table_name, replace=True, index_sqls=None, typed=False, dedup=False):
+    """データをSQLiteに一括保存（インデックスは書き込み後に作成）
+
+    dedup=True の場合は自然キーで取り込み済みの行をスキップして追加する（インデックスは維持）。
+    """
     try:
         db_file = os.path.abspath(DB_PATH)
         print(f"[DEBUG] データ保存開始: テーブル={table_name}, DB={db_file}")
         print(f"[DEBUG] データサイズ: {len(df)}行, {len(df.columns)}列")
         
-        conn = sqlite3.connect(db_file)
-        
-        if replace:
-            # 既存テーブルを削除して新規作成
-            df.to_sql(table_name, conn, if_exists='replace', index=False)
-            print(f"[DEBUG] テーブル {table_name} を置換保存しました")
-        else:
-            # データを追加
-            df.to_sql(table_name, conn, if_exists='append', index=False)
-            print(f"[DEBUG] テーブル {table_name} にデータを追加しました")
+        progress_bar = st.progress(0)
         
-        conn.close()
+        def on_progress(rows):
+            progress_bar.progress(int(rows / max(len(df), 1) * 100))
         
-        # 保存確認
-        conn = sqlite3.connect(db_file)
-        cursor = conn.cursor()
-        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-        count = cursor.fetchone()[0]
-        conn.close()
+        # 処理実績は分析用のParquetデータセットにも同じチャンクを書き込む
+        parquet_writer = None
+        if table_name in ANALYTICS_TABLES:
+            parquet_writer = ParquetDatasetWriter(table_name, append=dedup or not replace)
+        month_collector = MonthCollector()
+        try:
+            chunks = iter_frame_chunks(df)
+            if dedup:
+                # 追加された行のみをParquet・統計キューブの更新対象にする
+                sinks = [month_collector.add]
+                if parquet_writer is not None:
+                    sinks.append(parquet_writer.write)
+                result = append_new_rows(
+                    db_file, table_name, chunks, index_sqls=index_sqls,
+                    progress_callback=on_progress, sinks=sinks
+                )
+            else:
+                load_options = typed_load_options() if typed else {}
+                if parquet_writer is not None:
+                    chunks = parquet_writer.tee(chunks)
+                result = bulk_load(
+                    db_file, table_name, month_collector.tee(chunks),
+                    replace=replace, index_sqls=index_sqls, progress_callback=on_progress,
+                    **load_options
+                )
+        except Exception:
+            if parquet_writer is not None:
+                parquet_writer.abort()
+            raise
+        parquet_saved = parquet_writer.commit() if parquet_writer is not None else None
+        progress_bar.empty()
+        if table_name in TYPED_TABLES:
+            refresh_decoded_view(db_file, table_name)
         
-        print(f"[DEBUG] 保存確認: テーブル {table_name} に {count} 行のデータ")
-        st.success(f"✅ データベース保存成功: {table_name} ({count}行)")
+        if dedup:
+            print(f"[DEBUG] テーブル {table_name} に差分を追加しました")
+            show_dedup_result(table_name, result)
+        else:
+            if replace:
+                print(f"[DEBUG] テーブル {table_name} を置換保存しました")
+            else:
+                print(f"[DEBUG] テーブル {table_name} にデータを追加しました")
+            show_load_result(table_name, result)
+        if parquet_saved is not None:
+            show_parquet_result(table_name, parquet_saved)
+        refresh_stats_cube(table_name, replace and not dedup, month_collector.months)
         
         return True
     except Exception as e:
@@ -131,6 +236,48 @@ def save_data_to_db(df, table_name, replace=True):
         st.error(error_msg)
         return False
 
+def save_csv_stream_to_db(uploaded_file, table_name, replace=True, index_sqls=None, typed=False, dedup=False):
+    """CSVをチャンク単位でSQLiteに保存（全データをメモリに保持しない）"""
+    try:
+        db_file = os.path.abspath(DB_PATH)
+        print(f"[DEBUG] ストリーミング保存開始: テーブル={table_name}, DB={db_file}")
+
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+
+        def on_progress(rows, fraction):
+            if fraction is not None:
+                progress_bar.progress(int(fraction * 100))
+            status_text.text(f"📦 書き込み中... {rows:,}行")
+
+        month_collector = MonthCollector()
+        result = stream_csv_to_table(
+            uploaded_file, db_file, table_name,
+            replace=replace, index_sqls=index_sqls, progress_callback=on_progress,
+            typed=typed, columnar=table_name in ANALYTICS_TABLES, observers=[month_collector], dedup=dedup
+        )
+
+        progress_bar.empty()
+        status_text.empty()
+        if table_name in TYPED_TABLES:
+            refresh_decoded_view(db_file, table_name)
+
+        print(f"[DEBUG] 保存確認: テーブル {table_name} に {result['rows']} 行のデータ")
+        if dedup:
+            show_dedup_result(table_name, result)
+        else:
+            show_load_result(table_name, result)
+        if 'parquet' in result:
+            show_parquet_result(table_name, result['parquet'])
+        refresh_stats_cube(table_name, replace and not dedup, month_collector.months)
+
+        return True
+    except Exception as e:
+        error_msg = f"データ保存エラー: {str(e)}"
+        print(f"[DEBUG] {error_msg}")
+        st.error(error_msg)
+        return False
+
 def get_existing_tables():
     """既存のテーブル一覧を取得"""
     try:
@@ -153,15 +300,162 @@ def delete_tables(table_names):
         cursor = conn.cursor()
         
         for table_name in table_names:
+            cursor.execute(f"DROP VIEW IF EXISTS {decoded_view_name(table_name)}")
             cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
         
+        # FlowInfo を削除した場合は保存済みの装置索引も削除
+        for table_name in table_names:
+            if table_name.startswith("FlowInfo_"):
+                drop_capability_index(conn, table_name)
+        
+        # 集計元を削除した場合は統計キューブも削除
+        if CUBE_SOURCE_TABLE in table_names:
+            drop_stats_cube(conn)
+        
         conn.commit()
         conn.close()
+        
+        # 対応するParquetデータセットも削除
+        for table_name in table_names:
+            remove_dataset(table_name)
         return True
     except Exception as e:
         st.error(f"テーブル削除エラー: {str(e)}")
         return False
 
+def get_untyped_log_tables(tables):
+    """型付き圧縮形式に変換可能な（未変換の）LOG系テーブルを取得"""
+    try:
+        db_file = os.path.abspath(DB_PATH)
+        conn = sqlite3.connect(db_file)
+        untyped = [t for t in tables if t in TYPED_TABLES and not is_typed_table(conn, t)]
+        conn.close()
+        return untyped
+    except Exception as e:
+        st.error(f"テーブル情報取得エラー: {str(e)}")
+        return []
+
+def convert_tables_to_typed(table_names):
+    """LOG系テーブルを型付き圧縮形式へ変換"""
+    try:
+        db_file = os.path.abspath(DB_PATH)
+        for table_name in table_names:
+            status_text = st.empty()
+
+            def on_progress(rows):
+                status_text.text(f"🗜️ {table_name} を変換中... {rows:,}行")
+
+            result = convert_table_to_typed(db_file, table_name, progress_callback=on_progress)
+            status_text.empty()
+            show_load_result(table_name, result)
+        return True
+    except Exception as e:
+        st.error(f"テーブル変換エラー: {str(e)}")
+        return False
+
+def optimize_log_indexes():
+    """アプリのクエリに合わせてLOG/LOG2のインデックスを最適化"""
+    try:
+        db_file = os.path.abspath(DB_PATH)
+        status_text = st.empty()
+        report, adopted, unused = run_index_advisor(
+            db_file, progress_callback=lambda message: status_text.text(f"🧭 {message}")
+        )
+        status_text.empty()
+        return report, adopted, unused
+    except Exception as e:
+        st.error(f"インデックス最適化エラー: {str(e)}")
+        return None, [], []
+
+def rebuild_stats_cube():
+    """統計キューブを全月分作り直す"""
+    try:
+        db_file = os.path.abspath(DB_PATH)
+        progress_bar = st.progress(0)
+
+        def on_progress(done, total):
+            progress_bar.progress(int(done / max(total, 1) * 100))
+
+        updated = update_stats_cube(db_file, progress_callback=on_progress)
+        progress_bar.empty()
+        return updated
+    except Exception as e:
+        st.error(f"統計キューブ作成エラー: {str(e)}")
+        return None
+
+def rebuild_parquet_datasets(table_names):
+    """処理実績テーブルから分析用Parquetデータセットを作り直す（DB外で作成されたテーブル向け）"""
+    try:
+        db_file = os.path.abspath(DB_PATH)
+        for table_name in table_names:
+            status_text = st.empty()
+
+            def on_progress(rows):
+                status_text.text(f"🗂️ {table_name} を書き込み中... {rows:,}行")
+
+            saved = export_table_to_dataset(db_file, table_name, progress_callback=on_progress)
+            status_text.empty()
+            show_parquet_result(table_name, saved)
+        return True
+    except Exception as e:
+        st.error(f"Parquetデータセット作成エラー: {str(e)}")
+        return False
+
+def show_flowinfo_diff(old_table, new_table):
+    """2つの FlowInfo の差分を取得しながら件数を表示し、先頭の行とCSVを出力
+
+    CSVはメモリに溜めずにDBと同じフォルダのファイルへ書き出し、そのファイルをダウンロードさせる。
+    """
+    try:
+        db_file = os.path.abspath(DB_PATH)
+        csv_path = os.path.join(os.path.dirname(db_file), f"diff_{old_table}_{new_table}.csv")
+        status_text = st.empty()
+        counts = {DIFF_ADDED: 0, DIFF_REMOVED: 0, DIFF_CHANGED: 0}
+        preview = []
+        with st.spinner("🔍 差分を比較中..."), open(csv_path, "w", encoding="utf-8-sig", newline="") as f:
+            for chunk in iter_snapshot_diff(db_file, old_table, new_table):
+                for change, count in chunk["CHANGE"].value_counts().items():
+                    counts[change] += int(count)
+                if sum(len(part) for part in preview) < DIFF_PREVIEW_ROWS:
+                    preview.append(chunk.head(DIFF_PREVIEW_ROWS))
+                chunk.to_csv(f, index=False, header=f.tell() == 0)
+                status_text.text(f"🔍 比較中... {sum(counts.values()):,}件")
+        status_text.empty()
+
+        col1, col2, col3 = st.columns(3)
+        col1.metric(DIFF_ADDED, f"{counts[DIFF_ADDED]:,}")
+        col2.metric(DIFF_REMOVED, f"{counts[DIFF_REMOVED]:,}")
+        col3.metric(DIFF_CHANGED, f"{counts[DIFF_CHANGED]:,}")
+        if not preview:
+            os.remove(csv_path)
+            st.success(f"✅ {old_table} と {new_table} の処理可能工程に差分はありません")
+            return
+        st.dataframe(pd.concat(preview).head(DIFF_PREVIEW_ROWS), use_container_width=True)
+        st.info(f"📁 差分のCSV: {csv_path}")
+        with open(csv_path, "rb") as f:
+            st.download_button(
+                label="差分をCSVでダウンロード",
+                data=f,
+                file_name=os.path.basename(csv_path),
+                mime="text/csv",
+                key="download_flowinfo_diff"
+            )
+    except Exception as e:
+        print(f"[DEBUG] FlowInfo比較エラー: {e}")
+        st.error(f"FlowInfo比較エラー: {str(e)}")
+
+def vacuum_database():
+    """データベースの空き領域を解放"""
+    try:
+        db_file = os.path.abspath(DB_PATH)
+        conn = sqlite3.connect(db_file)
+        conn.execute("VACUUM")
+        conn.close()
+        return True
+    except Exception as e:
+        st.error(f"VACUUMエラー: {str(e)}")
+        return False
+
 def get_table_info(table_name):
     """テーブルの情報を取得"""
     try:
@@ -181,6 +475,109 @@ def get_table_info(table_name):
     except Exception as e:
         return 0, 0
 
+def show_log_ingest(table_name, label):
+    """処理実績（LOG / LOG2）の読み込みとDB格納
+
+    保存したデータは分析用Parquetデータセットにも書き込む。自然キーが定義されたテーブルは差分追加も選択できる。
+    """
+    key = table_name.lower()
+    uploaded_file = st.file_uploader(
+        f"{label}のCSVファイルを選択してください",
+        type=['csv'],
+        key=key
+    )
+    
+    ingest_mode = st.radio(
+        "読み込み方式",
+        ["通常（一括読み込み）", "ストリーミング（大容量向け）"],
+        key=f"{key}_ingest_mode",
+        horizontal=True,
+        help="ストリーミングではCSVをチャンク単位で読み込みながらDBへ書き込むため、ファイルサイズによらずメモリ使用量が一定になります"
+    )
+    append_delta = False
+    if table_name in NATURAL_KEYS:
+        save_mode = st.radio(
+            "保存方法",
+            ["置換（全件入れ替え）", "差分追加（取り込み済みの行をスキップ）"],
+            key=f"{key}_save_mode",
+            horizontal=True,
+            help=f"差分追加では {'・'.join(NATURAL_KEYS[table_name])} が一致する行を取り込み済みとしてスキップし、新しい行のみを追加します。"
+                 "既存テーブルの形式（型付きかどうか）に合わせて保存されます"
+        )
+        append_delta = save_mode == "差分追加（取り込み済みの行をスキップ）"
+    typed_storage = st.checkbox(
+        "型付き圧縮形式で保存（日時の整数化・IDの辞書化）",
+        key=f"{key}_typed_storage",
+        disabled=append_delta,
+        help="日時をエポック秒、WAIT_TIME/RUN_TIMEを数値、EQP_ID/DeviceGp/OPE_NO/LOT_IDを辞書テーブルの整数コードで保存します。"
+             f"DBサイズが小さくなり、可視化の絞り込みが高速になります。元の文字列表現は {decoded_view_name(table_name)} ビューで参照できます"
+    )
+    
+    def index_sqls_for(columns):
+        return get_log_index_sqls(columns) if table_name == "LOG" else None
+    
+    if uploaded_file is not None and ingest_mode == "ストリーミング（大容量向け）":
+        # 一括読み込みしたデータは不要なので破棄
+        st.session_state.pop(f"{key}_df", None)
+        try:
+            preview_df, encoding = peek_csv(uploaded_file)
+            st.dataframe(preview_df, use_container_width=True)
+            st.caption(f"先頭{len(preview_df)}行のプレビュー（エンコーディング: {encoding}）")
+            
+            if st.button(f"💾 {label}をDBにストリーミング保存", key=f"stream_save_{key}"):
+                if save_csv_stream_to_db(uploaded_file, table_name, replace=not append_delta,
+                                         index_sqls=index_sqls_for(preview_df.columns),
+                                         typed=typed_storage, dedup=append_delta):
+                    st.success(f"✅ テーブル '{table_name}' に保存し、インデックスを更新しました")
+                    st.rerun()
+        except Exception as e:
+            st.error(f"❌ 処理中にエラーが発生しました: {str(e)}")
+            st.error("ブラウザを更新して再度お試しください")
+    
+    elif uploaded_file is not None:
+        col1, col2 = st.columns(2)
+        with col1:
+            load_data = st.button("📂 ファイルを読み込み", key=f"load_{key}")
+        
+        if load_data or f"{key}_df" in st.session_state:
+            try:
+                if load_data:
+                    df, error = safe_read_csv(uploaded_file)
+                    if error:
+                        st.error(f"❌ {error}")
+                    else:
+                        st.session_state[f"{key}_df"] = df
+                        
+                        # インデックス対象カラムの確認
+                        if table_name == "LOG":
+                            required_columns = [
+                                'SUB_LOT_TYPE', 'LOT_ID', 'EQP_ID', 'STIME', 
+                                'PROD_GRP_ID', 'PROD_TYPE', 'OPE_NO', 'RUN_TIME', 'WAIT_TIME'
+                            ]
+                            existing_columns = [col for col in required_columns if col in df.columns]
+                            st.session_state.log_index_columns = existing_columns
+                        
+                        st.success(f"✅ データを読み込みました（{len(df)}行, {len(df.columns)}列）")
+                
+                if f"{key}_df" in st.session_state:
+                    df = st.session_state[f"{key}_df"]
+                    st.dataframe(df.head(), use_container_width=True)
+                    
+                    if table_name == "LOG" and st.session_state.get('log_index_columns'):
+                        st.info(f"インデックス対象カラム: {', '.join(st.session_state.log_index_columns)}")
+                    
+                    with col2:
+                        if st.button(f"💾 {label}をDBに保存", key=f"save_{key}"):
+                            if save_data_to_db(df, table_name, replace=not append_delta,
+                                               index_sqls=index_sqls_for(df.columns),
+                                               typed=typed_storage, dedup=append_delta):
+                                st.success(f"✅ テーブル '{table_name}' に保存し、インデックスを更新しました")
+                                st.rerun()
+                        
+            except Exception as e:
+                st.error(f"❌ 処理中にエラーが発生しました: {str(e)}")
+                st.error("ブラウザを更新して再度お試しください")
+
 # アプリケーション開始
 st.title("📊 データ読み込み - DB管理システム")
 
@@ -200,13 +597,14 @@ init_database()
 # 機能1: データ読み込みとDB格納
 st.header("🔄データ読み込みとDB格納")
 
-# タブで7種類のデータを分離
-tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs([
-    "品質基準表", "同時着工数", "制約時間", "処理実績", "投入計画", "合同フロー", "レイアウト"
+# タブで8種類のデータを分離
+tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8 = st.tabs([
+    "品質基準表", "同時着工数", "制約時間", "処理実績", "投入計画", "合同フロー", "レイアウト", "処理実績（可視化用）"
 ])
 
 with tab1:
     st.subheader("品質基準表の読み込み")
+    show_flowinfo_messages()
     
     col1, col2 = st.columns(2)
     
@@ -249,7 +647,7 @@ with tab1:
                             table_name = f"FlowInfo_{date_str}"
                             
                             if save_data_to_db(df, table_name, replace=True):
-                                st.success(f"✅ テーブル '{table_name}' に保存しました")
+                                refresh_capability_index(table_name)
                                 st.rerun()
                         
             except Exception as e:
@@ -335,56 +733,7 @@ with tab3:
 with tab4:
     st.subheader("処理実績の読み込み")
     
-    uploaded_file = st.file_uploader(
-        "処理実績のCSVファイルを選択してください",
-        type=['csv'],
-        key="log"
-    )
-    
-    if uploaded_file is not None:
-        col1, col2 = st.columns(2)
-        with col1:
-            load_data = st.button("📂 ファイルを読み込み", key="load_log")
-        
-        if load_data or "log_df" in st.session_state:
-            try:
-                if load_data:
-                    df, error = safe_read_csv(uploaded_file)
-                    if error:
-                        st.error(f"❌ {error}")
-                    else:
-                        st.session_state.log_df = df
-                        
-                        # インデックス対象カラムの確認
-                        required_columns = [
-                            'SUB_LOT_TYPE', 'LOT_ID', 'EQP_ID', 'STIME', 
-                            'PROD_GRP_ID', 'PROD_TYPE', 'OPE_NO', 'RUN_TIME', 'WAIT_TIME'
-                        ]
-                        existing_columns = [col for col in required_columns if col in df.columns]
-                        st.session_state.log_index_columns = existing_columns
-                        
-                        st.success(f"✅ データを読み込みました（{len(df)}行, {len(df.columns)}列）")
-                
-                if "log_df" in st.session_state:
-                    df = st.session_state.log_df
-                    st.dataframe(df.head(), use_container_width=True)
-                    
-                    if hasattr(st.session_state, 'log_index_columns') and st.session_state.log_index_columns:
-                        st.info(f"インデックス対象カラム: {', '.join(st.session_state.log_index_columns)}")
-                    
-                    with col2:
-                        if st.button("💾 処理実績をDBに保存", key="save_log"):
-                            if save_data_to_db(df, "LOG", replace=True):
-                                # インデックス作成
-                                if create_indexes_for_log_table():
-                                    st.success("✅ テーブル 'LOG' に保存し、インデックスを作成しました")
-                                else:
-                                    st.success("✅ テーブル 'LOG' に保存しました（インデックス作成は失敗）")
-                                st.rerun()
-                        
-            except Exception as e:
-                st.error(f"❌ 処理中にエラーが発生しました: {str(e)}")
-                st.error("ブラウザを更新して再度お試しください")
+    show_log_ingest("LOG", "処理実績")
 
 with tab5:
     st.subheader("投入計画の読み込み")
@@ -500,6 +849,11 @@ with tab7:
                 st.error(f"❌ 処理中にエラーが発生しました: {str(e)}")
                 st.error("ブラウザを更新して再度お試しください")
 
+with tab8:
+    st.subheader("処理実績（可視化用）の読み込み")
+    st.caption("製造情報可視化アプリ（vis_b）が使用する LOG2 テーブル（LOT_ID, OPE_START_DATETIME, WAIT_TIME, EQP_ID, OPE_NO, SUB_LOT_TYPE, MRC, DeviceGp）を読み込みます")
+    show_log_ingest("LOG2", "処理実績（可視化用）")
+
 # 機能2: テーブル削除機能
 st.markdown("---")
 st.header("🗑️DBテーブル管理")
@@ -547,6 +901,88 @@ if existing_tables:
                 st.rerun()
             else:
                 st.error("❌ テーブル削除に失敗しました")
+
+    # 型付き圧縮形式への変換
+    st.subheader("型付き圧縮形式への変換")
+    st.caption("LOG / LOG2 を日時の整数化・IDの辞書化を行った形式に変換します。元の文字列表現は <テーブル名>_DECODED ビューで参照できます")
+    untyped_tables = get_untyped_log_tables(existing_tables)
+    if untyped_tables:
+        convert_targets = st.multiselect(
+            "変換するテーブルを選択してください",
+            untyped_tables,
+            key="convert_targets"
+        )
+        if convert_targets and st.button("🗜️ 選択したテーブルを変換", key="convert_typed"):
+            if convert_tables_to_typed(convert_targets):
+                st.success(f"✅ {len(convert_targets)}個のテーブルを変換しました")
+                st.session_state.existing_tables = get_existing_tables()
+    else:
+        st.info("変換対象のテーブルはありません")
+
+    # インデックス最適化
+    st.subheader("インデックス最適化")
+    st.caption("可視化・パラメータ推定で実際に発行するクエリの実行計画（EXPLAIN QUERY PLAN）を調べ、複合・部分インデックスを作成して前後の実行時間を比較します。計測で高速化したインデックスのみ残します")
+    if st.button("🧭 インデックスを最適化", key="optimize_indexes"):
+        report, adopted, unused = optimize_log_indexes()
+        if report is not None and report.empty:
+            st.info("対象となるLOG / LOG2テーブルがありません")
+        elif report is not None:
+            st.dataframe(report, use_container_width=True)
+            if adopted:
+                st.success(f"✅ 採用したインデックス: {', '.join(adopted)}")
+            else:
+                st.info("新たに採用されたインデックスはありません")
+            if unused:
+                st.info(f"💡 どのクエリでも使われていないインデックス（削除候補）: {', '.join(unused)}")
+
+    # 分析用Parquetデータセット
+    st.subheader("分析用Parquetデータセット")
+    st.caption(f"{' / '.join(ANALYTICS_TABLES)} の保存時に自動で作成されます。DB外で作成されたテーブルはここでデータセットを作り直せます")
+    analytics_tables = [t for t in ANALYTICS_TABLES if t in existing_tables]
+    if analytics_tables:
+        export_targets = st.multiselect(
+            "データセットを作り直すテーブルを選択してください",
+            analytics_tables,
+            key="export_targets"
+        )
+        if export_targets and st.button("🗂️ 選択したテーブルのデータセットを作成", key="export_parquet"):
+            rebuild_parquet_datasets(export_targets)
+    else:
+        st.info(f"対象となる {' / '.join(ANALYTICS_TABLES)} テーブルがありません")
+
+    # 統計キューブ
+    st.subheader("統計キューブ")
+    st.caption(f"{CUBE_SOURCE_TABLE} の待ち時間を年月・DeviceGp・EQP_ID別に集計した {CUBE_TABLE} を作成します。"
+               f"「処理実績（可視化用）」タブで {CUBE_SOURCE_TABLE} を保存すると自動で更新されます（置換時は全月、追加時は追加された月のみ）。"
+               "DB外で作成された場合は再作成してください")
+    if CUBE_SOURCE_TABLE in existing_tables:
+        if st.button("📦 統計キューブを再作成", key="rebuild_cube"):
+            updated = rebuild_stats_cube()
+            if updated is not None:
+                st.success(f"✅ 統計キューブを作成しました: {updated}ヶ月分")
+                st.session_state.existing_tables = get_existing_tables()
+    else:
+        st.info(f"集計元の {CUBE_SOURCE_TABLE} テーブルがありません")
+
+    # 品質基準表（FlowInfo）の比較
+    st.subheader("品質基準表の比較")
+    st.caption("2つの FlowInfo テーブルの間で、装置ごとの処理可能な TYPE・OPE_NO の追加・削除と INHIBIT の変更をDB上で比較します")
+    flowinfo_tables = sorted((t for t in existing_tables if t.startswith("FlowInfo_")), reverse=True)
+    if len(flowinfo_tables) >= 2:
+        col1, col2 = st.columns(2)
+        with col1:
+            diff_old = st.selectbox("比較元", flowinfo_tables, index=1, key="diff_old")
+        with col2:
+            diff_new = st.selectbox("比較先", flowinfo_tables, index=0, key="diff_new")
+        if diff_old != diff_new and st.button("🔍 差分を表示", key="diff_flowinfo"):
+            show_flowinfo_diff(diff_old, diff_new)
+    else:
+        st.info("比較するには FlowInfo テーブルが2つ以上必要です")
+
+    if st.button("🧹 空き領域を解放（VACUUM）", key="vacuum_db"):
+        with st.spinner("VACUUMを実行中..."):
+            if vacuum_database():
+                st.success("✅ 空き領域を解放しました")
 else:
     st.info("📋 現在データベースにテーブルは存在しません")
 
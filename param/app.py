@@ -1,7 +1,12 @@
 import streamlit as st
 import os
-import pickle
 import sys
+import time
+
+# 共通モジュール(washi)を読み込めるようにルートディレクトリをパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from washi.jobs import ensure_worker, submit_job, validate_name
+from washi.jobview import show_job_status
 
 # ページ設定
 st.set_page_config(
@@ -10,6 +15,9 @@ st.set_page_config(
     layout="wide"
 )
 
+# ジョブの種別
+JOB_KIND = "param_estimate"
+
 def main():
     st.title("🔧 パラメータ推定")
     st.markdown("---")
@@ -71,64 +79,40 @@ def main():
             st.write("ファイルが設定されています。パラメータ推定を実行できます。")
         
         with col2:
+            output_name = st.text_input("出力ファイル名（拡張子なし）", value="parameter")
+            incremental = st.checkbox(
+                "🔁 差分更新（前回の推定以降に追加されたLOGのみ反映）", value=False,
+                help="同じ出力ファイル名の前回の統計量（.stats.pkl）に追加分のみを加算します。分位点は近似値（誤差1%以内）になります。参照実装で集計するため、param_enc で推定済みのファイルには使用できません（別の出力ファイル名を指定してください）。"
+            )
             if st.button("🚀 パラメータ推定", type="primary"):
                 try:
-                    # プログレスバーの表示
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    status_text.text("パラメータ推定モジュールをインポート中...")
-                    progress_bar.progress(20)
-                    
-                    # param_encモジュールのインポート
-                    try:
-                        import param_enc
-                        status_text.text("パラメータ推定を実行中...")
-                        progress_bar.progress(50)
-                        
-                        # パラメータ推定の実行
-                        parameter = param_enc.param_estimate(st.session_state.file_path)
-                        
-                        status_text.text("結果を保存中...")
-                        progress_bar.progress(80)
-                        
-                        # 結果をloadフォルダに保存
-                        output_path = os.path.join(load_folder, "parameter.pkl")
-                        with open(output_path, 'wb') as f:
-                            pickle.dump(parameter, f)
-                        
-                        progress_bar.progress(100)
-                        status_text.text("完了!")
-                        
-                        st.success("✅ パラメータ推定が正常に完了しました！")
-                        st.info(f"📁 結果は以下に保存されました: {output_path}")
-                        
-                        # 結果の簡単な表示（可能な場合）
-                        if hasattr(parameter, '__len__') and len(parameter) > 0:
-                            st.write("**推定されたパラメータの概要:**")
-                            if isinstance(parameter, dict):
-                                st.json(parameter)
-                            elif hasattr(parameter, 'shape'):
-                                st.write(f"- 形状: {parameter.shape}")
-                                st.write(f"- データ型: {type(parameter).__name__}")
-                            else:
-                                st.write(f"- データ型: {type(parameter).__name__}")
-                                st.write(f"- 値: {str(parameter)[:200]}...")
-                    
-                    except ImportError as e:
-                        st.error(f"❌ param_encモジュールのインポートに失敗しました: {str(e)}")
-                        st.info("param_enc.pyまたはparam_enc.pydファイルがpythonパスに存在することを確認してください。")
-                    
-                    except Exception as e:
-                        st.error(f"❌ パラメータ推定中にエラーが発生しました: {str(e)}")
-                        st.info("詳細なエラー情報:")
-                        st.code(f"エラータイプ: {type(e).__name__}\nエラーメッセージ: {str(e)}")
+                    # 画面とは別のプロセス（ジョブワーカー）で実行する
+                    name = validate_name(output_name or "parameter")
+                    job_id = submit_job(JOB_KIND, {
+                        "file_path": os.path.abspath(st.session_state.file_path),
+                        "load_folder": os.path.abspath(load_folder),
+                        "name": name,
+                        "module_dir": os.path.dirname(os.path.abspath(__file__)),
+                        "incremental": incremental,
+                    }, label=f"{os.path.basename(st.session_state.file_path)} → {name}.pkl")
+                    ensure_worker()
+                    st.success(f"✅ パラメータ推定をジョブ #{job_id} として登録しました。画面を閉じても処理は続きます。")
                 
                 except Exception as e:
-                    st.error(f"❌ 予期しないエラーが発生しました: {str(e)}")
+                    st.error(f"❌ ジョブの登録に失敗しました: {str(e)}")
     else:
         st.warning("⚠️ まず「データ指定ステップ」でファイルを設定してください。")
     
+    # ジョブの状態表示
+    st.markdown("---")
+    st.header("📋 ジョブの状態")
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        st.button("🔄 状態を更新")
+    with col2:
+        auto_refresh = st.checkbox("実行中は自動更新する", value=True)
+    active = show_job_status(JOB_KIND)
+    
     # サイドバーに情報表示
     with st.sidebar:
         st.header("📋 アプリ情報")
@@ -140,6 +124,8 @@ def main():
         
         **出力:**
         - parameter.pkl (loadフォルダに保存)
+        
+        パラメータ推定はバックグラウンドのジョブとして実行されます。
         """)
         
         if st.session_state.file_selected:
@@ -174,5 +160,10 @@ def main():
         else:
             st.write("フォルダが見つかりません")
 
+    # 待機中・実行中のジョブがあれば一定間隔で再表示する
+    if active and auto_refresh:
+        time.sleep(2)
+        st.rerun()
+
 if __name__ == "__main__":
     main()
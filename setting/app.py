@@ -1,12 +1,33 @@
 import streamlit as st
 import sqlite3
 import pandas as pd
+import os
 import re
+import sys
 from typing import Dict, List, Tuple, Set
 
+# 共通モジュール(washi)を読み込めるようにルートディレクトリをパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from washi.equipment import (
+    RECORD_COLUMNS, EquipmentIndex, StoredEquipmentIndex, filter_records, has_capability_index, page_count,
+    page_key
+)
+from washi.generalize import (
+    CHANGE_COLUMN, CHANGE_ENABLED, CHANGE_INHIBITED, CHANGE_NONE, RULE_ACTIONS,
+    describe_rule, expand_rules, flow_steps, make_rule, mark_changes, parse_list, settings_to_csv
+)
+
+DB_PATH = './load/SONY.db'
+
+# 設備一覧・既存レコードの1ページあたりの行数（画面の部品数を一定に保つ）
+PAGE_SIZE = 50
+
+# 一括設定の結果として画面に表示する行数（全件はCSVで出力）
+PREVIEW_ROWS = 1_000
+
 # データベース接続
 def get_db_connection():
-    return sqlite3.connect('./load/SONY.db')
+    return sqlite3.connect(DB_PATH)
 
 # FlowInfoテーブル一覧を取得
 def get_flowinfo_tables():
@@ -21,62 +42,118 @@ def get_flowinfo_tables():
 @st.cache_data
 def load_and_preprocess_data(table_name: str):
     conn = get_db_connection()
+    stored = has_capability_index(conn, table_name)
     
-    # 必要なカラムのみ読み込み
-    query = f"""
-    SELECT TYPE, OPE_NO, EQP_GRP_CONV, ALL_EQP_ID, INHIBIT_EQP_ID, EQP_ID 
-    FROM {table_name}
-    WHERE TYPE IS NOT NULL AND OPE_NO IS NOT NULL
-    """
+    if stored:
+        # 索引がある場合は工程の選択肢に使う (TYPE, OPE_NO, EQP_GRP_CONV) の組み合わせのみ読み込む
+        query = f"""
+        SELECT DISTINCT TYPE, OPE_NO, EQP_GRP_CONV
+        FROM {table_name}
+        WHERE TYPE IS NOT NULL AND OPE_NO IS NOT NULL
+        """
+    else:
+        # 必要なカラムのみ読み込み
+        query = f"""
+        SELECT TYPE, OPE_NO, EQP_GRP_CONV, ALL_EQP_ID, INHIBIT_EQP_ID, EQP_ID 
+        FROM {table_name}
+        WHERE TYPE IS NOT NULL AND OPE_NO IS NOT NULL
+        """
     df = pd.read_sql_query(query, conn)
     conn.close()
     
-    # 1. 全設備とそれに紐づくTYPE、OPE_NO情報の作成
-    equipment_mapping = {}
+    if stored:
+        # データ管理アプリでFlowInfo保存時に作成された装置索引をクエリで参照する
+        equipment_index = StoredEquipmentIndex(os.path.abspath(DB_PATH), table_name)
+    else:
+        # 装置別・設備グループ別・使用禁止装置の索引を一括で作成（行ごとの分割は行わない）
+        equipment_index = EquipmentIndex(df)
     
-    for _, row in df.iterrows():
-        type_val = row['TYPE']
-        ope_no = row['OPE_NO']
-        all_eqp = row['ALL_EQP_ID'] if pd.notna(row['ALL_EQP_ID']) else ""
-        
-        # スペース区切りで設備を分割
-        equipment_list = all_eqp.split() if all_eqp else []
-        
-        for equipment in equipment_list:
-            if equipment not in equipment_mapping:
-                equipment_mapping[equipment] = []
-            equipment_mapping[equipment].append({
-                'TYPE': type_val,
-                'OPE_NO': ope_no,
-                'EQP_GRP_CONV': row['EQP_GRP_CONV'],
-                'INHIBIT_EQP_ID': row['INHIBIT_EQP_ID'] if pd.notna(row['INHIBIT_EQP_ID']) else "",
-                'EQP_ID': row['EQP_ID'] if pd.notna(row['EQP_ID']) else ""
-            })
+    return equipment_index, df
+
+# 一括設定（ルールを装置×工程に展開して1つの設定ファイルに出力）
+def bulk_settings(equipment_index, df, table_name):
+    if 'bulk_rules' not in st.session_state:
+        st.session_state.bulk_rules = []
     
-    # 2. EQP_GRP_CONVに紐づくALL_EQP_ID情報の作成
-    group_equipment_mapping = {}
-    for _, row in df.iterrows():
-        group_name = row['EQP_GRP_CONV']
-        all_eqp = row['ALL_EQP_ID'] if pd.notna(row['ALL_EQP_ID']) else ""
-        equipment_list = all_eqp.split() if all_eqp else []
-        
-        if group_name not in group_equipment_mapping:
-            group_equipment_mapping[group_name] = set()
-        group_equipment_mapping[group_name].update(equipment_list)
+    st.subheader("ルールの追加")
+    steps = flow_steps(df)
     
-    # 3. 各TYPE、OPE_NOにおける設備の使用状況情報の作成
-    equipment_usage = {}
-    for _, row in df.iterrows():
-        type_val = row['TYPE']
-        ope_no = row['OPE_NO']
-        inhibit_eqp = row['INHIBIT_EQP_ID'] if pd.notna(row['INHIBIT_EQP_ID']) else ""
-        inhibit_list = inhibit_eqp.split() if inhibit_eqp else []
-        
-        key = (type_val, ope_no)
-        if key not in equipment_usage:
-            equipment_usage[key] = set(inhibit_list)
+    col1, col2 = st.columns(2)
+    with col1:
+        rule_group = st.selectbox("設備グループ", equipment_index.groups(), key="rule_group")
+        group_equipment = equipment_index.group_equipment(rule_group) if rule_group else []
+        rule_equipment = st.multiselect(
+            f"対象の設備（未選択の場合は全{len(group_equipment)}台）", group_equipment, key="rule_equipment"
+        )
+        rule_contains = st.text_input("設備名でフィルタ", "", key="rule_contains")
+        rule_new_equipment = st.text_input("新規設備名（スペース・カンマ区切りで複数可）", "", key="rule_new_equipment")
+    with col2:
+        rule_types = st.multiselect("TYPE（未選択の場合は全TYPE）", sorted(steps['TYPE'].unique()), key="rule_types")
+        rule_ope_text = st.text_area("OPE_NO（スペース・カンマ・改行区切り。空欄の場合は全工程）", "", key="rule_ope_nos")
+        rule_action = st.radio(
+            "操作", list(RULE_ACTIONS), format_func=RULE_ACTIONS.get, key="rule_action"
+        )
+    
+    if st.button("➕ ルールを追加", key="add_rule") and rule_group:
+        ope_nos = parse_list(rule_ope_text)
+        unknown = sorted(set(ope_nos) - set(steps['OPE_NO']))
+        if unknown:
+            st.warning(f"⚠️ FlowInfoにないOPE_NOは対象になりません: {', '.join(unknown[:10])}{' ...' if len(unknown) > 10 else ''}")
+        st.session_state.bulk_rules.append(make_rule(
+            rule_group, rule_action, equipment=rule_equipment, contains=rule_contains,
+            new_equipment=parse_list(rule_new_equipment), types=rule_types, ope_nos=ope_nos,
+        ))
+        st.success("✅ ルールを追加しました")
+    
+    # 登録済みのルール（後のルールが優先）
+    rules = st.session_state.bulk_rules
+    if not rules:
+        st.info("💡 ルールを追加すると、対象の設備×工程の設定をまとめて作成できます")
+        return
     
-    return equipment_mapping, group_equipment_mapping, equipment_usage, df
+    st.subheader("登録済みのルール")
+    st.caption("同じ設備・TYPE・OPE_NOに複数のルールが当たる場合は、後のルールが優先されます")
+    st.dataframe(
+        pd.DataFrame({"No": range(1, len(rules) + 1), "内容": [describe_rule(rule) for rule in rules]}),
+        use_container_width=True, hide_index=True
+    )
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        remove_numbers = st.multiselect("削除するルール", list(range(1, len(rules) + 1)), key="remove_rules")
+    with col2:
+        st.write("")
+        if st.button("🗑️ 削除", key="delete_rules") and remove_numbers:
+            st.session_state.bulk_rules = [rule for i, rule in enumerate(rules, start=1) if i not in remove_numbers]
+            st.rerun()
+    
+    # ルールを展開し、現在のFlowInfoと比較
+    settings = expand_rules(rules, equipment_index.group_equipment, steps)
+    current = equipment_index.capability_frame(settings['設備名'].unique())
+    settings = mark_changes(settings, current)
+    counts = settings[CHANGE_COLUMN].value_counts()
+    
+    st.subheader("一括設定の結果")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("対象設備", f"{settings['設備名'].nunique():,}台")
+    col2.metric(CHANGE_ENABLED, f"{counts.get(CHANGE_ENABLED, 0):,}件")
+    col3.metric(CHANGE_INHIBITED, f"{counts.get(CHANGE_INHIBITED, 0):,}件")
+    col4.metric(CHANGE_NONE, f"{counts.get(CHANGE_NONE, 0):,}件")
+    
+    only_changes = st.checkbox("現在のFlowInfoから変わる行のみ出力する", value=True, key="bulk_only_changes")
+    output_df = settings[settings[CHANGE_COLUMN] != CHANGE_NONE] if only_changes else settings
+    st.dataframe(output_df.head(PREVIEW_ROWS), use_container_width=True, hide_index=True)
+    if len(output_df) > PREVIEW_ROWS:
+        st.caption(f"先頭{PREVIEW_ROWS:,}行を表示しています（全{len(output_df):,}行）")
+    
+    if output_df.empty:
+        st.warning("出力するデータがありません。ルールの対象を確認してください。")
+    else:
+        st.download_button(
+            label="設定ファイル（CSV）をダウンロード",
+            data=settings_to_csv(output_df),
+            file_name=f"equipment_settings_{table_name}.csv",
+            mime="text/csv"
+        )
 
 # メイン関数
 def main():
@@ -91,13 +168,19 @@ def main():
     selected_table = st.selectbox("使用するFlowInfoテーブルを選択してください", tables)
     
     # データの読み込み
-    equipment_mapping, group_equipment_mapping, equipment_usage, df = load_and_preprocess_data(selected_table)
+    equipment_index, df = load_and_preprocess_data(selected_table)
+    
+    # 設定モードの選択（一括設定は複数装置にルールでまとめて適用する）
+    mode = st.radio("設定モード", ["単体設定", "一括設定（ルール）"], horizontal=True)
+    if mode == "一括設定（ルール）":
+        bulk_settings(equipment_index, df, selected_table)
+        return
     
     # セッション状態の初期化
     if 'selected_equipment' not in st.session_state:
         st.session_state.selected_equipment = None
     if 'equipment_data' not in st.session_state:
-        st.session_state.equipment_data = []
+        st.session_state.equipment_data = pd.DataFrame(columns=RECORD_COLUMNS)
     if 'new_records' not in st.session_state:
         st.session_state.new_records = []
     
@@ -105,69 +188,45 @@ def main():
     equipment_type = st.radio("設備タイプを選択してください", ["新規設備", "既存設備"])
     
     # 設備グループの選択
-    available_groups = sorted(list(group_equipment_mapping.keys()))
+    available_groups = equipment_index.groups()
     selected_group = st.selectbox("設備グループを選択してください", available_groups)
     
     if selected_group:
-        # 選択された設備グループに紐づく設備の表示
-        group_equipment = sorted(list(group_equipment_mapping[selected_group]))
-        
-        # 設備名でのフィルタ
+        # 設備名でのフィルタ（絞り込みとページ分割は索引側で行う）
         filter_text = st.text_input("設備名でフィルタ", "")
-        if filter_text:
-            group_equipment = [eq for eq in group_equipment if filter_text in eq]
+        _, total = equipment_index.group_equipment_page(selected_group, filter_text, limit=0)
         
-        # 設備一覧を表形式で表示
-        if group_equipment:
+        # 設備一覧を表形式で表示（1ページ分のみ）
+        if total:
             st.subheader("設備一覧")
+            n_pages = page_count(total, PAGE_SIZE)
+            page = st.number_input(f"ページ（全{n_pages}ページ, {total:,}台）", min_value=1, max_value=n_pages,
+                                   value=1, key=f"equipment_page_{selected_group}_{filter_text}")
+            group_equipment, _ = equipment_index.group_equipment_page(
+                selected_group, filter_text, (page - 1) * PAGE_SIZE, PAGE_SIZE
+            )
+            equipment_df = pd.DataFrame({"設備名": group_equipment, "Fab": 1, "Bay": 1})
+            st.dataframe(equipment_df, use_container_width=True, hide_index=True)
             
-            equipment_data = []
-            for equipment in group_equipment:
-                equipment_data.append({
-                    "設備名": equipment,
-                    "Fab": 1,
-                    "Bay": 1
-                })
-            
-            equipment_df = pd.DataFrame(equipment_data)
-            
-            # データフレームを表示し、選択された行を取得
-            for idx, row in equipment_df.iterrows():
-                col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
-                
-                with col1:
-                    st.write(row['設備名'])
-                with col2:
-                    st.write(row['Fab'])
-                with col3:
-                    st.write(row['Bay'])
-                with col4:
-                    if st.button(f"コピー", key=f"copy_{idx}"):
-                        st.session_state.selected_equipment = row['設備名']
-                        # 選択された設備のデータを準備
-                        if row['設備名'] in equipment_mapping:
-                            equipment_details = []
-                            for detail in equipment_mapping[row['設備名']]:
-                                # INHIBITの判定
-                                key = (detail['TYPE'], detail['OPE_NO'])
-                                inhibit_equipment = equipment_usage.get(key, set())
-                                is_inhibited = row['設備名'] in inhibit_equipment
-                                
-                                equipment_details.append({
-                                    '設備名': row['設備名'],
-                                    'TYPE': detail['TYPE'],
-                                    'OPE_NO': detail['OPE_NO'],
-                                    'INHIBIT': is_inhibited
-                                })
-                            st.session_state.equipment_data = equipment_details
-                        st.session_state.new_records = []
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                copy_source = st.selectbox("コピー元の設備", group_equipment, key=f"copy_source_{selected_group}_{filter_text}_{page}")
+            with col2:
+                if st.button("コピー", key="copy_equipment"):
+                    st.session_state.selected_equipment = copy_source
+                    # 選択された設備のデータを準備（INHIBITは索引作成時に判定済み）
+                    equipment_details = equipment_index.equipment_frame(copy_source)
+                    if not equipment_details.empty:
+                        st.session_state.equipment_data = equipment_details
+                    st.session_state.new_records = []
         
         # 選択された設備の詳細表示
         if st.session_state.selected_equipment:
             st.subheader(f"選択された設備: {st.session_state.selected_equipment}")
             
             # 既存レコードの表示・編集
-            if st.session_state.equipment_data:
+            records = st.session_state.equipment_data
+            if not records.empty:
                 st.write("**既存レコード:**")
                 
                 # フィルタリングオプション
@@ -176,7 +235,7 @@ def main():
                 
                 with filter_col1:
                     # TYPEフィルタ
-                    available_types_in_records = sorted(list(set([record['TYPE'] for record in st.session_state.equipment_data])))
+                    available_types_in_records = sorted(records['TYPE'].unique())
                     selected_type_filter = st.selectbox(
                         "TYPE フィルタ", 
                         ["すべて"] + available_types_in_records, 
@@ -185,7 +244,7 @@ def main():
                 
                 with filter_col2:
                     # OPE_NOフィルタ
-                    available_ope_nos_in_records = sorted(list(set([record['OPE_NO'] for record in st.session_state.equipment_data])))
+                    available_ope_nos_in_records = sorted(records['OPE_NO'].unique())
                     selected_ope_no_filter = st.selectbox(
                         "OPE_NO フィルタ", 
                         ["すべて"] + available_ope_nos_in_records, 
@@ -200,45 +259,33 @@ def main():
                         key="inhibit_filter"
                     )
                 
-                # フィルタリング実行
-                filtered_records = []
-                for idx, record in enumerate(st.session_state.equipment_data):
-                    # TYPEフィルタ
-                    if selected_type_filter != "すべて" and record['TYPE'] != selected_type_filter:
-                        continue
-                    
-                    # OPE_NOフィルタ
-                    if selected_ope_no_filter != "すべて" and record['OPE_NO'] != selected_ope_no_filter:
-                        continue
-                    
-                    # INHIBITフィルタ
-                    if selected_inhibit_filter == "有効 (True)" and not record['INHIBIT']:
-                        continue
-                    elif selected_inhibit_filter == "無効 (False)" and record['INHIBIT']:
-                        continue
-                    
-                    filtered_records.append((idx, record))
-                
-                # フィルタリング結果表示
-                st.write(f"**表示中: {len(filtered_records)} / {len(st.session_state.equipment_data)} レコード**")
+                # フィルタリング実行（レコードごとのループは行わない）
+                filtered_records = filter_records(
+                    records,
+                    type_val=None if selected_type_filter == "すべて" else selected_type_filter,
+                    ope_no=None if selected_ope_no_filter == "すべて" else selected_ope_no_filter,
+                    inhibit={"有効 (True)": True, "無効 (False)": False}.get(selected_inhibit_filter),
+                )
                 
-                for original_idx, record in filtered_records:
-                    col1, col2, col3, col4 = st.columns([2, 2, 2, 1])
-                    
-                    with col1:
-                        st.write(record['設備名'])
-                    with col2:
-                        st.write(record['TYPE'])
-                    with col3:
-                        st.write(record['OPE_NO'])
-                    with col4:
-                        # INHIBITチェックボックス
-                        new_inhibit = st.checkbox(
-                            "INHIBIT", 
-                            value=record['INHIBIT'], 
-                            key=f"inhibit_{original_idx}"
-                        )
-                        st.session_state.equipment_data[original_idx]['INHIBIT'] = new_inhibit
+                # フィルタリング結果表示（1ページ分のみ編集表に表示）
+                st.write(f"**表示中: {len(filtered_records)} / {len(records)} レコード**")
+                filter_key = f"{st.session_state.selected_equipment}_{selected_type_filter}_{selected_ope_no_filter}_{selected_inhibit_filter}"
+                n_pages = page_count(len(filtered_records), PAGE_SIZE)
+                page = st.number_input(f"ページ（全{n_pages}ページ）", min_value=1, max_value=n_pages,
+                                       value=1, key=f"record_page_{filter_key}")
+                page_records = filtered_records.iloc[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+                edited = st.data_editor(
+                    page_records,
+                    column_config={"INHIBIT": st.column_config.CheckboxColumn("INHIBIT")},
+                    disabled=["設備名", "TYPE", "OPE_NO"],
+                    hide_index=True,
+                    use_container_width=True,
+                    # 書き戻しでフィルタ結果（ページの行）が変わった場合に前の編集が別の行に適用されないよう、
+                    # キーには表示中の行を含める
+                    key=page_key(f"record_editor_{filter_key}_{page}", page_records.index),
+                )
+                # 編集されたINHIBITを元のレコードに反映（行の対応は元のインデックスで取る）
+                records.loc[page_records.index, 'INHIBIT'] = edited['INHIBIT'].to_numpy(dtype=bool)
             
             # 新規レコード追加セクション
             st.write("**新規レコード追加:**")
@@ -320,14 +367,14 @@ def main():
                     output_data = []
                     
                     # 既存レコードの変更をCSV出力用に準備
-                    for record in st.session_state.equipment_data:
-                        output_data.append({
-                            '設備名': final_equipment_name,
-                            '設備グループ': selected_group,
-                            'TYPE': record['TYPE'],
-                            'OPE_NO': record['OPE_NO'],
-                            'INHIBIT': 1 if record['INHIBIT'] else 0
-                        })
+                    records = st.session_state.equipment_data
+                    output_data.extend(pd.DataFrame({
+                        '設備名': final_equipment_name,
+                        '設備グループ': selected_group,
+                        'TYPE': records['TYPE'],
+                        'OPE_NO': records['OPE_NO'],
+                        'INHIBIT': records['INHIBIT'].astype(int)
+                    }).to_dict('records'))
                     
                     # 新規レコードをCSV出力用に準備
                     for record in st.session_state.new_records:
@@ -1,7 +1,14 @@
 import streamlit as st
 import os
-import pickle
 import sys
+import time
+
+# 共通モジュール(washi)を読み込めるようにルートディレクトリをパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from washi.jobs import ensure_worker, submit_job, validate_name
+from washi.jobview import show_job_status
+from washi.simresult import SIMRES_NAME
+from washi.sweep import SWEEP_PREFIX, list_scenarios, read_summary, sweep_dir
 
 # ページ設定
 st.set_page_config(
@@ -10,6 +17,28 @@ st.set_page_config(
     layout="wide"
 )
 
+# ジョブの種別
+JOB_KIND = "simulation"
+SWEEP_JOB_KIND = "sweep"
+
+def get_scenario_folders(load_folder):
+    """設定CSVを含むフォルダ（loadフォルダとその直下のフォルダ）の一覧を取得（スイープの出力フォルダは除く）"""
+    candidates = [load_folder] + [
+        os.path.join(load_folder, name) for name in sorted(os.listdir(load_folder))
+        if os.path.isdir(os.path.join(load_folder, name)) and not name.startswith(SWEEP_PREFIX)
+    ]
+    return [folder for folder in candidates if list_scenarios(folder)]
+
+def show_simulation_result(job, latest=False):
+    """完了したシミュレーションジョブの結果ファイルを表示"""
+    st.success(f"📁 結果: {job['result_path']}（vis_a で可視化できます）")
+
+def show_sweep_result(job, latest=False):
+    """完了したスイープジョブの比較表を表示（最新のジョブは展開して表示）"""
+    st.success(f"📁 比較表: {job['result_path']}")
+    with st.expander(f"📊 #{job['job_id']} のシナリオ比較", expanded=latest):
+        st.dataframe(read_summary(os.path.dirname(job['result_path'])), use_container_width=True)
+
 def main():
     st.title("🔬 装置汎用化シミュレーション")
     st.markdown("---")
@@ -213,65 +242,24 @@ def main():
             st.write(f"- 装置設定: `{os.path.basename(st.session_state.equipment_path)}`")
         
         with col2:
+            scenario_name = st.text_input("シナリオ名（結果ファイル名）", value=SIMRES_NAME, key="scenario_name")
             if st.button("🚀 シミュレーション実行", type="primary", key="sim_button"):
                 try:
-                    # プログレスバーの表示
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    status_text.text("シミュレーションモジュールをインポート中...")
-                    progress_bar.progress(20)
-                    
-                    # sim_encモジュールのインポート
-                    try:
-                        import sim_enc
-                        status_text.text("シミュレーションを実行中...")
-                        progress_bar.progress(50)
-                        
-                        # シミュレーションの実行
-                        simres = sim_enc.sim(
-                            st.session_state.database_path,
-                            st.session_state.parameter_path,
-                            st.session_state.equipment_path
-                        )
-                        
-                        status_text.text("結果を保存中...")
-                        progress_bar.progress(80)
-                        
-                        # 結果をloadフォルダに保存
-                        output_path = os.path.join(load_folder, "simres.pkl")
-                        with open(output_path, 'wb') as f:
-                            pickle.dump(simres, f)
-                        
-                        progress_bar.progress(100)
-                        status_text.text("完了!")
-                        
-                        st.success("✅ シミュレーションが正常に完了しました！")
-                        st.info(f"📁 結果は以下に保存されました: {output_path}")
-                        
-                        # 結果の簡単な表示（可能な場合）
-                        if hasattr(simres, '__len__') and len(simres) > 0:
-                            st.write("**シミュレーション結果の概要:**")
-                            if isinstance(simres, dict):
-                                st.json(simres)
-                            elif hasattr(simres, 'shape'):
-                                st.write(f"- 形状: {simres.shape}")
-                                st.write(f"- データ型: {type(simres).__name__}")
-                            else:
-                                st.write(f"- データ型: {type(simres).__name__}")
-                                st.write(f"- 値: {str(simres)[:200]}...")
-                    
-                    except ImportError as e:
-                        st.error(f"❌ sim_encモジュールのインポートに失敗しました: {str(e)}")
-                        st.info("sim_enc.pyまたはsim_enc.pydファイルがpythonパスに存在することを確認してください。")
-                    
-                    except Exception as e:
-                        st.error(f"❌ シミュレーション中にエラーが発生しました: {str(e)}")
-                        st.info("詳細なエラー情報:")
-                        st.code(f"エラータイプ: {type(e).__name__}\nエラーメッセージ: {str(e)}")
+                    # 画面とは別のプロセス（ジョブワーカー）で実行する
+                    name = validate_name(scenario_name or SIMRES_NAME)
+                    job_id = submit_job(JOB_KIND, {
+                        "database_path": os.path.abspath(st.session_state.database_path),
+                        "parameter_path": os.path.abspath(st.session_state.parameter_path),
+                        "equipment_path": os.path.abspath(st.session_state.equipment_path),
+                        "load_folder": os.path.abspath(load_folder),
+                        "name": name,
+                        "module_dir": os.path.dirname(os.path.abspath(__file__)),
+                    }, label=f"シナリオ: {name}")
+                    ensure_worker()
+                    st.success(f"✅ シミュレーションをジョブ #{job_id} として登録しました。複数のシナリオを続けて登録できます。")
                 
                 except Exception as e:
-                    st.error(f"❌ 予期しないエラーが発生しました: {str(e)}")
+                    st.error(f"❌ ジョブの登録に失敗しました: {str(e)}")
     else:
         st.warning("⚠️ シミュレーションを実行するには、すべてのデータを設定してください。")
         
@@ -281,6 +269,59 @@ def main():
         st.write(f"- パラメータ: {'✅' if st.session_state.parameter_selected else '❌'}")
         st.write(f"- 装置汎用化設定: {'✅' if st.session_state.equipment_selected else '❌'}")
     
+    st.markdown("---")
+    
+    # スイープ（複数シナリオの並列実行）
+    st.header("🧪 スイープ（複数シナリオの比較）")
+    st.write("フォルダ内の装置汎用化設定CSV（設定アプリの出力）をそれぞれ1シナリオとして並列に実行し、待ち時間の比較表を作成します。")
+    
+    if st.session_state.database_selected and st.session_state.parameter_selected:
+        scenario_folders = get_scenario_folders(load_folder)
+        if scenario_folders:
+            col1, col2 = st.columns([2, 1])
+            
+            with col1:
+                scenario_folder = st.selectbox("設定CSVのフォルダを選択:", scenario_folders, key="sweep_folder")
+                scenarios = list_scenarios(scenario_folder)
+                st.write(f"**シナリオ数: {len(scenarios)}件**（データベース・パラメータは読み取り専用のコピーを共有）")
+                st.write(", ".join(f"`{name}`" for name, _ in scenarios))
+            
+            with col2:
+                sweep_name = st.text_input("スイープ名", value="sweep", key="sweep_name")
+                if st.button("🧪 スイープ実行", type="primary", key="sweep_button"):
+                    try:
+                        sweep_name = validate_name(sweep_name or "sweep")
+                        output_dir = sweep_dir(sweep_name, load_folder)
+                        job_id = submit_job(SWEEP_JOB_KIND, {
+                            "database_path": os.path.abspath(st.session_state.database_path),
+                            "parameter_path": os.path.abspath(st.session_state.parameter_path),
+                            "scenario_dir": os.path.abspath(scenario_folder),
+                            "output_dir": os.path.abspath(output_dir),
+                            "module_dir": os.path.dirname(os.path.abspath(__file__)),
+                        }, label=f"スイープ: {sweep_name}（{len(scenarios)}シナリオ）")
+                        ensure_worker()
+                        st.success(f"✅ スイープをジョブ #{job_id} として登録しました。結果: {output_dir}")
+                    
+                    except Exception as e:
+                        st.error(f"❌ ジョブの登録に失敗しました: {str(e)}")
+        else:
+            st.info("📂 loadフォルダ、またはその直下のフォルダに設定CSVを置いてください。")
+    else:
+        st.warning("⚠️ スイープを実行するには、データベースとパラメータを設定してください。")
+    
+    # ジョブの状態表示
+    st.markdown("---")
+    st.header("📋 ジョブの状態")
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        st.button("🔄 状態を更新")
+    with col2:
+        auto_refresh = st.checkbox("実行中は自動更新する", value=True)
+    active = show_job_status(JOB_KIND, show_simulation_result)
+    
+    st.subheader("🧪 スイープ")
+    active = show_job_status(SWEEP_JOB_KIND, show_sweep_result) or active
+    
     # サイドバーに情報表示
     with st.sidebar:
         st.header("📋 アプリ情報")
@@ -292,7 +333,11 @@ def main():
         4. 「シミュレーション実行」ボタンをクリック
         
         **出力:**
-        - simres.pkl (loadフォルダに保存)
+        - simres.arrow (loadフォルダに保存、Arrow IPC形式)
+        - simres.parts (逐次書き出しに対応したシミュレーションの場合)
+        
+        シミュレーションはバックグラウンドのジョブとして実行され、
+        シナリオ名ごとに結果ファイルが作成されます。
         """)
         
         # 設定状況の表示
@@ -340,5 +385,10 @@ def main():
         else:
             st.write("フォルダが見つかりません")
 
+    # 待機中・実行中のジョブがあれば一定間隔で再表示する
+    if active and auto_refresh:
+        time.sleep(2)
+        st.rerun()
+
 if __name__ == "__main__":
     main()
@@ -7,6 +7,13 @@ import pickle
 import numpy as np
 from datetime import datetime
 import os
+import sys
+import polars as pl
+
+# 共通モジュール(washi)を読み込めるようにルートディレクトリをパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from washi.columnar import list_datasets, polars_to_pandas, scan_dataset
+from washi.simresult import is_complete, is_result_file, is_result_parts, part_files, scan_simres
 
 # ページ設定
 st.set_page_config(
@@ -15,6 +22,43 @@ st.set_page_config(
     layout="wide"
 )
 
+# 除外するOPE_NO
+EXCLUDED_OPE_NO = [
+    "NY_DMY.NY-DMY", "SSATU.1PC-MPC", "SSATU.1PC-MPC2", "SSATU.1PC-WWS",
+    "SSATU.2PC-MPC", "SSATU.2PC-MPC2", "SSATU.2PC-MPC3", "SSATU.MOKUSHIT",
+    "P_WET.P-YLP", "P_WET.P-WWS", "PASS.CHECK", "NYUUKO.NYUUKO-1",
+    "NYUUKO.NYUUKO-2", "NYUUKO.W1-END", "BANK_IN.BANK-IN"
+]
+
+# 可視化に必要な列
+REQUIRED_COLUMNS = [
+    "LOT_ID", "OPE_START_DATETIME", "WAIT_TIME", "EQP_ID",
+    "OPE_NO", "SUB_LOT_TYPE", "MRC", "DeviceGp"
+]
+
+def preprocess_data(df):
+    """データ型変換・フィルタリング・月情報の追加を行う"""
+    # データ型変換
+    df['OPE_START_DATETIME'] = pd.to_datetime(df['OPE_START_DATETIME'])
+    df['WAIT_TIME'] = pd.to_numeric(df['WAIT_TIME'], errors='coerce')
+    
+    # データフィルタリング
+    df_filtered = df[
+        (df['SUB_LOT_TYPE'] == 'P0') & 
+        (df['MRC'] == 'MASTER') & 
+        (~df['OPE_NO'].isin(EXCLUDED_OPE_NO))
+    ].copy()
+    
+    # 月情報を追加
+    df_filtered['年月'] = df_filtered['OPE_START_DATETIME'].dt.to_period('M')
+    
+    # メモリ最適化
+    df_filtered['DeviceGp'] = df_filtered['DeviceGp'].astype('category')
+    df_filtered['EQP_ID'] = df_filtered['EQP_ID'].astype('category')
+    df_filtered['WAIT_TIME'] = df_filtered['WAIT_TIME'].astype('float32')
+    
+    return df_filtered
+
 @st.cache_data
 def load_data_from_pickle(file_path):
     """pklファイルからデータを読み込み、前処理を行う"""
@@ -22,34 +66,67 @@ def load_data_from_pickle(file_path):
         with open(file_path, 'rb') as f:
             df = pickle.load(f)
         
-        # データ型変換
-        df['OPE_START_DATETIME'] = pd.to_datetime(df['OPE_START_DATETIME'])
-        df['WAIT_TIME'] = pd.to_numeric(df['WAIT_TIME'], errors='coerce')
-        
-        # 除外するOPE_NO
-        excluded_ope_no = [
-            "NY_DMY.NY-DMY", "SSATU.1PC-MPC", "SSATU.1PC-MPC2", "SSATU.1PC-WWS",
-            "SSATU.2PC-MPC", "SSATU.2PC-MPC2", "SSATU.2PC-MPC3", "SSATU.MOKUSHIT",
-            "P_WET.P-YLP", "P_WET.P-WWS", "PASS.CHECK", "NYUUKO.NYUUKO-1",
-            "NYUUKO.NYUUKO-2", "NYUUKO.W1-END", "BANK_IN.BANK-IN"
-        ]
-        
-        # データフィルタリング
-        df_filtered = df[
-            (df['SUB_LOT_TYPE'] == 'P0') & 
-            (df['MRC'] == 'MASTER') & 
-            (~df['OPE_NO'].isin(excluded_ope_no))
-        ].copy()
+        return preprocess_data(df)
         
-        # 月情報を追加
-        df_filtered['年月'] = df_filtered['OPE_START_DATETIME'].dt.to_period('M')
+    except Exception as e:
+        st.error(f"データの読み込みに失敗しました: {e}")
+        return None
+
+def p0_master_filter():
+    """P0/MASTERかつ除外工程以外の行を選ぶ条件（読み込み時に適用する）"""
+    return (
+        (pl.col('SUB_LOT_TYPE') == 'P0') &
+        (pl.col('MRC') == 'MASTER') &
+        ~pl.col('OPE_NO').is_in(EXCLUDED_OPE_NO)
+    )
+
+@st.cache_data
+def load_data_from_result(file_path, version=None):
+    """Arrow IPC形式の結果ファイルから必要な列・行のみを読み込み、前処理を行う
+
+    version は逐次書き出し中の結果でキャッシュを更新するためのキー（パート数と完了状態）。
+    """
+    try:
+        # メモリマップで開き、必要な列とP0/MASTER等の行のみを取り出す
+        lf = scan_simres(file_path).filter(p0_master_filter()).select(REQUIRED_COLUMNS)
+        
+        return preprocess_data(polars_to_pandas(lf.collect()))
         
-        # メモリ最適化
-        df_filtered['DeviceGp'] = df_filtered['DeviceGp'].astype('category')
-        df_filtered['EQP_ID'] = df_filtered['EQP_ID'].astype('category')
-        df_filtered['WAIT_TIME'] = df_filtered['WAIT_TIME'].astype('float32')
+    except Exception as e:
+        st.error(f"データの読み込みに失敗しました: {e}")
+        return None
+
+def load_data_from_file(file_path):
+    """拡張子に応じて結果ファイル（Arrow IPC / pkl）を読み込む"""
+    if is_result_parts(file_path):
+        if not part_files(file_path):
+            # まだ1パートも書き出されていない
+            return None
+        return load_data_from_result(file_path, (len(part_files(file_path)), is_complete(file_path)))
+    if is_result_file(file_path):
+        return load_data_from_result(file_path)
+    return load_data_from_pickle(file_path)
+
+def get_parquet_datasets():
+    """可視化に必要な列を持つParquetデータセットの一覧を取得"""
+    datasets = []
+    for name in list_datasets():
+        try:
+            columns = scan_dataset(name).collect_schema().names()
+        except Exception:
+            continue
+        if set(REQUIRED_COLUMNS) <= set(columns):
+            datasets.append(name)
+    return datasets
+
+@st.cache_data
+def load_data_from_parquet(table_name):
+    """Parquetデータセットから必要な列・行のみを読み込み、前処理を行う"""
+    try:
+        # 列の選択とP0/MASTER等の条件はParquetの読み込み時に適用される
+        lf = scan_dataset(table_name).filter(p0_master_filter()).select(REQUIRED_COLUMNS)
         
-        return df_filtered
+        return preprocess_data(polars_to_pandas(lf.collect()))
         
     except Exception as e:
         st.error(f"データの読み込みに失敗しました: {e}")
@@ -108,7 +185,7 @@ def main():
     # データの読み込み方法を選択
     data_source = st.sidebar.radio(
         "データの読み込み方法:",
-        ["--- 選択してください ---", "フォルダ内のファイル", "ファイルアップロード"]
+        ["--- 選択してください ---", "フォルダ内のファイル", "ファイルアップロード", "Parquetデータセット"]
     )
     
     df = None
@@ -130,24 +207,24 @@ def main():
         return
     
     elif data_source == "フォルダ内のファイル":
-        # vis_aフォルダ内のpklファイルを取得
-        pkl_files = []
+        # vis_aフォルダ内の結果ファイル（Arrow IPC / pkl）を取得
+        result_files = []
         vis_a_path = "./load"
         if os.path.exists(vis_a_path):
-            for file in os.listdir(vis_a_path):
-                if file.endswith('.pkl'):
-                    pkl_files.append(file)
+            for file in sorted(os.listdir(vis_a_path)):
+                if file.endswith('.pkl') or is_result_file(file) or is_result_parts(os.path.join(vis_a_path, file)):
+                    result_files.append(file)
         
-        if not pkl_files:
-            st.error("loadフォルダ内にpklファイルが見つかりません。")
+        if not result_files:
+            st.error("loadフォルダ内に結果ファイル（arrow / pkl）が見つかりません。")
             return
         
         # デフォルト選択肢として"選択してください"を追加
-        file_options = ["--- ファイルを選択してください ---"] + pkl_files
+        file_options = ["--- ファイルを選択してください ---"] + result_files
         
         # ファイル選択
         selected_option = st.sidebar.selectbox(
-            "読み込むpklファイルを選択:",
+            "読み込むファイルを選択:",
             file_options,
             index=0
         )
@@ -156,16 +233,22 @@ def main():
             file_path = os.path.join(vis_a_path, selected_option)
             selected_file_info = f"フォルダ内ファイル: {selected_option}"
             
+            # 逐次書き出し中のシミュレーション結果は書き出し済みの分のみ表示する
+            if is_result_parts(file_path) and not is_complete(file_path):
+                st.sidebar.warning(f"⏳ シミュレーション実行中です（書き出し済み: {len(part_files(file_path))}パート）")
+                if st.sidebar.button("🔄 最新の結果を読み込む"):
+                    st.rerun()
+            
             # データ読み込み
             with st.spinner('データを読み込み中...'):
-                df = load_data_from_pickle(file_path)
+                df = load_data_from_file(file_path)
                 if df is not None:
                     st.session_state.data_loaded = True
         else:
-            st.info("📁 フォルダ内のpklファイルを選択してください")
+            st.info("📁 フォルダ内の結果ファイルを選択してください")
             st.markdown(f"""
             **利用可能なファイル:**
-            {chr(10).join([f"- {file}" for file in pkl_files])}
+            {chr(10).join([f"- {file}" for file in result_files])}
             
             **必要な列:**
             - LOT_ID: ロットID
@@ -182,8 +265,8 @@ def main():
     elif data_source == "ファイルアップロード":
         # ファイルアップロード機能
         uploaded_file = st.sidebar.file_uploader(
-            "pklファイルをアップロード:",
-            type=['pkl']
+            "結果ファイルをアップロード:",
+            type=['arrow', 'feather', 'ipc', 'pkl']
         )
         
         if uploaded_file is not None:
@@ -196,7 +279,7 @@ def main():
             
             # データ読み込み
             with st.spinner('アップロードされたデータを読み込み中...'):
-                df = load_data_from_pickle(temp_path)
+                df = load_data_from_file(temp_path)
                 if df is not None:
                     st.session_state.data_loaded = True
             
@@ -204,13 +287,40 @@ def main():
             if os.path.exists(temp_path):
                 os.remove(temp_path)
         else:
-            st.info("📤 pklファイルをアップロードしてください")
+            st.info("📤 結果ファイルをアップロードしてください")
             st.markdown("""
             **アップロード可能なファイル形式:**
+            - `.arrow` / `.feather` / `.ipc` (Arrow IPC形式、必要な列のみ読み込み)
             - `.pkl` (pickle形式)
             """)
             return
     
+    elif data_source == "Parquetデータセット":
+        # loadフォルダ内のParquetデータセット（data アプリで保存）を取得
+        datasets = get_parquet_datasets()
+        
+        if not datasets:
+            st.error("必要な列を持つParquetデータセットが見つかりません。")
+            return
+        
+        selected_dataset = st.sidebar.selectbox(
+            "読み込むデータセットを選択:",
+            ["--- データセットを選択してください ---"] + datasets,
+            index=0
+        )
+        
+        if selected_dataset != "--- データセットを選択してください ---":
+            selected_file_info = f"Parquetデータセット: {selected_dataset}"
+            
+            # データ読み込み
+            with st.spinner('データを読み込み中...'):
+                df = load_data_from_parquet(selected_dataset)
+                if df is not None:
+                    st.session_state.data_loaded = True
+        else:
+            st.info("🗂️ Parquetデータセットを選択してください")
+            return
+    
     if df is None:
         if not st.session_state.data_loaded:
             st.warning("⚠️ データファイルが選択されていません")
@@ -10,6 +10,17 @@ from functools import lru_cache
 import polars as pl
 from typing import Optional, Dict, List
 import gc
+import sys
+
+# 共通モジュール(washi)を読み込めるようにルートディレクトリをパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from washi.columnar import dataset_exists, load_log2_wait_times, polars_to_pandas
+from washi.cube import CUBE_TABLE, cube_exists, cube_has_sketches, load_stats_cube, rollup_stats_from_cube
+from washi.frames import add_year_month, load_log2_polars
+from washi.qtime import STATUS_VIOLATION, applicable_rules, load_log2_steps, load_qtime_rules, qtime_windows, summarize_windows
+from washi.queries import LOG2_MAX_DATE_QUERY, build_log2_date_filter, build_log2_query
+from washi.schema import decode_frame, is_typed_table
+from washi.stats import monthly_wait_stats
 
 # アプリのタイトル設定
 st.set_page_config(page_title="SONY製造情報可視化アプリ", layout="wide")
@@ -48,32 +59,74 @@ data_limit = st.sidebar.selectbox(
     help="大容量データの場合、読み込み上限を設定して高速化できます（最大32GBメモリまで対応）"
 )
 
+# 読み込み方式（polarsで失敗した場合はpandasで読み込む）
+load_engine = st.sidebar.selectbox(
+    "読み込み方式",
+    ["polars（高速）", "pandas（従来）"],
+    index=0,
+    help="polarsは日時変換・絞り込み・型変換をまとめてマルチスレッドで実行します"
+)
+
+# 統計キューブ（data アプリで作成される集計済みテーブル）の使用設定
+use_cube = False
+try:
+    _conn = sqlite3.connect(db_path)
+    _cube_available = cube_exists(_conn)
+    _conn.close()
+except Exception:
+    _cube_available = False
+if _cube_available:
+    use_cube = st.sidebar.checkbox(
+        "📦 集計済みの統計キューブを使用",
+        value=True,
+        help="元データを読み込まずに集計済みの月次統計を表示します（期間は月単位、読み込み上限は適用されません）"
+    )
+
+# 複数月をまとめたランキングはスケッチ付きのキューブでのみ使用できる
+use_rollup = False
+if use_cube:
+    try:
+        use_rollup = cube_has_sketches(db_path)
+    except Exception:
+        use_rollup = False
+
+# 読み込み元の設定（Parquetデータセットがある場合は優先して使用）
+use_parquet = False
+if dataset_exists("LOG2"):
+    use_parquet = st.sidebar.checkbox(
+        "🗂️ Parquetデータセットから読み込む",
+        value=True,
+        help="data アプリで保存された分析用データセットから、必要な列・期間のみを読み込みます"
+    )
+
 # データベースから必要なデータを読み込む（元の仕様）
 @st.cache_data(ttl=3600, show_spinner="データを読み込み中...", max_entries=3)
-def load_data_optimized(period_months="全期間", data_limit=100000):
+def load_data_optimized(period_months="全期間", data_limit=100000, engine="polars（高速）"):
     """元のチャンク読み込み方式を使用"""
     try:
         # データベース接続
         conn = sqlite3.connect(db_path)
         st.sidebar.success(f"✅ データベース接続成功")
         
+        # 型付きスキーマ（数値の日時・待ち時間、辞書化ID）かどうか
+        typed = is_typed_table(conn, "LOG2")
+        if typed:
+            st.sidebar.info("🗜️ 型付き圧縮形式のLOG2を使用します")
+        
         # 期間フィルタの設定
         date_filter = ""
         if period_months != "全期間":
             try:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT MAX(OPE_START_DATETIME) 
-                    FROM LOG2 
-                    WHERE SUB_LOT_TYPE = 'P0' AND MRC = 'MASTER' 
-                    AND OPE_START_DATETIME IS NOT NULL
-                """)
+                cursor.execute(LOG2_MAX_DATE_QUERY)
                 max_date_result = cursor.fetchone()
                 
                 if max_date_result and max_date_result[0]:
                     max_date = max_date_result[0]
+                    if typed:
+                        max_date = pd.to_datetime(max_date, unit='s')
                     st.sidebar.info(f"📅 最新データ日時: {max_date}")
-                    date_filter = f"AND OPE_START_DATETIME >= datetime('{max_date}', '-{period_months} months')"
+                    date_filter = build_log2_date_filter(max_date_result[0], period_months, typed)
                     st.sidebar.info(f"📅 期間フィルタ: 最新データから{period_months}ヶ月")
                     st.sidebar.info(f"🔍 適用されるフィルタ: {date_filter}")
                 else:
@@ -85,33 +138,7 @@ def load_data_optimized(period_months="全期間", data_limit=100000):
         limit_clause = f"LIMIT {data_limit}" if data_limit != "全件" else ""
         
         # 最適化されたSQLクエリ（実際のデータ形式に合わせて修正）
-        query = f"""
-        SELECT 
-            LOT_ID, 
-            OPE_START_DATETIME, 
-            CAST(WAIT_TIME as REAL) as WAIT_TIME, 
-            EQP_ID, 
-            OPE_NO, 
-            SUB_LOT_TYPE, 
-            MRC, 
-            DeviceGp
-        FROM LOG2
-        WHERE SUB_LOT_TYPE = 'P0' 
-        AND MRC = 'MASTER'
-        AND WAIT_TIME IS NOT NULL
-        AND WAIT_TIME != ''
-        AND WAIT_TIME != '0'
-        AND CAST(WAIT_TIME as REAL) > 0
-        AND DeviceGp IS NOT NULL
-        AND DeviceGp != ''
-        AND EQP_ID IS NOT NULL
-        AND EQP_ID != ''
-        AND OPE_START_DATETIME IS NOT NULL
-        AND OPE_START_DATETIME != ''
-        {date_filter}
-        ORDER BY ROWID DESC
-        {limit_clause}
-        """
+        query = build_log2_query(typed, date_filter, limit_clause)
         
         st.sidebar.info(f"🔍 読み込み上限: {data_limit}件" if data_limit != "全件" else f"🔍 読み込み上限: {data_limit}")
         
@@ -121,6 +148,23 @@ def load_data_optimized(period_months="全期間", data_limit=100000):
         else:
             st.sidebar.info("🔍 全期間でデータを取得します")
         
+        # polarsでバッチごとに変換して読み込み（失敗時は従来のpandas方式）
+        if engine == "polars（高速）":
+            try:
+                start_time = datetime.now()
+                df = load_log2_polars(conn, query, typed)
+                conn.close()
+                elapsed = (datetime.now() - start_time).total_seconds()
+                if df.empty:
+                    st.sidebar.warning("⚠️ データが見つかりませんでした")
+                    return pd.DataFrame()
+                st.sidebar.success(f"✅ polars読み込み完了: {len(df):,}件 ({elapsed:.1f}秒)")
+                st.sidebar.info(f"📅 実際のデータ期間: {df['OPE_START_DATETIME'].min()} ～ {df['OPE_START_DATETIME'].max()}")
+                return df
+            except Exception as polars_error:
+                print(f"[DEBUG] polars読み込みエラー: {polars_error}")
+                st.sidebar.warning(f"⚠️ polarsでの読み込みに失敗したため従来方式で読み込みます: {polars_error}")
+        
         # チャンク読み込みで大量データに対応（進行状況表示付き）
         # データ量に応じてチャンクサイズを動的に調整
         if data_limit == "全件":
@@ -181,12 +225,8 @@ def load_data_optimized(period_months="全期間", data_limit=100000):
                     
                     # チャンクレベルでのデータ処理
                     if not chunk.empty:
-                        # 日時変換とyear_month追加
-                        chunk['OPE_START_DATETIME'] = pd.to_datetime(chunk['OPE_START_DATETIME'], errors='coerce')
-                        chunk['year_month'] = chunk['OPE_START_DATETIME'].dt.strftime('%Y-%m')
-                        
-                        # 有効なデータのみ追加
-                        chunk = chunk.dropna(subset=['OPE_START_DATETIME', 'year_month'])
+                        # 日時変換とyear_month追加（有効なデータのみ）
+                        chunk = add_year_month(chunk, typed)
                         
                         if not chunk.empty:
                             df_chunks.append(chunk)
@@ -239,12 +279,14 @@ def load_data_optimized(period_months="全期間", data_limit=100000):
                 
                 # 日時変換とyear_month追加
                 if not df.empty:
-                    df['OPE_START_DATETIME'] = pd.to_datetime(df['OPE_START_DATETIME'], errors='coerce')
-                    df['year_month'] = df['OPE_START_DATETIME'].dt.strftime('%Y-%m')
-                    df = df.dropna(subset=['OPE_START_DATETIME', 'year_month'])
+                    df = add_year_month(df, typed)
                 
                 st.sidebar.success(f"✅ 一括読み込み完了: {len(df):,}件")
                 
+            # 辞書コードを元のIDに戻す（category型）
+            if typed and not df.empty:
+                df = decode_frame(conn, df)
+                
         except Exception as query_error:
             st.sidebar.error(f"❌ クエリエラー: {query_error}")
             conn.close()
@@ -298,6 +340,29 @@ def load_data_optimized(period_months="全期間", data_limit=100000):
         st.sidebar.error(f"❌ データベースエラー: {e}")
         return pd.DataFrame()
 
+# Parquetデータセットから必要な列・期間のみを読み込む
+@st.cache_data(ttl=3600, show_spinner="データを読み込み中...", max_entries=3)
+def load_data_from_parquet(period_months="全期間", data_limit=100000):
+    """LOG2のParquetデータセットから読み込み（条件はファイル読み込み時に適用）"""
+    try:
+        start_time = datetime.now()
+        df = load_log2_wait_times(
+            period_months=None if period_months == "全期間" else period_months,
+            limit=None if data_limit == "全件" else data_limit
+        )
+        elapsed = (datetime.now() - start_time).total_seconds()
+        
+        if df.empty:
+            st.sidebar.warning("⚠️ Parquetデータセットに条件に一致するデータがありません")
+            return df
+        
+        st.sidebar.success(f"✅ Parquet読み込み完了: {len(df):,}件 ({elapsed:.1f}秒)")
+        st.sidebar.info(f"📅 実際のデータ期間: {df['OPE_START_DATETIME'].min()} ～ {df['OPE_START_DATETIME'].max()}")
+        return df
+    except Exception as e:
+        st.sidebar.error(f"❌ Parquet読み込みエラー: {e}")
+        return pd.DataFrame()
+
 # 高速化された事前計算関数
 @st.cache_data(ttl=3600, show_spinner="統計データを高速計算中...", max_entries=5)
 def calculate_monthly_stats_optimized(df):
@@ -306,54 +371,8 @@ def calculate_monthly_stats_optimized(df):
         if df.empty:
             return pd.DataFrame()
         
-        # NumPyを使用した高速集約
-        stats_list = []
-        
-        # グループ化のためのユニークな組み合わせを事前取得
-        grouped = df.groupby(['year_month', 'DeviceGp', 'EQP_ID'])['WAIT_TIME']
-        
-        for (year_month, device_gp, eqp_id), group in grouped:
-            wait_times = group.values  # NumPy配列で高速化
-            
-            stats_list.append({
-                'year_month': year_month,
-                'DeviceGp': device_gp,
-                'EQP_ID': eqp_id,
-                'count': len(wait_times),
-                'mean': np.mean(wait_times),
-                'median': np.median(wait_times),
-                'q3': np.percentile(wait_times, 75)
-            })
-        
-        device_stats = pd.DataFrame(stats_list)
-        
-        # 全DeviceGp統合版の計算（高速化）
-        all_stats_list = []
-        all_grouped = df.groupby(['year_month', 'EQP_ID'])['WAIT_TIME']
-        
-        for (year_month, eqp_id), group in all_grouped:
-            wait_times = group.values
-            
-            all_stats_list.append({
-                'year_month': year_month,
-                'DeviceGp': 'ALL',
-                'EQP_ID': eqp_id,
-                'count': len(wait_times),
-                'mean': np.mean(wait_times),
-                'median': np.median(wait_times),
-                'q3': np.percentile(wait_times, 75)
-            })
-        
-        all_stats = pd.DataFrame(all_stats_list)
-        
-        # 結合
-        combined_stats = pd.concat([device_stats, all_stats], ignore_index=True)
-        
-        # データ型最適化
-        combined_stats['count'] = combined_stats['count'].astype('int32')
-        combined_stats['mean'] = combined_stats['mean'].astype('float32')
-        combined_stats['median'] = combined_stats['median'].astype('float32')
-        combined_stats['q3'] = combined_stats['q3'].astype('float32')
+        # ソートによる一括集計（DeviceGp別と全DeviceGp統合を同じ並びから計算）
+        combined_stats = monthly_wait_stats(df)
         
         st.sidebar.success(f"✅ 高速事前計算完了: {len(combined_stats):,}件")
         return combined_stats
@@ -362,6 +381,55 @@ def calculate_monthly_stats_optimized(df):
         st.sidebar.error(f"❌ 事前計算エラー: {e}")
         return pd.DataFrame()
 
+# 統計キューブから月次統計を読み込む
+@st.cache_data(ttl=3600, show_spinner="統計キューブを読み込み中...", max_entries=5)
+def load_monthly_stats_from_cube(period_months="全期間"):
+    """集計済みの統計キューブから月次統計を読み込み"""
+    try:
+        stats = load_stats_cube(db_path, None if period_months == "全期間" else period_months)
+        if not stats.empty:
+            st.sidebar.success(f"✅ 統計キューブ読み込み完了: {len(stats):,}件 ({CUBE_TABLE})")
+        return stats
+    except Exception as e:
+        st.sidebar.error(f"❌ 統計キューブ読み込みエラー: {e}")
+        return pd.DataFrame()
+
+# 統計キューブのスケッチを合算して複数月の統計を求める
+@st.cache_data(ttl=3600, show_spinner="スケッチを集約中...", max_entries=10)
+def load_rollup_stats_from_cube(months, device="ALL"):
+    """スケッチの合算による期間全体のEQP_ID別統計（中央値・第三四分位点は近似値）"""
+    try:
+        return rollup_stats_from_cube(db_path, list(months), device)
+    except Exception as e:
+        st.sidebar.error(f"❌ スケッチ集約エラー: {e}")
+        return pd.DataFrame()
+
+# 制約時間（Qtime）の違反を判定する
+@st.cache_data(ttl=3600, show_spinner="Q-timeを判定中...", max_entries=3)
+def load_qtime_results(period_months="全期間"):
+    """制約ごとの違反率と、超過時間の大きい違反区間、判定しなかった製品別の制約数を返す"""
+    try:
+        conn = sqlite3.connect(db_path)
+        try:
+            rules = load_qtime_rules(conn)
+            if rules.is_empty():
+                return pd.DataFrame(), pd.DataFrame(), 0
+            steps = load_log2_steps(conn, None if period_months == "全期間" else period_months)
+        finally:
+            conn.close()
+        # LOG2 に製品TYPEの列がない場合、製品別の制約は判定できない
+        skipped = len(rules) - len(applicable_rules(steps, rules))
+        windows = qtime_windows(steps, rules)
+        summary = polars_to_pandas(summarize_windows(windows))
+        worst = polars_to_pandas(
+            windows.filter(windows["STATUS"] == STATUS_VIOLATION)
+            .sort("EXCESS_SECONDS", descending=True).head(1000)
+        )
+        return summary, worst, skipped
+    except Exception as e:
+        st.sidebar.error(f"❌ Q-time判定エラー: {e}")
+        return pd.DataFrame(), pd.DataFrame(), 0
+
 # 高速化されたプロット作成関数
 @lru_cache(maxsize=32)
 def create_optimized_plot(plot_type: str, data_hash: str, **kwargs):
@@ -468,89 +536,115 @@ def main():
         else:
             detail_status.info(f"📊 高速データ取得中 (期間: {period_months}, 上限: {data_limit})")
         
-        # 最適化されたload_data関数を使用
-        df = load_data_optimized(period_months=period_months, data_limit=data_limit)
-        progress_bar.progress(50)
-        
-        # メモリクリーンアップ
-        gc.collect()
+        # 統計キューブがあれば元データを読み込まずに使用
+        monthly_stats = pd.DataFrame()
+        if use_cube:
+            monthly_stats = load_monthly_stats_from_cube(period_months=period_months)
         
-        if not df.empty:
+        if monthly_stats.empty:
+            # Parquetデータセットを優先し、読み込めない場合はデータベースから読み込む
+            df = pd.DataFrame()
+            if use_parquet:
+                df = load_data_from_parquet(period_months=period_months, data_limit=data_limit)
+            if df.empty:
+                df = load_data_optimized(period_months=period_months, data_limit=data_limit, engine=load_engine)
+            progress_bar.progress(50)
+            
+            # メモリクリーンアップ
+            gc.collect()
+            
+            if df.empty:
+                st.warning("データが読み込めませんでした。データベースの接続とテーブル構造を確認してください。")
+                return
+            
             status_text.text('⚡ 高速統計計算中...')
             detail_status.info("📈 最適化された月次統計を計算中...")
             progress_bar.progress(70)
             
             # 最適化された事前計算実行
             monthly_stats = calculate_monthly_stats_optimized(df)
-            progress_bar.progress(90)
+            del df
+            gc.collect()
+        progress_bar.progress(90)
+        
+        if not monthly_stats.empty:
+            status_text.text('⚡ 高速可視化準備中...')
+            detail_status.info("🎨 高速可視化コンポーネント準備中...")
+            progress_bar.progress(100)
             
-            if not monthly_stats.empty:
-                status_text.text('⚡ 高速可視化準備中...')
-                detail_status.info("🎨 高速可視化コンポーネント準備中...")
-                progress_bar.progress(100)
-                
-                # 少し待ってからクリア
-                import time
-                time.sleep(0.3)  # 時間短縮
-                
-                progress_bar.empty()
-                status_text.empty()
-                detail_status.success("🚀 高速処理完了！")
-                
-                # データの概要を表示
-                unique_devices = df['DeviceGp'].nunique()
-                unique_months = df['year_month'].nunique()
-                unique_eqps = df['EQP_ID'].nunique()
-                date_range = f"{df['year_month'].min()} ～ {df['year_month'].max()}"
+            # 少し待ってからクリア
+            import time
+            time.sleep(0.3)  # 時間短縮
+            
+            progress_bar.empty()
+            status_text.empty()
+            detail_status.success("🚀 高速処理完了！")
+            
+            # データの概要を表示（月次統計から算出するため元データは不要）
+            device_rows = monthly_stats[monthly_stats['DeviceGp'] != 'ALL']
+            total_records = int(monthly_stats.loc[monthly_stats['DeviceGp'] == 'ALL', 'count'].sum())
+            unique_devices = device_rows['DeviceGp'].nunique()
+            unique_months = monthly_stats['year_month'].nunique()
+            unique_eqps = monthly_stats['EQP_ID'].nunique()
+            date_range = f"{monthly_stats['year_month'].min()} ～ {monthly_stats['year_month'].max()}"
+            
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("総レコード数", f"{total_records:,}")
+            with col2:
+                st.metric("デバイス数", unique_devices)
+            with col3:
+                st.metric("機器数", unique_eqps)
+            with col4:
+                st.metric("対象期間", f"{unique_months}ヶ月")
+            
+            st.info(f"📅 データ期間: {date_range}")
+            
+            # デバイスリストを取得
+            devices_list = sorted(device_rows['DeviceGp'].dropna().unique())
+            
+            if devices_list:
+                devices = ["ALL"] + devices_list
                 
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    st.metric("総レコード数", f"{len(df):,}")
-                with col2:
-                    st.metric("デバイス数", unique_devices)
-                with col3:
-                    st.metric("機器数", unique_eqps)
-                with col4:
-                    st.metric("対象期間", f"{unique_months}ヶ月")
+                # サイドバーにデバイス選択を追加
+                selected_device = st.sidebar.selectbox(
+                    "🔍 デバイスを選択してください", 
+                    devices,
+                    index=0,
+                    help="個別のデバイスまたは全デバイス統合（ALL）を選択できます"
+                )
                 
-                st.info(f"📅 データ期間: {date_range}")
+                # パフォーマンス情報表示
+                if total_records > 100000:
+                    st.sidebar.info("⚡ 大容量データ対応：高速化機能が有効です")
                 
-                # デバイスリストを取得
-                devices_list = sorted([d for d in df['DeviceGp'].dropna().unique() if d != 'ALL'])
+                # タブを作成
+                tab1, tab2, tab3, tab4 = st.tabs(["📊 機器待ち時間ランキング表", "📈 機器ランキング推移", "🥧 機器待ち時間割合", "⏱️ Q-time違反"])
                 
-                if devices_list:
-                    devices = ["ALL"] + devices_list
-                    
-                    # サイドバーにデバイス選択を追加
-                    selected_device = st.sidebar.selectbox(
-                        "🔍 デバイスを選択してください", 
-                        devices,
-                        index=0,
-                        help="個別のデバイスまたは全デバイス統合（ALL）を選択できます"
-                    )
+                # 可視化1: 月ごとの各機器の待ち時間のランキング表（最適化版）
+                with tab1:
+                    st.header("📊 月ごとの各機器の待ち時間ランキング")
                     
-                    # パフォーマンス情報表示
-                    if len(df) > 100000:
-                        st.sidebar.info("⚡ 大容量データ対応：高速化機能が有効です")
-                    
-                    # タブを作成
-                    tab1, tab2, tab3 = st.tabs(["📊 機器待ち時間ランキング表", "📈 機器ランキング推移", "🥧 機器待ち時間割合"])
-                    
-                    # 可視化1: 月ごとの各機器の待ち時間のランキング表（最適化版）
-                    with tab1:
-                        st.header("📊 月ごとの各機器の待ち時間ランキング")
+                    # 月の選択
+                    available_months = sorted(monthly_stats[monthly_stats['DeviceGp'] == selected_device]['year_month'].unique())
+                    if available_months:
+                        # スケッチ付きのキューブでは表示期間全体をまとめたランキングも選択できる
+                        rollup_option = "期間全体（スケッチによる近似）"
+                        month_options = available_months + ([rollup_option] if use_rollup else [])
+                        selected_month = st.selectbox("月を選択", month_options, index=len(available_months)-1)
                         
-                        # 月の選択
-                        available_months = sorted(monthly_stats[monthly_stats['DeviceGp'] == selected_device]['year_month'].unique())
-                        if available_months:
-                            selected_month = st.selectbox("月を選択", available_months, index=len(available_months)-1)
-                            
-                            # データ数の閾値設定
-                            min_data_count = st.slider(
-                                "データ数の閾値（これ以下のデータ数の機器はランキングから除外）",
-                                min_value=1, max_value=200, value=50, step=1
-                            )
-                            
+                        # データ数の閾値設定
+                        min_data_count = st.slider(
+                            "データ数の閾値（これ以下のデータ数の機器はランキングから除外）",
+                            min_value=1, max_value=200, value=50, step=1
+                        )
+                        
+                        if selected_month == rollup_option:
+                            # 月ごとのスケッチを合算（元データは読み込まない）
+                            period_stats = load_rollup_stats_from_cube(tuple(available_months), selected_device)
+                            st.caption(f"📦 {available_months[0]} ～ {available_months[-1]} のスケッチを合算（中央値・第三四分位点は相対誤差1%以内の近似値）")
+                            filtered_stats = period_stats[period_stats['count'] >= min_data_count].copy() if not period_stats.empty else period_stats
+                        else:
                             # 最適化されたフィルタリング
                             mask = (
                                 (monthly_stats['year_month'] == selected_month) & 
@@ -558,178 +652,227 @@ def main():
                                 (monthly_stats['count'] >= min_data_count)
                             )
                             filtered_stats = monthly_stats[mask].copy()
+                        
+                        if not filtered_stats.empty:
+                            # 第三四分位点でソート（高速化）
+                            filtered_stats = filtered_stats.sort_values('q3', ascending=False).reset_index(drop=True)
+                            filtered_stats['rank'] = np.arange(1, len(filtered_stats) + 1)  # NumPy使用で高速化
                             
-                            if not filtered_stats.empty:
-                                # 第三四分位点でソート（高速化）
-                                filtered_stats = filtered_stats.sort_values('q3', ascending=False).reset_index(drop=True)
-                                filtered_stats['rank'] = np.arange(1, len(filtered_stats) + 1)  # NumPy使用で高速化
-                                
-                                # 表示用データフレーム（小数点丸めを高速化）
-                                display_df = filtered_stats[['rank', 'EQP_ID', 'q3', 'mean', 'median', 'count']].copy()
-                                display_df[['q3', 'mean', 'median']] = display_df[['q3', 'mean', 'median']].round(2)
-                                
-                                display_df = display_df.rename(columns={
-                                    'rank': 'ランク', 
-                                    'EQP_ID': '機器ID',
-                                    'q3': '待ち時間(第三四分位点)', 
-                                    'mean': '平均待ち時間', 
-                                    'median': '中央値', 
-                                    'count': 'データ数'
-                                })
-                                
-                                st.write(f"**{selected_month}の待ち時間ランキング - デバイス: {selected_device}**")
-                                
-                                # 大量データの場合はページネーション風の表示
-                                if len(display_df) > 100:
-                                    show_all = st.checkbox("全ての機器を表示", value=False)
-                                    if not show_all:
-                                        display_df = display_df.head(100)
-                                        st.info("上位100件を表示中。全件表示するには上のチェックボックスをONにしてください。")
-                                
-                                st.dataframe(display_df, use_container_width=True, height=400)
-                                
-                                st.info(f"表示機器数: {len(filtered_stats)}台 | 最大待ち時間(Q3): {filtered_stats['q3'].max():.2f} | 最小待ち時間(Q3): {filtered_stats['q3'].min():.2f}")
-                            else:
-                                st.warning(f"選択された条件に一致するデータがありません。")
+                            # 表示用データフレーム（小数点丸めを高速化）
+                            display_df = filtered_stats[['rank', 'EQP_ID', 'q3', 'mean', 'median', 'count']].copy()
+                            display_df[['q3', 'mean', 'median']] = display_df[['q3', 'mean', 'median']].round(2)
+                            
+                            display_df = display_df.rename(columns={
+                                'rank': 'ランク', 
+                                'EQP_ID': '機器ID',
+                                'q3': '待ち時間(第三四分位点)', 
+                                'mean': '平均待ち時間', 
+                                'median': '中央値', 
+                                'count': 'データ数'
+                            })
+                            
+                            st.write(f"**{selected_month}の待ち時間ランキング - デバイス: {selected_device}**")
+                            
+                            # 大量データの場合はページネーション風の表示
+                            if len(display_df) > 100:
+                                show_all = st.checkbox("全ての機器を表示", value=False)
+                                if not show_all:
+                                    display_df = display_df.head(100)
+                                    st.info("上位100件を表示中。全件表示するには上のチェックボックスをONにしてください。")
+                            
+                            st.dataframe(display_df, use_container_width=True, height=400)
+                            
+                            st.info(f"表示機器数: {len(filtered_stats)}台 | 最大待ち時間(Q3): {filtered_stats['q3'].max():.2f} | 最小待ち時間(Q3): {filtered_stats['q3'].min():.2f}")
                         else:
-                            st.warning("月次データが見つかりません。")
+                            st.warning(f"選択された条件に一致するデータがありません。")
+                    else:
+                        st.warning("月次データが見つかりません。")
+                
+                # 可視化2: 月ごとの各機器の待ち時間のランキング変化（最適化版）
+                with tab2:
+                    st.header("📈 月ごとの待ち時間ランキング推移")
                     
-                    # 可視化2: 月ごとの各機器の待ち時間のランキング変化（最適化版）
-                    with tab2:
-                        st.header("📈 月ごとの待ち時間ランキング推移")
-                        
-                        # データ数の閾値設定
-                        min_data_count_vis2 = st.slider(
-                            "データ数の閾値（これ以下のデータ数の機器は推移から除外）",
-                            min_value=1, max_value=200, value=50, step=1, key="vis2_threshold"
-                        )
-                        
-                        # 上位表示する機器数を選択
-                        max_machines = min(50, monthly_stats[monthly_stats['DeviceGp'] == selected_device]['EQP_ID'].nunique())
-                        top_n = st.slider("表示する機器数", min_value=5, max_value=max_machines, value=min(25, max_machines), step=1)
+                    # データ数の閾値設定
+                    min_data_count_vis2 = st.slider(
+                        "データ数の閾値（これ以下のデータ数の機器は推移から除外）",
+                        min_value=1, max_value=200, value=50, step=1, key="vis2_threshold"
+                    )
+                    
+                    # 上位表示する機器数を選択
+                    max_machines = min(50, monthly_stats[monthly_stats['DeviceGp'] == selected_device]['EQP_ID'].nunique())
+                    top_n = st.slider("表示する機器数", min_value=5, max_value=max_machines, value=min(25, max_machines), step=1)
+                    
+                    # 最適化されたフィルタリング
+                    device_mask = (
+                        (monthly_stats['DeviceGp'] == selected_device) &
+                        (monthly_stats['count'] >= min_data_count_vis2)
+                    )
+                    device_stats = monthly_stats[device_mask].copy()
+                    
+                    if not device_stats.empty:
+                        # 月ごとのランキングを高速計算
+                        device_stats['rank'] = device_stats.groupby('year_month')['q3'].rank(method='dense', ascending=False)
                         
-                        # 最適化されたフィルタリング
-                        device_mask = (
-                            (monthly_stats['DeviceGp'] == selected_device) &
-                            (monthly_stats['count'] >= min_data_count_vis2)
-                        )
-                        device_stats = monthly_stats[device_mask].copy()
+                        # 複数の月にデータがある機器を特定（高速化）
+                        eqp_month_counts = device_stats.groupby('EQP_ID')['year_month'].nunique()
+                        multi_month_eqps = eqp_month_counts[eqp_month_counts >= 2].index.tolist()
                         
-                        if not device_stats.empty:
-                            # 月ごとのランキングを高速計算
-                            device_stats['rank'] = device_stats.groupby('year_month')['q3'].rank(method='dense', ascending=False)
+                        if multi_month_eqps:
+                            # 平均Q3値でトップN機器を選択（高速化）
+                            avg_q3 = device_stats[device_stats['EQP_ID'].isin(multi_month_eqps)].groupby('EQP_ID')['q3'].mean()
+                            top_eqps = avg_q3.nlargest(top_n).index.tolist()
                             
-                            # 複数の月にデータがある機器を特定（高速化）
-                            eqp_month_counts = device_stats.groupby('EQP_ID')['year_month'].nunique()
-                            multi_month_eqps = eqp_month_counts[eqp_month_counts >= 2].index.tolist()
+                            plot_data = device_stats[device_stats['EQP_ID'].isin(top_eqps)]
                             
-                            if multi_month_eqps:
-                                # 平均Q3値でトップN機器を選択（高速化）
-                                avg_q3 = device_stats[device_stats['EQP_ID'].isin(multi_month_eqps)].groupby('EQP_ID')['q3'].mean()
-                                top_eqps = avg_q3.nlargest(top_n).index.tolist()
+                            if not plot_data.empty:
+                                # 最適化されたプロット作成
+                                fig = create_fast_ranking_chart(
+                                    plot_data, 
+                                    f"月ごとの待ち時間ランキング推移 - デバイス: {selected_device}",
+                                    height=600
+                                )
                                 
-                                plot_data = device_stats[device_stats['EQP_ID'].isin(top_eqps)]
+                                st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})  # ツールバー非表示で軽量化
                                 
-                                if not plot_data.empty:
-                                    # 最適化されたプロット作成
-                                    fig = create_fast_ranking_chart(
-                                        plot_data, 
-                                        f"月ごとの待ち時間ランキング推移 - デバイス: {selected_device}",
-                                        height=600
-                                    )
-                                    
-                                    st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})  # ツールバー非表示で軽量化
-                                    
-                                    st.info(f"表示機器数: {len(top_eqps)}台（最小データ数: {min_data_count_vis2}件以上）")
-                                else:
-                                    st.warning("プロット用のデータが見つかりません。")
+                                st.info(f"表示機器数: {len(top_eqps)}台（最小データ数: {min_data_count_vis2}件以上）")
                             else:
-                                st.warning("複数の月にわたってデータがある機器が見つかりません。")
+                                st.warning("プロット用のデータが見つかりません。")
                         else:
-                            st.warning(f"選択されたデバイス({selected_device})のデータがありません。")
+                            st.warning("複数の月にわたってデータがある機器が見つかりません。")
+                    else:
+                        st.warning(f"選択されたデバイス({selected_device})のデータがありません。")
+                
+                # 可視化3: 月ごとの各機器の待ち時間の割合の可視化（最適化版）
+                with tab3:
+                    st.header("🥧 月ごとの機器待ち時間の割合")
                     
-                    # 可視化3: 月ごとの各機器の待ち時間の割合の可視化（最適化版）
-                    with tab3:
-                        st.header("🥧 月ごとの機器待ち時間の割合")
-                        
-                        # 上位表示する機器数を選択
-                        max_machines_vis3 = min(30, df['EQP_ID'].nunique())
-                        top_n_vis3 = st.slider("上位表示する機器数", min_value=5, max_value=max_machines_vis3, value=min(20, max_machines_vis3), step=1, key="vis3_top_n")
-                        
-                        # 選択されたデバイスに基づいてデータをフィルタリング（最適化）
-                        if selected_device == "ALL":
-                            device_df_vis3 = df
-                        else:
-                            device_df_vis3 = df[df['DeviceGp'] == selected_device].copy()
+                    # 上位表示する機器数を選択
+                    max_machines_vis3 = min(30, unique_eqps)
+                    top_n_vis3 = st.slider("上位表示する機器数", min_value=5, max_value=max_machines_vis3, value=min(20, max_machines_vis3), step=1, key="vis3_top_n")
+                    
+                    # 選択されたデバイスの月次統計（ALLは全DeviceGp統合の行）から待ち時間合計を取得
+                    device_stats_vis3 = monthly_stats[monthly_stats['DeviceGp'] == selected_device]
+                    
+                    if not device_stats_vis3.empty:
+                        # 月ごとの各機器の待ち時間合計
+                        monthly_wait = device_stats_vis3[['year_month', 'EQP_ID', 'sum']].rename(columns={'sum': 'WAIT_TIME'})
                         
-                        if not device_df_vis3.empty:
-                            # 月ごとの各機器の待ち時間合計を高速計算
-                            monthly_wait = device_df_vis3.groupby(['year_month', 'EQP_ID'])['WAIT_TIME'].sum().reset_index()
-                            
-                            # 各月の上位機器を効率的に計算
-                            plot_data = []
-                            for month in sorted(monthly_wait['year_month'].unique()):
-                                month_data = monthly_wait[monthly_wait['year_month'] == month].copy()
-                                month_data = month_data.sort_values('WAIT_TIME', ascending=False)
-                                
-                                # 上位N機器とその他を分ける
-                                if len(month_data) > top_n_vis3:
-                                    top_eqps = month_data.head(top_n_vis3)
-                                    others_wait = month_data.tail(len(month_data) - top_n_vis3)['WAIT_TIME'].sum()
-                                    
-                                    # 上位機器のデータ追加
-                                    for _, row in top_eqps.iterrows():
-                                        plot_data.append({
-                                            'month': month,
-                                            'EQP_ID': row['EQP_ID'],
-                                            'wait_time': row['WAIT_TIME']
-                                        })
-                                    
-                                    # その他のデータ追加
-                                    if others_wait > 0:
-                                        plot_data.append({
-                                            'month': month,
-                                            'EQP_ID': 'その他',
-                                            'wait_time': others_wait
-                                        })
-                                else:
-                                    # 全機器を追加
-                                    for _, row in month_data.iterrows():
-                                        plot_data.append({
-                                            'month': month,
-                                            'EQP_ID': row['EQP_ID'],
-                                            'wait_time': row['WAIT_TIME']
-                                        })
+                        # 各月の上位機器を効率的に計算
+                        plot_data = []
+                        for month in sorted(monthly_wait['year_month'].unique()):
+                            month_data = monthly_wait[monthly_wait['year_month'] == month].copy()
+                            month_data = month_data.sort_values('WAIT_TIME', ascending=False)
                             
-                            if plot_data:
-                                plot_df = pd.DataFrame(plot_data)
-                                
-                                # 割合計算（高速化）
-                                plot_df['total_by_month'] = plot_df.groupby('month')['wait_time'].transform('sum')
-                                plot_df['percentage'] = (plot_df['wait_time'] / plot_df['total_by_month']) * 100
-                                
-                                # 最適化されたプロット作成
-                                fig = create_fast_stacked_bar(
-                                    plot_df, 
-                                    f"月ごとの機器待ち時間の割合 - デバイス: {selected_device}",
-                                    height=600
-                                )
+                            # 上位N機器とその他を分ける
+                            if len(month_data) > top_n_vis3:
+                                top_eqps = month_data.head(top_n_vis3)
+                                others_wait = month_data.tail(len(month_data) - top_n_vis3)['WAIT_TIME'].sum()
                                 
-                                st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
+                                # 上位機器のデータ追加
+                                for _, row in top_eqps.iterrows():
+                                    plot_data.append({
+                                        'month': month,
+                                        'EQP_ID': row['EQP_ID'],
+                                        'wait_time': row['WAIT_TIME']
+                                    })
                                 
-                                unique_months = len(plot_df['month'].unique())
-                                unique_eqps = len(plot_df['EQP_ID'].unique())
-                                st.info(f"表示期間: {unique_months}ヶ月 | 表示機器数: {unique_eqps}台")
+                                # その他のデータ追加
+                                if others_wait > 0:
+                                    plot_data.append({
+                                        'month': month,
+                                        'EQP_ID': 'その他',
+                                        'wait_time': others_wait
+                                    })
                             else:
-                                st.warning("プロット用のデータが準備できませんでした。")
+                                # 全機器を追加
+                                for _, row in month_data.iterrows():
+                                    plot_data.append({
+                                        'month': month,
+                                        'EQP_ID': row['EQP_ID'],
+                                        'wait_time': row['WAIT_TIME']
+                                    })
+                        
+                        if plot_data:
+                            plot_df = pd.DataFrame(plot_data)
+                            
+                            # 割合計算（高速化）
+                            plot_df['total_by_month'] = plot_df.groupby('month')['wait_time'].transform('sum')
+                            plot_df['percentage'] = (plot_df['wait_time'] / plot_df['total_by_month']) * 100
+                            
+                            # 最適化されたプロット作成
+                            fig = create_fast_stacked_bar(
+                                plot_df, 
+                                f"月ごとの機器待ち時間の割合 - デバイス: {selected_device}",
+                                height=600
+                            )
+                            
+                            st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
+                            
+                            unique_months = len(plot_df['month'].unique())
+                            unique_eqps = len(plot_df['EQP_ID'].unique())
+                            st.info(f"表示期間: {unique_months}ヶ月 | 表示機器数: {unique_eqps}台")
                         else:
-                            st.warning(f"選択されたデバイス({selected_device})のデータがありません。")
-                else:
-                    st.warning("デバイスが見つかりません。データを確認してください。")
+                            st.warning("プロット用のデータが準備できませんでした。")
+                    else:
+                        st.warning(f"選択されたデバイス({selected_device})のデータがありません。")
+
+                # 可視化4: 制約時間（Q-time）の違反状況
+                with tab4:
+                    st.header("⏱️ 制約時間（Q-time）の違反状況")
+                    st.caption("FROM工程の開始からTO工程の開始までの時間を、制約時間（分）と比較します")
+
+                    qtime_summary, qtime_worst, qtime_skipped = load_qtime_results(period_months=period_months)
+                    if qtime_skipped:
+                        st.warning(
+                            f"⚠️ LOG2 に製品TYPEの列がないため、製品別の制約 {qtime_skipped:,}件 は判定していません"
+                            "（全製品共通の制約のみ判定しています）。"
+                        )
+                    if qtime_summary.empty:
+                        if not qtime_skipped:
+                            st.info("制約時間のデータがありません。data アプリで制約時間（Qtime）を読み込んでください。")
+                    else:
+                        total_windows = int(qtime_summary['windows'].sum())
+                        total_violations = int(qtime_summary['violations'].sum())
+                        col1, col2, col3 = st.columns(3)
+                        with col1:
+                            st.metric("制約数", f"{len(qtime_summary):,}")
+                        with col2:
+                            st.metric("判定区間数", f"{total_windows:,}")
+                        with col3:
+                            st.metric("違反率", f"{total_violations / max(total_windows, 1):.2%}")
+
+                        # 時間は分単位で表示
+                        display_summary = qtime_summary.copy()
+                        for col in ['LIMIT_SECONDS', 'median_seconds', 'p95_seconds', 'max_seconds']:
+                            display_summary[col] = (display_summary[col] / 60).round(1)
+                        display_summary['violation_rate'] = (display_summary['violation_rate'] * 100).round(2)
+                        st.subheader("制約ごとの違反率")
+                        st.dataframe(
+                            display_summary.rename(columns={
+                                'RULE_ID': '制約No', 'FROM_OPE_NO': 'FROM工程', 'TO_OPE_NO': 'TO工程',
+                                'LIMIT_SECONDS': '制約時間(分)', 'windows': '区間数', 'violations': '違反数',
+                                'open': '未完了', 'median_seconds': '中央値(分)', 'p95_seconds': '95%点(分)',
+                                'max_seconds': '最大(分)', 'violation_rate': '違反率(%)'
+                            }),
+                            use_container_width=True, hide_index=True
+                        )
+
+                        if not qtime_worst.empty:
+                            st.subheader("超過時間の大きい違反（上位1,000件）")
+                            display_worst = qtime_worst[['LOT_ID', 'FROM_OPE_NO', 'TO_OPE_NO', 'FROM_TIME', 'TO_TIME', 'ELAPSED_SECONDS', 'EXCESS_SECONDS']].copy()
+                            display_worst['ELAPSED_SECONDS'] = (display_worst['ELAPSED_SECONDS'] / 60).round(1)
+                            display_worst['EXCESS_SECONDS'] = (display_worst['EXCESS_SECONDS'] / 60).round(1)
+                            st.dataframe(
+                                display_worst.rename(columns={
+                                    'FROM_OPE_NO': 'FROM工程', 'TO_OPE_NO': 'TO工程', 'FROM_TIME': 'FROM開始',
+                                    'TO_TIME': 'TO開始', 'ELAPSED_SECONDS': '経過時間(分)', 'EXCESS_SECONDS': '超過時間(分)'
+                                }),
+                                use_container_width=True, hide_index=True
+                            )
             else:
-                st.warning("事前計算に失敗しました。")
+                st.warning("デバイスが見つかりません。データを確認してください。")
         else:
-            st.warning("データが読み込めませんでした。データベースの接続とテーブル構造を確認してください。")
+            st.warning("事前計算に失敗しました。")
             
     except Exception as e:
         st.error(f"エラーが発生しました: {e}")
@@ -0,0 +1 @@
+"""WASHI 共通モジュール（各Streamlitアプリから利用する処理を集約）"""
@@ -0,0 +1,160 @@
+"""バッチ処理装置（同時着工数 eqp_batch）の待ち行列とバッチ編成
+
+バッチ装置ごとに、レシピ（OPE_NO）別の待ち行列を持つ。着工条件を満たしたレシピは
+ヒープで管理するため、ロット到着ごとの処理は O(log n) で、待ちロット全体の走査は不要。
+
+着工方針（BATCH_POLICIES）:
+- greedy: 1ロットでも待っていれば着工する
+- min: 最小着工数まで待つ
+- full: 最大着工数（満杯）まで待つ
+いずれの方針でも、最も古いロットの待ち時間が max_wait を超えたら、そろっている分で着工する。
+"""
+import heapq
+import itertools
+from collections import deque
+
+import numpy as np
+
+BATCH_POLICIES = {
+    "greedy": "待ちロットがあればすぐ着工",
+    "min": "最小着工数まで待つ",
+    "full": "満杯まで待つ",
+}
+DEFAULT_BATCH_POLICY = "min"
+
+
+def fill_threshold(policy, capacity, min_batch):
+    """着工方針から、待たずに着工できるロット数を返す"""
+    if policy not in BATCH_POLICIES:
+        raise ValueError(f"未対応の着工方針です: {policy}（{', '.join(BATCH_POLICIES)}）")
+    if policy == "greedy":
+        return 1
+    if policy == "full":
+        return capacity
+    return max(1, min(min_batch, capacity))
+
+
+class BatchQueue:
+    """1台のバッチ装置の待ち行列（レシピ別）
+
+    ヒープの要素は (先頭ロットの到着時刻, 版番号, レシピ)。レシピの先頭が変わるたびに
+    版番号を更新し、古い要素は取り出し時に読み飛ばす（遅延削除）。
+    """
+
+    def __init__(self, capacity, threshold=1):
+        self.capacity = int(capacity)
+        self.threshold = int(threshold)
+        self.queues = {}
+        self.versions = {}
+        self.oldest = []
+        self.ready = []
+        self.waiting = 0
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return self.waiting
+
+    def pending(self, recipe):
+        """レシピの待ちロット数"""
+        queue = self.queues.get(recipe)
+        return len(queue) if queue else 0
+
+    def _push_head(self, recipe):
+        """レシピの先頭ロットをヒープに登録する"""
+        queue = self.queues[recipe]
+        version = next(self._counter)
+        self.versions[recipe] = version
+        heapq.heappush(self.oldest, (queue[0][1], version, recipe))
+        if len(queue) >= self.threshold:
+            heapq.heappush(self.ready, (queue[0][1], version, recipe))
+
+    def add(self, lot, recipe, arrival):
+        """ロットを追加する"""
+        queue = self.queues.get(recipe)
+        if queue is None:
+            queue = self.queues[recipe] = deque()
+        queue.append((lot, arrival))
+        self.waiting += 1
+        if len(queue) == 1:
+            self._push_head(recipe)
+        elif len(queue) == self.threshold:
+            heapq.heappush(self.ready, (queue[0][1], self.versions[recipe], recipe))
+
+    def _peek(self, heap):
+        """ヒープから有効な先頭要素を返す（古い要素は削除する）"""
+        while heap:
+            arrival, version, recipe = heap[0]
+            if self.versions.get(recipe) == version and self.queues.get(recipe):
+                return arrival, recipe
+            heapq.heappop(heap)
+        return None
+
+    def take(self, recipe):
+        """レシピの先頭から最大 capacity ロットを取り出す"""
+        queue = self.queues[recipe]
+        count = min(len(queue), self.capacity)
+        lots = [queue.popleft()[0] for _ in range(count)]
+        self.waiting -= count
+        if queue:
+            self._push_head(recipe)
+        else:
+            del self.queues[recipe]
+            del self.versions[recipe]
+        return lots
+
+    def select(self, now, max_wait=None):
+        """着工するバッチを選ぶ
+
+        戻り値: (ロットのリスト, None) または 着工しない場合 ([], 再確認する時刻またはNone)
+        """
+        ready = self._peek(self.ready)
+        if ready is not None:
+            return self.take(ready[1]), None
+        oldest = self._peek(self.oldest)
+        if oldest is None:
+            return [], None
+        arrival, recipe = oldest
+        if max_wait is None:
+            return [], None
+        if now >= arrival + max_wait:
+            return self.take(recipe), None
+        return [], arrival + max_wait
+
+
+def choose_batch_equipment(queues, candidates, recipe, eqp_busy):
+    """到着したロットを入れるバッチ装置を選ぶ
+
+    同じレシピが満杯前で待っている装置、空いている装置、待ちロットの少ない装置の順に優先する。
+    """
+    best = None
+    best_key = None
+    for eqp in candidates:
+        queue = queues[eqp]
+        pending = queue.pending(recipe)
+        key = (
+            0 if 0 < pending < queue.capacity else 1,
+            1 if eqp_busy[eqp] else 0,
+            len(queue),
+        )
+        if best_key is None or key < best_key:
+            best, best_key = eqp, key
+    return best
+
+
+if __name__ == "__main__":
+    import time
+
+    # 到着ごとの処理時間がレシピ数・待ちロット数に依存しないことを確認
+    rng = np.random.default_rng(0)
+    for n_recipes in (10, 1_000, 100_000):
+        queue = BatchQueue(capacity=6, threshold=6)
+        recipes = rng.integers(0, n_recipes, 1_000_000)
+        start = time.perf_counter()
+        batches = 0
+        for i, recipe in enumerate(recipes):
+            queue.add(i, int(recipe), float(i))
+            if i % 4 == 0:
+                lots, _ = queue.select(float(i), max_wait=50_000.0)
+                batches += bool(lots)
+        elapsed = time.perf_counter() - start
+        print(f"[DEBUG] レシピ {n_recipes:,}種類: {elapsed:.2f}秒, バッチ {batches:,}件, 待ち {len(queue):,}ロット")
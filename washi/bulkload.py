@@ -0,0 +1,180 @@
+"""SQLiteへの一括書き込みエンジン（executemany + 書き込み用PRAGMA + インデックス遅延作成）"""
+import sqlite3
+import time
+
+import pandas as pd
+
+# 書き込み時のPRAGMA設定
+# WALにより書き込み中も他アプリからの読み込みがブロックされない（journal_modeはDBに永続化される）
+LOAD_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "OFF",
+    "cache_size": -262144,  # 256MB（負値はKB単位）
+    "temp_store": "MEMORY",
+}
+
+# 書き込み完了後に戻すPRAGMA設定（接続単位の設定のみ）
+DEFAULT_PRAGMAS = {
+    "synchronous": "NORMAL",
+}
+
+# 書き込み速度の目標値（行/秒）
+TARGET_ROWS_PER_SEC = 200_000
+
+# DataFrameを書き込む際の1回あたりの行数
+FRAME_CHUNK_SIZE = 100_000
+
+# 他プロセスの書き込み待ちの上限（ミリ秒）
+BUSY_TIMEOUT_MS = 30_000
+
+# テーブルの作成回数（世代）を記録するテーブル（置換でROWIDが振り直されたことの検出用）
+GENERATION_TABLE = "TABLE_GENERATION"
+
+
+def quote_identifier(name):
+    """SQL識別子をクォートする"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def apply_pragmas(conn, pragmas):
+    """PRAGMA設定を適用する"""
+    for key, value in pragmas.items():
+        conn.execute(f"PRAGMA {key}={value}")
+
+
+def open_bulk_connection(db_file):
+    """一括書き込み用の接続を開く（トランザクションは明示的に管理する）"""
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    apply_pragmas(conn, LOAD_PRAGMAS)
+    return conn
+
+
+def table_exists(conn, table_name):
+    """テーブルの存在を確認する"""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table_name,)
+    ).fetchone()
+    return row is not None
+
+
+def table_generation(conn, table_name):
+    """テーブルの世代（bulk_load で作成・置換された回数、記録がない場合は0）を返す"""
+    if not table_exists(conn, GENERATION_TABLE):
+        return 0
+    row = conn.execute(
+        f"SELECT generation FROM {GENERATION_TABLE} WHERE name = ?", (table_name,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def bump_table_generation(conn, table_name):
+    """テーブルの世代を1つ進める（テーブルの作成・置換と同じトランザクション内で呼び出す）"""
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {GENERATION_TABLE} (name TEXT PRIMARY KEY, generation INTEGER NOT NULL)"
+    )
+    conn.execute(
+        f"INSERT INTO {GENERATION_TABLE} (name, generation) VALUES (?, 1) "
+        "ON CONFLICT(name) DO UPDATE SET generation = generation + 1",
+        (table_name,)
+    )
+
+
+def drop_table_indexes(conn, table_name):
+    """テーブルのインデックスを削除し、再作成用のSQLを返す（自動インデックスは対象外）"""
+    rows = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL",
+        (table_name,)
+    ).fetchall()
+    for name, _ in rows:
+        conn.execute(f"DROP INDEX IF EXISTS {quote_identifier(name)}")
+    return [sql for _, sql in rows]
+
+
+def iter_frame_chunks(df, chunksize=FRAME_CHUNK_SIZE):
+    """DataFrameを行方向に分割するイテレータ"""
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+
+def bulk_load(db_file, table_name, chunks, replace=True, index_sqls=None,
+              progress_callback=None, transform=None, column_types=None, defer_indexes=True):
+    """DataFrameのチャンク列をテーブルへ一括書き込みする
+
+    - 全チャンクを1トランザクションで書き込み、失敗時はロールバックする
+    - replace=True の場合、既存テーブルは先頭チャンクを受け取ってから削除する
+      （チャンクが1つもない場合は既存テーブルをそのまま残す）
+    - テーブルを作成・置換した場合はテーブルの世代（table_generation）を進める
+    - 既存インデックスは先頭チャンクを受け取ってから削除し、書き込み後に index_sqls と合わせて作成する
+      （チャンクが1つもない場合はインデックスもそのまま残す）
+    - 完了後にANALYZEを実行し、クエリプランナの統計情報を更新する
+    - progress_callback(書き込み済み行数) を各チャンク後に呼び出す
+    - transform(conn, chunk) を指定すると書き込み前に各チャンクを変換する（同一トランザクション内）
+    - column_types でカラムの宣言型（カラム名→SQLite型）を上書きできる
+    - defer_indexes=False の場合は既存インデックスを維持したまま追加する（少量の差分追加向け）。
+      この場合は全件のANALYZEの代わりに PRAGMA optimize で必要な統計のみ更新する
+
+    戻り値: rows, seconds, rows_per_sec, target_met を持つ辞書
+    """
+    start_time = time.perf_counter()
+    conn = open_bulk_connection(db_file)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+
+        deferred_indexes = []
+        total_rows = 0
+        insert_sql = None
+        for chunk in chunks:
+            if transform is not None:
+                chunk = transform(conn, chunk)
+
+            if insert_sql is None:
+                if replace or not table_exists(conn, table_name):
+                    bump_table_generation(conn, table_name)
+                if replace:
+                    conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(table_name)}")
+                elif defer_indexes and table_exists(conn, table_name):
+                    # 追加時の既存インデックスも先頭チャンクを受け取ってから削除する
+                    deferred_indexes = drop_table_indexes(conn, table_name)
+                # 先頭チャンクの型推定でテーブルを作成
+                schema = pd.io.sql.get_schema(chunk, table_name, con=conn, dtype=column_types)
+                conn.execute(schema.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1))
+                columns = ", ".join(quote_identifier(col) for col in chunk.columns)
+                placeholders = ", ".join("?" for _ in chunk.columns)
+                insert_sql = f"INSERT INTO {quote_identifier(table_name)} ({columns}) VALUES ({placeholders})"
+
+            conn.executemany(insert_sql, chunk.itertuples(index=False, name=None))
+            total_rows += len(chunk)
+
+            if progress_callback is not None:
+                progress_callback(total_rows)
+
+        # インデックスはデータ投入後にまとめて作成
+        if insert_sql is not None:
+            for index_sql in deferred_indexes + list(index_sqls or []):
+                conn.execute(index_sql)
+
+        conn.execute("COMMIT")
+
+        if insert_sql is not None:
+            if defer_indexes:
+                conn.execute(f"ANALYZE {quote_identifier(table_name)}")
+            else:
+                conn.execute("PRAGMA optimize")
+        apply_pragmas(conn, DEFAULT_PRAGMAS)
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    seconds = time.perf_counter() - start_time
+    rows_per_sec = total_rows / seconds if seconds > 0 else float(total_rows)
+    print(f"[DEBUG] 一括書き込み: {table_name} {total_rows}行, {seconds:.2f}秒, {rows_per_sec:,.0f}行/秒")
+    return {
+        "rows": total_rows,
+        "seconds": seconds,
+        "rows_per_sec": rows_per_sec,
+        "target_met": rows_per_sec >= TARGET_ROWS_PER_SEC,
+    }
@@ -0,0 +1,353 @@
+"""分析用のParquetデータセット（year_month / DeviceGp でパーティション分割）"""
+import json
+import os
+import shutil
+import sqlite3
+import uuid
+from datetime import datetime
+from urllib.parse import quote
+
+import pandas as pd
+import polars as pl
+
+from washi.bulkload import quote_identifier
+from washi.schema import DICT_COLUMNS, REAL_COLUMNS, TIMESTAMP_COLUMNS, decode_frame, id_text, is_typed_table
+
+# データセットの保存先
+PARQUET_ROOT = os.path.join("./load", "parquet")
+
+# データセットを作成するテーブル（可視化アプリが読み込む処理実績のみ）
+ANALYTICS_TABLES = ("LOG", "LOG2")
+
+# 既存テーブルからデータセットを作成する際の1回あたりの行数
+EXPORT_CHUNK_SIZE = 100_000
+
+# データセットの情報ファイル名
+METADATA_FILE = "_dataset.json"
+
+# パーティションごとに1ファイルへまとめる行数（チャンクごとに小さなファイルが増えないようにする）
+PARTITION_FILE_ROWS = 500_000
+
+# 書き込み前に保持する行数の上限（超えた場合は行数の多いパーティションから書き出す）
+MAX_BUFFERED_ROWS = 2_000_000
+
+# polarsでnullとして扱われるパーティション値
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+def dataset_dir(table_name, root=PARQUET_ROOT):
+    """テーブルに対応するデータセットのディレクトリを返す"""
+    return os.path.join(root, table_name)
+
+
+def dataset_exists(table_name, root=PARQUET_ROOT):
+    """データセットが存在するか確認する"""
+    return os.path.exists(os.path.join(dataset_dir(table_name, root), METADATA_FILE))
+
+
+def read_metadata(table_name, root=PARQUET_ROOT):
+    """データセットの情報（パーティション列・行数など）を読み込む"""
+    with open(os.path.join(dataset_dir(table_name, root), METADATA_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def list_datasets(root=PARQUET_ROOT):
+    """保存済みのデータセット名一覧を返す"""
+    if not os.path.exists(root):
+        return []
+    return sorted(name for name in os.listdir(root) if dataset_exists(name, root))
+
+
+def remove_dataset(table_name, root=PARQUET_ROOT):
+    """データセットを削除する"""
+    path = dataset_dir(table_name, root)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+
+
+def time_column(columns):
+    """year_month の算出に使う日時カラムを返す（なければNone）"""
+    for col in TIMESTAMP_COLUMNS:
+        if col in columns:
+            return col
+    return None
+
+
+def pandas_to_polars(df, keep_numeric=True):
+    """pandasのDataFrameをpolarsに変換する（pyarrowを使わない）
+
+    日時カラムはDatetime、待ち時間等はFloat64、IDカラム（DICT_COLUMNS）と文字列などは文字列にする。
+    その他の数値・真偽値カラムは型を保つ。keep_numeric=False の場合はそれらも文字列に揃え、
+    CSVのチャンクごとに型推定が揺れてもファイル間のスキーマが一致するようにする（Parquetデータセット用）。
+    """
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        if col in TIMESTAMP_COLUMNS:
+            if not pd.api.types.is_datetime64_any_dtype(series):
+                series = pd.to_datetime(series, errors="coerce")
+            values = series.to_numpy(dtype="datetime64[us]")
+            columns[col] = pl.Series(col, values, dtype=pl.Datetime("us"))
+        elif col in REAL_COLUMNS:
+            values = pd.to_numeric(series, errors="coerce").to_numpy(dtype="float64")
+            columns[col] = pl.Series(col, values, dtype=pl.Float64, nan_to_null=True)
+        elif keep_numeric and col not in DICT_COLUMNS and pd.api.types.is_bool_dtype(series):
+            columns[col] = pl.Series(col, series.astype(object).where(series.notna(), None).tolist(), dtype=pl.Boolean)
+        elif keep_numeric and col not in DICT_COLUMNS and pd.api.types.is_integer_dtype(series):
+            values = series.astype(object).where(series.notna(), None).tolist()
+            columns[col] = pl.Series(col, values, dtype=pl.Int64)
+        elif keep_numeric and col not in DICT_COLUMNS and pd.api.types.is_float_dtype(series):
+            values = series.to_numpy(dtype="float64", na_value=float("nan"))
+            columns[col] = pl.Series(col, values, dtype=pl.Float64, nan_to_null=True)
+        else:
+            columns[col] = pl.Series(col, id_text(series).to_numpy(dtype=object).tolist(), dtype=pl.String)
+    return pl.DataFrame(columns)
+
+
+def polars_to_pandas(df, categorical_columns=()):
+    """polarsのDataFrameをpandasに変換する（pyarrowを使わない）"""
+    data = {}
+    for col in df.columns:
+        series = df[col]
+        if series.dtype == pl.Datetime:
+            data[col] = pd.to_datetime(series.to_numpy())
+        elif series.dtype in (pl.String, pl.Categorical):
+            series = series.cast(pl.String)
+            if col in categorical_columns:
+                # 値の一覧をEnumにしてコードを取り出す（pandas側での再ハッシュを避ける）
+                categories = series.drop_nulls().unique().sort()
+                codes = series.cast(pl.Enum(categories.to_list())).to_physical().cast(pl.Int64)
+                data[col] = pd.Categorical.from_codes(codes.fill_null(-1).to_numpy(), categories.to_numpy())
+            else:
+                data[col] = series.to_numpy()
+        else:
+            data[col] = series.to_numpy()
+    return pd.DataFrame(data)
+
+
+def _partition_value(value):
+    """パーティションのディレクトリ名に使う値（パス区切り等はエスケープ）"""
+    if value is None:
+        return NULL_PARTITION
+    return quote(str(value), safe="")
+
+
+class ParquetDatasetWriter:
+    """チャンクを受け取りParquetデータセットへ書き込む
+
+    一時ディレクトリに書き込み、commit() で既存のデータセットと置き換える（append=True の場合は追加する）。
+    行はパーティションごとに PARTITION_FILE_ROWS 行まで溜めてから1ファイルとして書き出し、
+    残りは commit() 時に書き出す。
+    書き込みに失敗してもDBへの保存を妨げないよう、エラーは記録して以降の書き込みを止める。
+    """
+
+    def __init__(self, table_name, append=False, root=PARQUET_ROOT):
+        self.table_name = table_name
+        self.root = root
+        self.append = append and dataset_exists(table_name, root)
+        self.tmp_dir = os.path.join(root, f".{table_name}.{uuid.uuid4().hex}.tmp")
+        self.file_prefix = uuid.uuid4().hex[:8]
+        self.partition_by = read_metadata(table_name, root)["partition_by"] if self.append else None
+        self.file_count = 0
+        self.rows = 0
+        self.error = None
+        self.buffers = {}
+        self.buffered_rows = 0
+
+    def write(self, chunk):
+        """1チャンク分を書き込む"""
+        if self.error is not None or chunk.empty:
+            return
+        try:
+            os.makedirs(self.tmp_dir, exist_ok=True)
+            frame = pandas_to_polars(chunk, keep_numeric=False)
+
+            ts_col = time_column(frame.columns)
+            if self.partition_by is None:
+                self.partition_by = []
+                if ts_col is not None:
+                    self.partition_by.append("year_month")
+                if "DeviceGp" in frame.columns:
+                    self.partition_by.append("DeviceGp")
+
+            if ts_col is not None:
+                frame = frame.with_columns(pl.col(ts_col).dt.strftime("%Y-%m").alias("year_month"))
+
+            if self.partition_by:
+                groups = frame.partition_by(self.partition_by, as_dict=True, include_key=False)
+            else:
+                groups = {(): frame}
+
+            for key, part in groups.items():
+                self.buffers.setdefault(key, []).append(part)
+                self.buffered_rows += len(part)
+                if sum(len(p) for p in self.buffers[key]) >= PARTITION_FILE_ROWS:
+                    self._flush(key)
+            while self.buffered_rows > MAX_BUFFERED_ROWS:
+                self._flush(max(self.buffers, key=lambda k: sum(len(p) for p in self.buffers[k])))
+            self.rows += len(chunk)
+        except Exception as e:
+            print(f"[DEBUG] Parquet書き込みエラー: {self.table_name}: {e}")
+            self.error = e
+
+    def _flush(self, key):
+        """パーティションに溜めた行を1ファイルとして書き出す"""
+        parts = self.buffers.pop(key)
+        part = parts[0] if len(parts) == 1 else pl.concat(parts, how="diagonal_relaxed")
+        self.buffered_rows -= len(part)
+        subdir = os.path.join(self.tmp_dir, *[
+            f"{name}={_partition_value(value)}"
+            for name, value in zip(self.partition_by, key)
+        ])
+        os.makedirs(subdir, exist_ok=True)
+        part.write_parquet(os.path.join(subdir, f"part-{self.file_prefix}-{self.file_count:06d}.parquet"))
+        self.file_count += 1
+
+    def tee(self, chunks):
+        """チャンクを書き込みながらそのまま受け流すイテレータ"""
+        for chunk in chunks:
+            self.write(chunk)
+            yield chunk
+
+    def commit(self):
+        """書き込んだデータセットで既存のデータセットを置き換える（失敗時はFalse）"""
+        if self.error is None:
+            try:
+                for key in list(self.buffers):
+                    self._flush(key)
+            except Exception as e:
+                print(f"[DEBUG] Parquet書き込みエラー: {self.table_name}: {e}")
+                self.error = e
+        if self.error is not None:
+            self.abort()
+            return False
+        if self.file_count == 0:
+            # 書き込む行がない場合（差分追加で全件スキップなど）
+            self.abort()
+            if not self.append:
+                remove_dataset(self.table_name, self.root)
+            return True
+        try:
+            if self.append:
+                self._merge_into_existing()
+            else:
+                self._write_metadata(self.tmp_dir, self.rows, self.file_count)
+                remove_dataset(self.table_name, self.root)
+                os.replace(self.tmp_dir, dataset_dir(self.table_name, self.root))
+        except Exception as e:
+            print(f"[DEBUG] Parquet置き換えエラー: {self.table_name}: {e}")
+            self.error = e
+            self.abort()
+            return False
+        return True
+
+    def _write_metadata(self, path, rows, files):
+        """データセットの情報ファイルを書き込む"""
+        with open(os.path.join(path, METADATA_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "table": self.table_name,
+                "partition_by": self.partition_by or [],
+                "rows": rows,
+                "files": files,
+                "written_at": datetime.now().isoformat(timespec="seconds"),
+            }, f, ensure_ascii=False)
+
+    def _merge_into_existing(self):
+        """追加分のファイルを既存のデータセットへ移動する"""
+        target = dataset_dir(self.table_name, self.root)
+        metadata = read_metadata(self.table_name, self.root)
+        for dirpath, _, filenames in os.walk(self.tmp_dir):
+            rel = os.path.relpath(dirpath, self.tmp_dir)
+            for filename in filenames:
+                dest_dir = os.path.join(target, rel)
+                os.makedirs(dest_dir, exist_ok=True)
+                os.replace(os.path.join(dirpath, filename), os.path.join(dest_dir, filename))
+        self._write_metadata(target, metadata["rows"] + self.rows, metadata["files"] + self.file_count)
+        self.abort()
+
+    def abort(self):
+        """書き込み途中のデータを破棄する"""
+        self.buffers = {}
+        self.buffered_rows = 0
+        if os.path.exists(self.tmp_dir):
+            shutil.rmtree(self.tmp_dir)
+
+
+def export_table_to_dataset(db_file, table_name, chunksize=EXPORT_CHUNK_SIZE,
+                            progress_callback=None, root=PARQUET_ROOT):
+    """DBの既存テーブルからデータセットを作り直す（型付きテーブルは復号して書き込む）
+
+    progress_callback(書き込み済み行数) を各チャンク後に呼び出す。戻り値は成否。
+    """
+    writer = ParquetDatasetWriter(table_name, root=root)
+    conn = sqlite3.connect(db_file)
+    try:
+        typed = is_typed_table(conn, table_name)
+        chunks = pd.read_sql_query(
+            f"SELECT * FROM {quote_identifier(table_name)}", conn, chunksize=chunksize
+        )
+        for chunk in chunks:
+            writer.write(decode_frame(conn, chunk) if typed else chunk)
+            if progress_callback is not None:
+                progress_callback(writer.rows)
+    except Exception:
+        writer.abort()
+        raise
+    finally:
+        conn.close()
+    return writer.commit()
+
+
+def scan_dataset(table_name, root=PARQUET_ROOT):
+    """データセットを遅延読み込みする（列の選択や条件はparquet読み込み時に適用される）"""
+    metadata = read_metadata(table_name, root)
+    partition_by = metadata.get("partition_by", [])
+    pattern = os.path.join(dataset_dir(table_name, root), "**", "*.parquet")
+    if partition_by:
+        return pl.scan_parquet(
+            pattern,
+            hive_partitioning=True,
+            hive_schema={name: pl.String for name in partition_by},
+        )
+    return pl.scan_parquet(pattern, hive_partitioning=False)
+
+
+# vis_b が使用するLOG2のカラム（year_month はパーティション値をそのまま使う）
+LOG2_COLUMNS = [
+    "LOT_ID", "OPE_START_DATETIME", "WAIT_TIME", "EQP_ID",
+    "OPE_NO", "SUB_LOT_TYPE", "MRC", "DeviceGp", "year_month",
+]
+
+
+def load_log2_wait_times(period_months=None, limit=None, root=PARQUET_ROOT):
+    """LOG2データセットから vis_b の待ち時間データを読み込む（SQLiteの build_log2_query 相当）
+
+    必要なカラムのみを読み込み、P0/MASTER 等の条件はParquetの読み込み時に適用する。
+    期間指定時は year_month のパーティションで読み込むファイル自体を絞り込む。
+    limit 指定時は日時の新しい順に limit 件を返す。
+    """
+    lf = scan_dataset("LOG2", root).filter(
+        (pl.col("SUB_LOT_TYPE") == "P0")
+        & (pl.col("MRC") == "MASTER")
+        & (pl.col("WAIT_TIME") > 0)
+        & pl.col("DeviceGp").is_not_null() & (pl.col("DeviceGp") != "")
+        & pl.col("EQP_ID").is_not_null() & (pl.col("EQP_ID") != "")
+        & pl.col("OPE_START_DATETIME").is_not_null()
+    )
+
+    if period_months is not None:
+        max_date = lf.select(pl.col("OPE_START_DATETIME").max()).collect().item()
+        if max_date is not None:
+            threshold = pd.Timestamp(max_date) - pd.DateOffset(months=int(period_months))
+            lf = lf.filter(
+                (pl.col("year_month") >= threshold.strftime("%Y-%m"))
+                & (pl.col("OPE_START_DATETIME") >= threshold.to_pydatetime())
+            )
+
+    lf = lf.select(LOG2_COLUMNS)
+    if limit is not None:
+        lf = lf.sort("OPE_START_DATETIME", descending=True).head(int(limit))
+
+    df = polars_to_pandas(lf.collect(), categorical_columns=("EQP_ID", "DeviceGp", "LOT_ID"))
+    df["WAIT_TIME"] = df["WAIT_TIME"].astype("float32")
+    return df
@@ -0,0 +1,262 @@
+"""待ち時間の月次統計キューブ（year_month × DeviceGp × EQP_ID の集計済みテーブル）
+
+各行には分位点スケッチ（washi.sketch）も保存し、複数月・複数DeviceGpをまとめた
+中央値・第三四分位点を元データを読み込まずに求められるようにする。
+"""
+import re
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from washi.bulkload import quote_identifier, table_exists
+from washi.frames import load_log2_polars
+from washi.indexes import get_columns
+from washi.queries import build_log2_query
+from washi.schema import epoch_seconds, is_typed_table
+from washi.sketch import frame_sketches, merge_quantiles
+from washi.stats import ALL_DEVICES, STATS_COLUMNS, STATS_KEYS, monthly_wait_stats
+
+# 統計キューブのテーブル名と集計元のテーブル
+CUBE_TABLE = "WAIT_STATS_CUBE"
+CUBE_SOURCE_TABLE = "LOG2"
+
+# 集計元に必要なカラム（vis_b の読み込みクエリと同じ）
+SOURCE_COLUMNS = [
+    "LOT_ID", "OPE_START_DATETIME", "WAIT_TIME", "EQP_ID",
+    "OPE_NO", "SUB_LOT_TYPE", "MRC", "DeviceGp",
+]
+
+CREATE_CUBE_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {CUBE_TABLE} (
+        year_month TEXT NOT NULL,
+        DeviceGp TEXT NOT NULL,
+        EQP_ID TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        sum REAL NOT NULL,
+        mean REAL NOT NULL,
+        median REAL NOT NULL,
+        q3 REAL NOT NULL,
+        sketch BLOB,
+        PRIMARY KEY (year_month, DeviceGp, EQP_ID)
+    )
+"""
+
+MONTH_PATTERN = re.compile(r"^\d{4}-\d{2}$")
+
+
+def cube_source_ready(conn):
+    """集計元のテーブルに必要なカラムが揃っているか確認する"""
+    return set(SOURCE_COLUMNS) <= set(get_columns(conn, CUBE_SOURCE_TABLE))
+
+
+def cube_exists(conn):
+    """統計キューブが作成済みか確認する"""
+    return table_exists(conn, CUBE_TABLE)
+
+
+def ensure_cube_table(conn):
+    """統計キューブを作成する（スケッチ列がない旧形式には列を追加）"""
+    conn.execute(CREATE_CUBE_SQL)
+    if "sketch" not in get_columns(conn, CUBE_TABLE):
+        conn.execute(f"ALTER TABLE {CUBE_TABLE} ADD COLUMN sketch BLOB")
+
+
+def drop_stats_cube(conn):
+    """統計キューブを削除する"""
+    conn.execute(f"DROP TABLE IF EXISTS {CUBE_TABLE}")
+
+
+def month_date_filter(month, typed=False):
+    """1ヶ月分に絞り込む条件を返す（build_log2_query の date_filter として使用）"""
+    start = pd.Timestamp(f"{month}-01")
+    end = start + pd.offsets.MonthBegin(1)
+    if typed:
+        return f"AND OPE_START_DATETIME >= {epoch_seconds(start)} AND OPE_START_DATETIME < {epoch_seconds(end)}"
+    # 日付のみの文字列と比較するため、時刻部分の有無に関わらず範囲に含まれる
+    return f"AND OPE_START_DATETIME >= '{start:%Y-%m-%d}' AND OPE_START_DATETIME < '{end:%Y-%m-%d}'"
+
+
+def source_months(conn, typed=False):
+    """集計元に含まれる年月の一覧を返す"""
+    if typed:
+        month_expr = "strftime('%Y-%m', OPE_START_DATETIME, 'unixepoch')"
+    else:
+        month_expr = "substr(OPE_START_DATETIME, 1, 7)"
+    rows = conn.execute(
+        f"SELECT DISTINCT {month_expr} FROM {CUBE_SOURCE_TABLE} "
+        "WHERE SUB_LOT_TYPE = 'P0' AND MRC = 'MASTER' AND OPE_START_DATETIME IS NOT NULL"
+    ).fetchall()
+    return sorted(month for (month,) in rows if month and MONTH_PATTERN.match(month))
+
+
+def frame_months(df):
+    """DataFrameに含まれる年月の一覧を返す（追加時の更新対象月の特定用）"""
+    if "OPE_START_DATETIME" not in df.columns:
+        return set()
+    months = pd.to_datetime(df["OPE_START_DATETIME"], errors="coerce").dt.strftime("%Y-%m")
+    return set(months.dropna().unique())
+
+
+class MonthCollector:
+    """書き込むチャンクに含まれる年月を記録する"""
+
+    def __init__(self):
+        self.months = set()
+
+    def add(self, chunk):
+        """チャンクの年月を記録する"""
+        self.months |= frame_months(chunk)
+
+    def tee(self, chunks):
+        """チャンクの年月を記録しながらそのまま受け流すイテレータ"""
+        for chunk in chunks:
+            self.add(chunk)
+            yield chunk
+
+
+def month_stats_with_sketches(df):
+    """1ヶ月分のデータから統計とスケッチ（DeviceGp別・全DeviceGp統合）を求める"""
+    stats = monthly_wait_stats(df)
+    device_sketches = frame_sketches(df, STATS_KEYS)
+    all_sketches = frame_sketches(df, ["year_month", "EQP_ID"])
+    all_sketches["DeviceGp"] = ALL_DEVICES
+    sketches = pd.concat([device_sketches, all_sketches], ignore_index=True)
+
+    stats[STATS_KEYS] = stats[STATS_KEYS].astype(str)
+    return stats.merge(sketches[STATS_KEYS + ["sketch"]], on=STATS_KEYS, how="left")
+
+
+def update_stats_cube(db_file, months=None, progress_callback=None):
+    """統計キューブを更新する（months=None の場合は全月を再作成）
+
+    分位点は月単位でしか求められないため、対象月の元データを読み込み直して置き換える。
+    1ヶ月ずつ処理するため、メモリ使用量は最大1ヶ月分のデータ量に抑えられる。
+    戻り値: 更新した月数（集計元がない場合はNone）
+    """
+    conn = sqlite3.connect(db_file)
+    try:
+        if not cube_source_ready(conn):
+            return None
+        typed = is_typed_table(conn, CUBE_SOURCE_TABLE)
+        rebuild = months is None
+        if rebuild:
+            months = source_months(conn, typed)
+        months = sorted(month for month in months if MONTH_PATTERN.match(str(month)))
+
+        ensure_cube_table(conn)
+        if rebuild:
+            conn.execute(f"DELETE FROM {CUBE_TABLE}")
+        conn.commit()
+
+        columns = STATS_KEYS + STATS_COLUMNS + ["sketch"]
+        insert_sql = (
+            f"INSERT INTO {CUBE_TABLE} ({', '.join(quote_identifier(col) for col in columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)})"
+        )
+        for i, month in enumerate(months):
+            query = build_log2_query(typed, month_date_filter(month, typed))
+            df = load_log2_polars(conn, query, typed)
+            if not df.empty:
+                df = df[df["year_month"] == month]
+            stats = month_stats_with_sketches(df)
+
+            with conn:
+                conn.execute(f"DELETE FROM {CUBE_TABLE} WHERE year_month = ?", (month,))
+                conn.executemany(insert_sql, (
+                    (ym, dev, eqp, int(count), float(total), float(mean), float(median), float(q3), sketch)
+                    for ym, dev, eqp, count, total, mean, median, q3, sketch in stats[columns].itertuples(index=False)
+                ))
+            print(f"[DEBUG] 統計キューブ更新: {month} {len(stats)}件")
+
+            if progress_callback is not None:
+                progress_callback(i + 1, len(months))
+        return len(months)
+    finally:
+        conn.close()
+
+
+def load_stats_cube(db_file, period_months=None):
+    """統計キューブを読み込む（period_months 指定時は最新月からの月数で絞り込む）
+
+    戻り値は monthly_wait_stats と同じ形式のDataFrame（キューブがない場合は空）。
+    """
+    conn = sqlite3.connect(db_file)
+    try:
+        if not cube_exists(conn):
+            return pd.DataFrame()
+        where = ""
+        if period_months is not None:
+            latest = conn.execute(f"SELECT MAX(year_month) FROM {CUBE_TABLE}").fetchone()[0]
+            if latest is not None:
+                first = pd.Period(latest, freq="M") - int(period_months)
+                where = f"WHERE year_month >= '{first}'"
+        columns = ", ".join(STATS_KEYS + STATS_COLUMNS)
+        df = pd.read_sql(
+            f"SELECT {columns} FROM {CUBE_TABLE} {where} ORDER BY DeviceGp = 'ALL', year_month, DeviceGp, EQP_ID",
+            conn
+        )
+    finally:
+        conn.close()
+
+    df["count"] = df["count"].astype("int32")
+    for col in ["mean", "median", "q3"]:
+        df[col] = df[col].astype("float32")
+    return df
+
+
+def cube_has_sketches(db_file):
+    """統計キューブの全行にスケッチがあるか確認する（旧形式のキューブは再作成が必要）"""
+    conn = sqlite3.connect(db_file)
+    try:
+        if not cube_exists(conn) or "sketch" not in get_columns(conn, CUBE_TABLE):
+            return False
+        total, missing = conn.execute(
+            f"SELECT COUNT(*), SUM(sketch IS NULL) FROM {CUBE_TABLE}"
+        ).fetchone()
+        return total > 0 and not missing
+    finally:
+        conn.close()
+
+
+def rollup_stats_from_cube(db_file, months, device=ALL_DEVICES):
+    """複数月をまとめたEQP_ID別の統計をスケッチの合算で求める（元データは読み込まない）
+
+    device=ALL の場合は全DeviceGpのスケッチを合算する。
+    件数・合計・平均は正確な値、中央値・第三四分位点はスケッチの相対誤差の範囲の近似値
+    （補間なしの順位による分位点に対する誤差）。
+    戻り値のカラム: EQP_ID, count, sum, mean, median, q3
+    """
+    months = list(months)
+    conn = sqlite3.connect(db_file)
+    try:
+        params = months[:]
+        device_filter = "AND DeviceGp != ?"
+        params.append(ALL_DEVICES)
+        if device != ALL_DEVICES:
+            device_filter = "AND DeviceGp = ?"
+            params[-1] = device
+        rows = pd.read_sql(
+            f"SELECT EQP_ID, count, sum, sketch FROM {CUBE_TABLE} "
+            f"WHERE year_month IN ({', '.join('?' for _ in months)}) {device_filter} AND sketch IS NOT NULL",
+            conn, params=params
+        )
+    finally:
+        conn.close()
+
+    columns = ["EQP_ID"] + STATS_COLUMNS
+    if rows.empty:
+        return pd.DataFrame(columns=columns)
+
+    codes, eqp_ids = pd.factorize(rows["EQP_ID"], sort=True)
+    totals, quantiles = merge_quantiles(codes, rows["sketch"].tolist(), len(eqp_ids))
+    sums = np.bincount(codes, weights=rows["sum"].to_numpy(), minlength=len(eqp_ids))
+    result = pd.DataFrame({
+        "EQP_ID": np.asarray(eqp_ids, dtype=object),
+        "count": totals.astype("int32"),
+        "sum": sums,
+        "mean": (sums / np.maximum(totals, 1)).astype("float32"),
+        "median": quantiles[0.5].astype("float32"),
+        "q3": quantiles[0.75].astype("float32"),
+    })
+    return result[columns]
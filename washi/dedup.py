@@ -0,0 +1,162 @@
+"""自然キーによる重複除外付きの差分追加（取り込み済みの行はスキップする）"""
+import sqlite3
+
+from washi.bulkload import bulk_load, quote_identifier, table_exists
+from washi.schema import DICT_COLUMNS, id_text, is_typed_table, typed_load_options
+
+# テーブルごとの自然キー（この組み合わせが同じ行は取り込み済みとみなす）
+NATURAL_KEYS = {
+    "LOG": ("LOT_ID", "OPE_NO", "EQP_ID", "STIME"),
+    "LOG2": ("LOT_ID", "OPE_NO", "EQP_ID", "OPE_START_DATETIME"),
+}
+
+# 差分判定に使う一時テーブル
+INCOMING_TABLE = "_incoming_keys"
+
+
+def natural_key_index_name(table_name):
+    """自然キーのインデックス名を返す"""
+    return f"idx_{table_name.lower()}_natural_key"
+
+
+def natural_key_index_sql(table_name, key_columns):
+    """自然キーのインデックス作成SQLを返す
+
+    既存データに重複があっても作成できるよう UNIQUE にはせず、重複の判定は取り込み時に行う。
+    """
+    cols = ", ".join(quote_identifier(col) for col in key_columns)
+    return (
+        f"CREATE INDEX IF NOT EXISTS {quote_identifier(natural_key_index_name(table_name))} "
+        f"ON {quote_identifier(table_name)} ({cols})"
+    )
+
+
+class NaturalKeyFilter:
+    """取り込み済みの行を除外する bulk_load の transform
+
+    チャンク内の重複を除いた後、自然キーが既存の行（同じ取り込みの前のチャンクを含む）と
+    一致するものを除外する。キーの比較は NULL 同士も一致とみなす（IS で比較）。
+    IDカラムは型付きスキーマの辞書と同じ表記（washi.schema.id_text）に揃えてから比較する。
+    encoder を指定すると、既存テーブルと同じ型付き表現に変換してから比較する。
+    sinks には除外後の元のチャンク（変換前）を受け取る関数を指定できる。
+    """
+
+    def __init__(self, table_name, key_columns, encoder=None, sinks=None):
+        self.table_name = table_name
+        self.key_columns = list(key_columns)
+        self.encoder = encoder
+        self.sinks = list(sinks or [])
+        self.inserted = 0
+        self.skipped = 0
+
+    def _existing_mask(self, conn, chunk):
+        """既存の行と自然キーが一致する行のマスクを返す"""
+        if not table_exists(conn, self.table_name):
+            return chunk.index.isin([])
+        table = quote_identifier(self.table_name)
+        conn.execute(natural_key_index_sql(self.table_name, self.key_columns))
+
+        # 既存テーブルと同じ型親和性の一時テーブルにキーを入れて比較する
+        key_list = ", ".join(quote_identifier(col) for col in self.key_columns)
+        conn.execute(f"DROP TABLE IF EXISTS temp.{INCOMING_TABLE}")
+        conn.execute(
+            f"CREATE TEMP TABLE {INCOMING_TABLE} AS "
+            f"SELECT 0 AS _row, {key_list} FROM {table} LIMIT 0"
+        )
+        placeholders = ", ".join("?" for _ in range(len(self.key_columns) + 1))
+        keys = chunk[self.key_columns].astype(object).where(chunk[self.key_columns].notna(), None)
+        conn.executemany(
+            f"INSERT INTO temp.{INCOMING_TABLE} VALUES ({placeholders})",
+            ((row, *values) for row, values in enumerate(keys.itertuples(index=False, name=None)))
+        )
+        conditions = " AND ".join(
+            f"l.{quote_identifier(col)} IS i.{quote_identifier(col)}" for col in self.key_columns
+        )
+        existing = [
+            row for (row,) in conn.execute(
+                f"SELECT i._row FROM temp.{INCOMING_TABLE} i "
+                f"WHERE EXISTS (SELECT 1 FROM {table} l WHERE {conditions})"
+            )
+        ]
+        conn.execute(f"DROP TABLE temp.{INCOMING_TABLE}")
+
+        mask = chunk.index.isin([])
+        mask[existing] = True
+        return mask
+
+    def __call__(self, conn, chunk):
+        """bulk_load の transform として使用する"""
+        total = len(chunk)
+        chunk = chunk.assign(**{col: id_text(chunk[col]) for col in chunk.columns if col in DICT_COLUMNS})
+        raw = chunk[~chunk.duplicated(subset=self.key_columns)]
+        encoded = self.encoder(conn, raw) if self.encoder is not None else raw
+
+        is_new = ~self._existing_mask(conn, encoded)
+        self.inserted += int(is_new.sum())
+        self.skipped += total - int(is_new.sum())
+
+        new_rows = raw[is_new]
+        for sink in self.sinks:
+            sink(new_rows)
+        return encoded[is_new]
+
+
+def append_new_rows(db_file, table_name, chunks, index_sqls=None, progress_callback=None,
+                    typed=None, sinks=None):
+    """自然キーで重複を除外しながらテーブルへ追加する
+
+    インデックスは削除せずに維持し（追加分のみ更新される）、自然キーのインデックスを使って判定する。
+    typed=None の場合は既存テーブルの形式（型付きかどうか）に合わせる。
+    戻り値は bulk_load の結果に inserted（追加行数）と skipped（スキップ行数）を加えた辞書。
+    自然キーが定義されていないテーブル（NATURAL_KEYS にないテーブル）は ValueError とする。
+    """
+    if table_name not in NATURAL_KEYS:
+        raise ValueError(f"差分追加に未対応のテーブルです: {table_name}（対応: {', '.join(NATURAL_KEYS)}）")
+    key_columns = NATURAL_KEYS[table_name]
+    if typed is None:
+        conn = sqlite3.connect(db_file)
+        try:
+            typed = is_typed_table(conn, table_name)
+        finally:
+            conn.close()
+
+    load_options = typed_load_options() if typed else {}
+    key_filter = NaturalKeyFilter(
+        table_name, key_columns, encoder=load_options.pop("transform", None), sinks=sinks
+    )
+    result = bulk_load(
+        db_file, table_name, chunks,
+        replace=False, index_sqls=list(index_sqls or []) + [natural_key_index_sql(table_name, key_columns)],
+        progress_callback=progress_callback, transform=key_filter, defer_indexes=False,
+        **load_options
+    )
+    result["inserted"] = key_filter.inserted
+    result["skipped"] = key_filter.skipped
+    print(f"[DEBUG] 差分追加: {table_name} 追加={key_filter.inserted}行, スキップ={key_filter.skipped}行")
+    return result
+
+
+if __name__ == "__main__":
+    import io
+    import os
+    import tempfile
+
+    import pandas as pd
+
+    from washi.bulkload import iter_frame_chunks
+    from washi.ingest import stream_csv_to_table
+
+    # 先頭チャンクのOPE_NOに欠損があるCSV（チャンクごとに型推定が変わる）
+    csv = "LOT_ID,OPE_START_DATETIME,WAIT_TIME,EQP_ID,OPE_NO,DeviceGp\n" + "".join(
+        f"L{i},2024-01-01 {i:02d}:00:00,1.0,E{i % 3},{'' if i == 1 else 1000 + i % 2},D\n" for i in range(8)
+    )
+    folder = tempfile.mkdtemp()
+    for typed in (False, True):
+        db_file = os.path.join(folder, f"dedup_{typed}.db")
+        stream_csv_to_table(io.BytesIO(csv.encode()), db_file, "LOG2", chunksize=2, typed=typed)
+
+        # 同じファイルを差分追加で再取り込み（CSVのストリーミング / DataFrameの一括読み込み）
+        streamed = stream_csv_to_table(io.BytesIO(csv.encode()), db_file, "LOG2", chunksize=2, dedup=True)
+        frame = append_new_rows(db_file, "LOG2", iter_frame_chunks(pd.read_csv(io.StringIO(csv)), 3))
+        print(f"[DEBUG] 型付き={typed}: 再取り込みの追加行数 ストリーミング={streamed['inserted']}, "
+              f"一括={frame['inserted']}（いずれも0であること）")
@@ -0,0 +1,580 @@
+"""FlowInfo から装置汎用化設定用の索引を作成する（setting アプリ）
+
+FlowInfo の1行は (TYPE, OPE_NO) ごとの使用可能装置（ALL_EQP_ID）と使用禁止装置
+（INHIBIT_EQP_ID）をスペース区切りで持つ。行ごとに文字列を分割する代わりに、
+列全体を分割して explode し、次の3つの表を1回の処理で作成する。
+
+- 装置別の明細: 装置ごとの (TYPE, OPE_NO, EQP_GRP_CONV, ...) と INHIBIT の判定
+- 設備グループ別の装置: EQP_GRP_CONV ごとの装置（重複なし）
+- 使用禁止装置: (TYPE, OPE_NO) ごとの使用禁止装置（同じキーの最初の行のみ）
+
+装置別の明細は装置名順・元の行順に並べ、装置ごとの開始位置を持つため、
+1台分の明細は二分探索とスライスで取り出せる。
+
+FlowInfo の保存時に索引をDBの EQP_CAPABILITY / EQP_GROUP_MEMBER テーブルへ
+FlowInfo のテーブル名（SNAPSHOT）ごとに保存しておくと、setting アプリや
+シミュレータはインデックス付きのクエリで装置の処理可能工程を引ける（StoredEquipmentIndex）。
+"""
+import hashlib
+import json
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from washi.bulkload import (
+    DEFAULT_PRAGMAS, apply_pragmas, drop_table_indexes, open_bulk_connection, quote_identifier, table_exists
+)
+from washi.indexes import get_columns
+
+# 装置名のカラム（設定CSVと同じ名前）
+EQUIPMENT_COLUMN = "設備名"
+
+# FlowInfo から読み込むカラム
+FLOWINFO_COLUMNS = ["TYPE", "OPE_NO", "EQP_GRP_CONV", "ALL_EQP_ID", "INHIBIT_EQP_ID", "EQP_ID"]
+
+# 保存先のテーブル（FlowInfo のテーブル名を SNAPSHOT 列に持つ）
+CAPABILITY_TABLE = "EQP_CAPABILITY"
+GROUP_MEMBER_TABLE = "EQP_GROUP_MEMBER"
+
+CREATE_CAPABILITY_SQLS = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {CAPABILITY_TABLE} (
+        SNAPSHOT TEXT NOT NULL,
+        EQP_ID TEXT NOT NULL,
+        TYPE TEXT NOT NULL,
+        OPE_NO TEXT NOT NULL,
+        EQP_GRP_CONV TEXT,
+        INHIBIT INTEGER NOT NULL,
+        ROW INTEGER NOT NULL
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {GROUP_MEMBER_TABLE} (
+        SNAPSHOT TEXT NOT NULL,
+        EQP_GRP_CONV TEXT NOT NULL,
+        EQP_ID TEXT
+    )
+    """,
+    # 装置→処理可能工程（元の行順）と、工程→処理可能装置の両方向で引けるようにする
+    # （後者はスナップショット間の比較でキーの照合にも使う）
+    f"CREATE INDEX IF NOT EXISTS idx_eqp_capability_eqp ON {CAPABILITY_TABLE} (SNAPSHOT, EQP_ID, ROW)",
+    f"CREATE INDEX IF NOT EXISTS idx_eqp_capability_step ON {CAPABILITY_TABLE} (SNAPSHOT, TYPE, OPE_NO, EQP_ID, INHIBIT)",
+    f"CREATE INDEX IF NOT EXISTS idx_eqp_group_member ON {GROUP_MEMBER_TABLE} (SNAPSHOT, EQP_GRP_CONV, EQP_ID)",
+]
+
+# 設定レコード（装置1台分の処理可能工程）のカラム
+RECORD_COLUMNS = [EQUIPMENT_COLUMN, "TYPE", "OPE_NO", "INHIBIT"]
+
+# スナップショット比較の変更区分と、1回に取得する行数
+DIFF_ADDED = "追加"
+DIFF_REMOVED = "削除"
+DIFF_CHANGED = "INHIBIT変更"
+DIFF_COLUMNS = ["CHANGE", "TYPE", "OPE_NO", "EQP_ID", "INHIBIT_OLD", "INHIBIT_NEW"]
+DIFF_FETCH_SIZE = 50_000
+
+# 装置別の明細に残すカラム（文字列はカテゴリ型にして保持する）
+DETAIL_COLUMNS = ["TYPE", "OPE_NO", "EQP_GRP_CONV", "INHIBIT_EQP_ID", "EQP_ID"]
+
+
+def explode_equipment(df, column):
+    """スペース区切りの装置リストのカラムを分割し、1装置1行に展開する（元の行番号は ROW 列）"""
+    lists = df[column].fillna("").astype(str).str.split()
+    exploded = df.drop(columns=[column]).assign(ROW=np.arange(len(df)), **{EQUIPMENT_COLUMN: lists})
+    return exploded.explode(EQUIPMENT_COLUMN, ignore_index=True).dropna(subset=[EQUIPMENT_COLUMN])
+
+
+class EquipmentIndex:
+    """FlowInfo の装置別・設備グループ別・使用禁止装置の索引"""
+
+    def __init__(self, df):
+        df = df[FLOWINFO_COLUMNS].reset_index(drop=True)
+
+        # 使用禁止装置（(TYPE, OPE_NO) ごとに最初の行を採用）
+        first_rows = df.drop_duplicates(["TYPE", "OPE_NO"], keep="first")
+        self.usage_keys = first_rows[["TYPE", "OPE_NO"]].reset_index(drop=True)
+        self.inhibits = explode_equipment(
+            first_rows[["TYPE", "OPE_NO", "INHIBIT_EQP_ID"]], "INHIBIT_EQP_ID"
+        ).drop(columns=["ROW"]).drop_duplicates(ignore_index=True)
+        inhibit_keys = pd.MultiIndex.from_frame(self.inhibits[["TYPE", "OPE_NO", EQUIPMENT_COLUMN]])
+
+        # 装置別の明細（装置名順・元の行順）
+        exploded = explode_equipment(df, "ALL_EQP_ID")
+        exploded["INHIBIT_EQP_ID"] = exploded["INHIBIT_EQP_ID"].fillna("")
+        exploded["EQP_ID"] = exploded["EQP_ID"].fillna("")
+        exploded["INHIBIT"] = pd.MultiIndex.from_frame(
+            exploded[["TYPE", "OPE_NO", EQUIPMENT_COLUMN]]
+        ).isin(inhibit_keys)
+        codes, self.equipment = pd.factorize(exploded[EQUIPMENT_COLUMN], sort=True)
+        order = np.argsort(codes, kind="stable")
+        self.details = exploded.iloc[order].reset_index(drop=True)
+        for column in DETAIL_COLUMNS:
+            self.details[column] = self.details[column].astype("category")
+        self.bounds = np.searchsorted(codes[order], np.arange(len(self.equipment) + 1))
+
+        # 設備グループ別の装置（装置のないグループも残す）
+        self.group_members = (
+            exploded[["EQP_GRP_CONV", EQUIPMENT_COLUMN]].drop_duplicates()
+            .sort_values(["EQP_GRP_CONV", EQUIPMENT_COLUMN], ignore_index=True)
+        )
+        self.group_names = list(df["EQP_GRP_CONV"].drop_duplicates())
+        print(f"[DEBUG] 装置索引: {len(df):,}行 → 装置 {len(self.equipment):,}台, "
+              f"明細 {len(self.details):,}行, 使用禁止 {len(self.inhibits):,}件")
+
+    def groups(self):
+        """設備グループ名の一覧（名前順）"""
+        return sorted(group for group in self.group_names if pd.notna(group))
+
+    def group_equipment(self, group):
+        """設備グループに属する装置の一覧（名前順）"""
+        members = self.group_members
+        return members.loc[members["EQP_GRP_CONV"] == group, EQUIPMENT_COLUMN].tolist()
+
+    def group_equipment_page(self, group, contains="", offset=0, limit=None):
+        """設備グループの装置を名前で絞り込み、1ページ分と該当件数を返す"""
+        members = self.group_members
+        names = members.loc[members["EQP_GRP_CONV"] == group, EQUIPMENT_COLUMN]
+        if contains:
+            names = names[names.str.contains(contains, regex=False)]
+        end = None if limit is None else offset + limit
+        return names.iloc[offset:end].tolist(), len(names)
+
+    def equipment_frame(self, equipment):
+        """装置1台分の設定レコード（設備名, TYPE, OPE_NO, INHIBIT）のDataFrame"""
+        details = self.equipment_details(equipment)
+        return pd.DataFrame({
+            EQUIPMENT_COLUMN: equipment,
+            "TYPE": details["TYPE"].astype(str).to_numpy(),
+            "OPE_NO": details["OPE_NO"].astype(str).to_numpy(),
+            "INHIBIT": details["INHIBIT"].to_numpy(dtype=bool),
+        }, columns=RECORD_COLUMNS)
+
+    def capability_frame(self, equipment_list):
+        """複数装置の設定レコード（設備名, TYPE, OPE_NO, INHIBIT）のDataFrame"""
+        details = self.details[self.details[EQUIPMENT_COLUMN].isin(list(equipment_list))]
+        return pd.DataFrame({
+            EQUIPMENT_COLUMN: details[EQUIPMENT_COLUMN].to_numpy(),
+            "TYPE": details["TYPE"].astype(str).to_numpy(),
+            "OPE_NO": details["OPE_NO"].astype(str).to_numpy(),
+            "INHIBIT": details["INHIBIT"].to_numpy(dtype=bool),
+        }, columns=RECORD_COLUMNS)
+
+    def equipment_details(self, equipment):
+        """装置1台分の明細（DataFrame、元の行順）"""
+        position = int(np.searchsorted(self.equipment, equipment))
+        if position >= len(self.equipment) or self.equipment[position] != equipment:
+            return self.details.iloc[0:0]
+        return self.details.iloc[self.bounds[position]:self.bounds[position + 1]]
+
+    def equipment_records(self, equipment):
+        """装置1台分の設定レコード（設備名, TYPE, OPE_NO, INHIBIT）のリスト"""
+        details = self.equipment_details(equipment)
+        return [
+            {EQUIPMENT_COLUMN: equipment, "TYPE": type_val, "OPE_NO": ope_no, "INHIBIT": bool(inhibit)}
+            for type_val, ope_no, inhibit in zip(details["TYPE"], details["OPE_NO"], details["INHIBIT"])
+        ]
+
+    def to_mappings(self):
+        """従来の3つの辞書（装置別, 設備グループ別, (TYPE, OPE_NO)別の使用禁止装置）に変換する"""
+        equipment_mapping = {}
+        for position, equipment in enumerate(self.equipment):
+            details = self.details.iloc[self.bounds[position]:self.bounds[position + 1]]
+            equipment_mapping[equipment] = [
+                {column: record[column] for column in DETAIL_COLUMNS}
+                for record in details[DETAIL_COLUMNS].astype(object).to_dict("records")
+            ]
+        group_equipment_mapping = {group: set() for group in self.group_names}
+        for group, equipment in self.group_members.itertuples(index=False):
+            group_equipment_mapping[group].add(equipment)
+        equipment_usage = {key: set() for key in self.usage_keys.itertuples(index=False, name=None)}
+        for type_val, ope_no, equipment in self.inhibits.itertuples(index=False):
+            equipment_usage[(type_val, ope_no)].add(equipment)
+        return equipment_mapping, group_equipment_mapping, equipment_usage
+
+
+def read_flowinfo(conn, table_name):
+    """FlowInfo から索引の作成に必要なカラムを読み込む（カラムが揃っていない場合はNone）"""
+    if not set(FLOWINFO_COLUMNS) <= set(get_columns(conn, table_name)):
+        return None
+    return pd.read_sql_query(
+        f"SELECT {', '.join(FLOWINFO_COLUMNS)} FROM {quote_identifier(table_name)} "
+        "WHERE TYPE IS NOT NULL AND OPE_NO IS NOT NULL",
+        conn
+    )
+
+
+def ensure_capability_tables(conn):
+    """索引の保存先テーブルとインデックスを作成する"""
+    for sql in CREATE_CAPABILITY_SQLS:
+        conn.execute(sql)
+
+
+def drop_capability_index(conn, snapshot):
+    """FlowInfo 1テーブル分の保存済み索引を削除する"""
+    if table_exists(conn, CAPABILITY_TABLE):
+        conn.execute(f"DELETE FROM {CAPABILITY_TABLE} WHERE SNAPSHOT = ?", (snapshot,))
+    if table_exists(conn, GROUP_MEMBER_TABLE):
+        conn.execute(f"DELETE FROM {GROUP_MEMBER_TABLE} WHERE SNAPSHOT = ?", (snapshot,))
+
+
+def has_capability_index(conn, snapshot):
+    """FlowInfo の索引が保存済みか確認する"""
+    if not table_exists(conn, GROUP_MEMBER_TABLE):
+        return False
+    row = conn.execute(
+        f"SELECT 1 FROM {GROUP_MEMBER_TABLE} WHERE SNAPSHOT = ? LIMIT 1", (snapshot,)
+    ).fetchone()
+    return row is not None
+
+
+def save_capability_index(db_file, snapshot):
+    """FlowInfo テーブルから索引を作成し、DBに保存する（同じ SNAPSHOT の既存分は置き換える）
+
+    戻り値: 保存した明細の行数（FlowInfo に必要なカラムがない場合はNone）
+    """
+    start = time.perf_counter()
+    conn = open_bulk_connection(db_file)
+    try:
+        df = read_flowinfo(conn, snapshot)
+        if df is None:
+            print(f"[DEBUG] 装置索引: {snapshot} に必要なカラムがないためスキップします")
+            return None
+        index = EquipmentIndex(df)
+        details = index.details
+        groups = details["EQP_GRP_CONV"].astype(object)
+        capabilities = zip(
+            details[EQUIPMENT_COLUMN].tolist(),
+            details["TYPE"].astype(str).tolist(), details["OPE_NO"].astype(str).tolist(),
+            groups.where(groups.notna(), None).tolist(),
+            details["INHIBIT"].astype(int).tolist(), details["ROW"].astype(int).tolist(),
+        )
+        # 装置のない設備グループは EQP_ID を NULL として残す
+        members = pd.DataFrame({"EQP_GRP_CONV": index.group_names}).merge(
+            index.group_members, on="EQP_GRP_CONV", how="left"
+        ).dropna(subset=["EQP_GRP_CONV"])
+
+        conn.execute("BEGIN IMMEDIATE")
+        ensure_capability_tables(conn)
+        drop_capability_index(conn, snapshot)
+        # インデックスは書き込み後にまとめて作成する（bulk_load と同じ）
+        drop_table_indexes(conn, CAPABILITY_TABLE)
+        conn.executemany(
+            f"INSERT INTO {CAPABILITY_TABLE} (SNAPSHOT, EQP_ID, TYPE, OPE_NO, EQP_GRP_CONV, INHIBIT, ROW) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((snapshot, *row) for row in capabilities)
+        )
+        conn.executemany(
+            f"INSERT INTO {GROUP_MEMBER_TABLE} (SNAPSHOT, EQP_GRP_CONV, EQP_ID) VALUES (?, ?, ?)",
+            (
+                (snapshot, str(group), None if pd.isna(equipment) else equipment)
+                for group, equipment in members.itertuples(index=False)
+            )
+        )
+        ensure_capability_tables(conn)
+        conn.execute("COMMIT")
+        conn.execute(f"ANALYZE {CAPABILITY_TABLE}")
+        conn.execute(f"ANALYZE {GROUP_MEMBER_TABLE}")
+        apply_pragmas(conn, DEFAULT_PRAGMAS)
+        print(f"[DEBUG] 装置索引を保存: {snapshot} {len(details):,}行, {time.perf_counter() - start:.1f}秒")
+        return len(details)
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+class StoredEquipmentIndex:
+    """DBに保存済みの索引を参照する（EquipmentIndex と同じ参照メソッドを持つ）
+
+    接続は参照ごとに開くため、Streamlit のキャッシュにそのまま保持できる。
+    """
+
+    def __init__(self, db_file, snapshot):
+        self.db_file = db_file
+        self.snapshot = snapshot
+
+    def _query(self, sql, params=()):
+        conn = sqlite3.connect(self.db_file)
+        try:
+            return conn.execute(sql, (self.snapshot, *params)).fetchall()
+        finally:
+            conn.close()
+
+    def groups(self):
+        """設備グループ名の一覧（名前順）"""
+        rows = self._query(
+            f"SELECT DISTINCT EQP_GRP_CONV FROM {GROUP_MEMBER_TABLE} WHERE SNAPSHOT = ? ORDER BY EQP_GRP_CONV"
+        )
+        return [group for (group,) in rows]
+
+    def group_equipment(self, group):
+        """設備グループに属する装置の一覧（名前順）"""
+        rows = self._query(
+            f"SELECT EQP_ID FROM {GROUP_MEMBER_TABLE} "
+            "WHERE SNAPSHOT = ? AND EQP_GRP_CONV = ? AND EQP_ID IS NOT NULL ORDER BY EQP_ID",
+            (str(group),)
+        )
+        return [equipment for (equipment,) in rows]
+
+    def group_equipment_page(self, group, contains="", offset=0, limit=None):
+        """設備グループの装置を名前で絞り込み、1ページ分と該当件数を返す"""
+        condition = "SNAPSHOT = ? AND EQP_GRP_CONV = ? AND EQP_ID IS NOT NULL AND instr(EQP_ID, ?) > 0"
+        params = (str(group), contains or "")
+        (total,), = self._query(f"SELECT COUNT(*) FROM {GROUP_MEMBER_TABLE} WHERE {condition}", params)
+        rows = self._query(
+            f"SELECT EQP_ID FROM {GROUP_MEMBER_TABLE} WHERE {condition} ORDER BY EQP_ID LIMIT ? OFFSET ?",
+            (*params, -1 if limit is None else int(limit), int(offset))
+        )
+        return [equipment for (equipment,) in rows], total
+
+    def equipment_frame(self, equipment):
+        """装置1台分の設定レコード（設備名, TYPE, OPE_NO, INHIBIT）のDataFrame"""
+        frame = pd.DataFrame(
+            self._query(
+                f"SELECT TYPE, OPE_NO, INHIBIT FROM {CAPABILITY_TABLE} WHERE SNAPSHOT = ? AND EQP_ID = ? ORDER BY ROW",
+                (equipment,)
+            ),
+            columns=["TYPE", "OPE_NO", "INHIBIT"]
+        ).astype({"INHIBIT": bool})
+        frame.insert(0, EQUIPMENT_COLUMN, equipment)
+        return frame[RECORD_COLUMNS]
+
+    def capability_frame(self, equipment_list):
+        """複数装置の設定レコード（設備名, TYPE, OPE_NO, INHIBIT）のDataFrame"""
+        frame = pd.DataFrame(
+            self._query(
+                f"SELECT EQP_ID, TYPE, OPE_NO, INHIBIT FROM {CAPABILITY_TABLE} "
+                "WHERE SNAPSHOT = ? AND EQP_ID IN (SELECT value FROM json_each(?)) ORDER BY EQP_ID, ROW",
+                (json.dumps([str(equipment) for equipment in equipment_list]),)
+            ),
+            columns=RECORD_COLUMNS
+        )
+        return frame.astype({"INHIBIT": bool})
+
+    def equipment_records(self, equipment):
+        """装置1台分の設定レコード（設備名, TYPE, OPE_NO, INHIBIT）のリスト"""
+        rows = self._query(
+            f"SELECT TYPE, OPE_NO, INHIBIT FROM {CAPABILITY_TABLE} WHERE SNAPSHOT = ? AND EQP_ID = ? ORDER BY ROW",
+            (equipment,)
+        )
+        return [
+            {EQUIPMENT_COLUMN: equipment, "TYPE": type_val, "OPE_NO": ope_no, "INHIBIT": bool(inhibit)}
+            for type_val, ope_no, inhibit in rows
+        ]
+
+
+def load_step_equipment(conn, snapshot):
+    """(TYPE, OPE_NO) ごとの使用可能な（使用禁止でない）装置の集合を返す（シミュレータ用）"""
+    eligible = {}
+    rows = conn.execute(
+        f"SELECT TYPE, OPE_NO, EQP_ID FROM {CAPABILITY_TABLE} WHERE SNAPSHOT = ? AND INHIBIT = 0",
+        (snapshot,)
+    )
+    for type_val, ope_no, equipment in rows:
+        eligible.setdefault((type_val, ope_no), set()).add(equipment)
+    return eligible
+
+
+def filter_records(records, type_val=None, ope_no=None, inhibit=None):
+    """設定レコードを TYPE・OPE_NO・INHIBIT で絞り込む（None は絞り込みなし）"""
+    mask = np.ones(len(records), dtype=bool)
+    if type_val is not None:
+        mask &= (records["TYPE"] == type_val).to_numpy()
+    if ope_no is not None:
+        mask &= (records["OPE_NO"] == ope_no).to_numpy()
+    if inhibit is not None:
+        mask &= (records["INHIBIT"] == inhibit).to_numpy()
+    return records[mask]
+
+
+def page_count(total, page_size):
+    """ページ数（0件の場合も1ページ）"""
+    return max(1, -(-int(total) // page_size))
+
+
+def page_key(prefix, index):
+    """表示中の行（元のインデックス）ごとに異なる編集表のキーを返す
+
+    st.data_editor の編集内容は行の位置で保持されるため、フィルタ結果が変わって
+    同じページに別の行が並んだ場合は別のキーにして、前の編集が別の行に適用されないようにする。
+    """
+    digest = hashlib.md5(np.asarray(index, dtype=np.int64).tobytes()).hexdigest()[:12]
+    return f"{prefix}_{digest}"
+
+
+def ensure_capability_index(db_file, snapshot):
+    """FlowInfo の索引が未作成（索引の導入前に保存されたテーブル）の場合は作成する"""
+    conn = sqlite3.connect(db_file)
+    try:
+        stored = has_capability_index(conn, snapshot)
+    finally:
+        conn.close()
+    if not stored:
+        save_capability_index(db_file, snapshot)
+
+
+def diff_queries():
+    """スナップショット比較のクエリ（追加・削除・INHIBIT変更）
+
+    キー (TYPE, OPE_NO, EQP_ID) ごとに、片方のスナップショットの行から
+    もう片方をインデックスで照合するため、結果は一時テーブルを作らずに順に返される。
+    """
+    def missing(side, other, change):
+        return f"""
+            SELECT '{change}', a.TYPE, a.OPE_NO, a.EQP_ID,
+                   {"MAX(a.INHIBIT), NULL" if side == "old" else "NULL, MAX(a.INHIBIT)"}
+            FROM {CAPABILITY_TABLE} a
+            WHERE a.SNAPSHOT = :{side} AND NOT EXISTS (
+                SELECT 1 FROM {CAPABILITY_TABLE} b
+                WHERE b.SNAPSHOT = :{other} AND b.TYPE = a.TYPE AND b.OPE_NO = a.OPE_NO AND b.EQP_ID = a.EQP_ID
+            )
+            GROUP BY a.TYPE, a.OPE_NO, a.EQP_ID
+        """
+
+    changed = f"""
+        SELECT '{DIFF_CHANGED}', a.TYPE, a.OPE_NO, a.EQP_ID, MAX(b.INHIBIT), MAX(a.INHIBIT)
+        FROM {CAPABILITY_TABLE} a
+        JOIN {CAPABILITY_TABLE} b
+          ON b.SNAPSHOT = :old AND b.TYPE = a.TYPE AND b.OPE_NO = a.OPE_NO AND b.EQP_ID = a.EQP_ID
+        WHERE a.SNAPSHOT = :new
+        GROUP BY a.TYPE, a.OPE_NO, a.EQP_ID
+        HAVING MAX(b.INHIBIT) <> MAX(a.INHIBIT)
+    """
+    return [
+        missing("new", "old", DIFF_ADDED),
+        missing("old", "new", DIFF_REMOVED),
+        changed,
+    ]
+
+
+def iter_snapshot_diff(db_file, old_snapshot, new_snapshot, batch_size=DIFF_FETCH_SIZE):
+    """2つの FlowInfo の処理可能工程の差分を DataFrame のチャンクで順に返す
+
+    列: CHANGE（追加/削除/INHIBIT変更）, TYPE, OPE_NO, EQP_ID, INHIBIT_OLD, INHIBIT_NEW
+    比較はDB上の装置索引（EQP_CAPABILITY）で行い、両方のテーブルを読み込むことはない。
+    """
+    for snapshot in (old_snapshot, new_snapshot):
+        ensure_capability_index(db_file, snapshot)
+    conn = sqlite3.connect(db_file)
+    try:
+        params = {"old": old_snapshot, "new": new_snapshot}
+        for query in diff_queries():
+            cursor = conn.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield pd.DataFrame(rows, columns=DIFF_COLUMNS)
+    finally:
+        conn.close()
+
+
+def legacy_mappings(df):
+    """従来の iterrows による3つの辞書の作成（比較用）"""
+    equipment_mapping = {}
+    for _, row in df.iterrows():
+        all_eqp = row['ALL_EQP_ID'] if pd.notna(row['ALL_EQP_ID']) else ""
+        for equipment in (all_eqp.split() if all_eqp else []):
+            equipment_mapping.setdefault(equipment, []).append({
+                'TYPE': row['TYPE'],
+                'OPE_NO': row['OPE_NO'],
+                'EQP_GRP_CONV': row['EQP_GRP_CONV'],
+                'INHIBIT_EQP_ID': row['INHIBIT_EQP_ID'] if pd.notna(row['INHIBIT_EQP_ID']) else "",
+                'EQP_ID': row['EQP_ID'] if pd.notna(row['EQP_ID']) else ""
+            })
+    group_equipment_mapping = {}
+    for _, row in df.iterrows():
+        all_eqp = row['ALL_EQP_ID'] if pd.notna(row['ALL_EQP_ID']) else ""
+        group_equipment_mapping.setdefault(row['EQP_GRP_CONV'], set()).update(all_eqp.split() if all_eqp else [])
+    equipment_usage = {}
+    for _, row in df.iterrows():
+        inhibit_eqp = row['INHIBIT_EQP_ID'] if pd.notna(row['INHIBIT_EQP_ID']) else ""
+        key = (row['TYPE'], row['OPE_NO'])
+        if key not in equipment_usage:
+            equipment_usage[key] = set(inhibit_eqp.split() if inhibit_eqp else [])
+    return equipment_mapping, group_equipment_mapping, equipment_usage
+
+
+def make_synthetic_flowinfo(n_rows, n_eqps=3_000, n_groups=300, n_types=50, seed=0):
+    """ベンチマーク用の合成FlowInfo（空欄・重複キーを含む）"""
+    rng = np.random.default_rng(seed)
+    group = rng.integers(0, n_groups, n_rows)
+    per_group = n_eqps // n_groups
+    members = [
+        " ".join(f"EQ{g * per_group + i}" for i in rng.choice(per_group, rng.integers(0, per_group + 1), replace=False))
+        for g in group
+    ]
+    inhibits = [" ".join(eqps.split()[:rng.integers(0, 3)]) for eqps in members]
+    df = pd.DataFrame({
+        "TYPE": np.char.add("T", rng.integers(0, n_types, n_rows).astype(str)),
+        "OPE_NO": np.char.add("OPE", rng.integers(0, n_rows // 10 + 1, n_rows).astype(str)),
+        "EQP_GRP_CONV": np.char.add("GRP", group.astype(str)),
+        "ALL_EQP_ID": members,
+        "INHIBIT_EQP_ID": inhibits,
+        "EQP_ID": np.char.add("EQ", rng.integers(0, n_eqps, n_rows).astype(str)),
+    })
+    # 空欄（NULL）を混ぜる
+    for column in ("ALL_EQP_ID", "INHIBIT_EQP_ID", "EQP_ID"):
+        df.loc[rng.random(n_rows) < 0.05, column] = None
+    return df
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    from washi.bulkload import bulk_load, iter_frame_chunks
+
+    for n_rows in (20_000, 300_000):
+        df = make_synthetic_flowinfo(n_rows)
+        start = time.perf_counter()
+        index = EquipmentIndex(df)
+        indexed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        expected = legacy_mappings(df)
+        legacy = time.perf_counter() - start
+        print(f"[DEBUG] {n_rows:,}行: 索引 {indexed:.2f}秒, iterrows {legacy:.2f}秒 ({legacy / indexed:.0f}倍)")
+
+        # 3つの辞書が従来の処理と一致することを確認
+        for name, actual, reference in zip(
+            ("装置別", "設備グループ別", "使用禁止"), index.to_mappings(), expected
+        ):
+            print(f"[DEBUG]   {name}: 一致={actual == reference}")
+
+    # DBに保存した索引の参照（FlowInfo 保存時に作成される）
+    db_file = os.path.join(tempfile.mkdtemp(), "flowinfo.db")
+    bulk_load(db_file, "FlowInfo_20240101", iter_frame_chunks(df))
+    save_capability_index(db_file, "FlowInfo_20240101")
+    stored = StoredEquipmentIndex(db_file, "FlowInfo_20240101")
+    sample = list(index.equipment[:200])
+    start = time.perf_counter()
+    matched = all(stored.equipment_records(equipment) == index.equipment_records(equipment) for equipment in sample)
+    elapsed = (time.perf_counter() - start) / len(sample)
+    print(f"[DEBUG] 保存済み索引: 1台あたり {elapsed * 1000:.2f}ミリ秒（照合を含む）, 一致={matched}, "
+          f"設備グループ一致={stored.groups() == index.groups()}")
+
+    # 翌日分（一部の行で装置追加・使用禁止解除）との比較
+    changed = df.copy()
+    rows = np.random.default_rng(1).choice(len(changed), 2_000, replace=False)
+    changed.loc[rows[:1_000], "ALL_EQP_ID"] = changed.loc[rows[:1_000], "ALL_EQP_ID"].fillna("") + " EQ_NEW"
+    changed.loc[rows[1_000:], "INHIBIT_EQP_ID"] = None
+    bulk_load(db_file, "FlowInfo_20240102", iter_frame_chunks(changed))
+    save_capability_index(db_file, "FlowInfo_20240102")
+    start = time.perf_counter()
+    diff = pd.concat(iter_snapshot_diff(db_file, "FlowInfo_20240101", "FlowInfo_20240102"))
+    print(f"[DEBUG] スナップショット比較: {time.perf_counter() - start:.1f}秒, "
+          f"{diff['CHANGE'].value_counts().to_dict()}")
+
+    # INHIBIT で絞り込んだページの編集: 1行を変更して書き戻すとページの行が入れ替わり、キーも変わる
+    records = pd.DataFrame(index.equipment_records(index.equipment[0]), columns=RECORD_COLUMNS)
+    records["INHIBIT"] = np.arange(len(records)) % 2 == 0
+    page = filter_records(records, inhibit=True).iloc[:10]
+    key = page_key("record_editor", page.index)
+    records.loc[page.index[0], "INHIBIT"] = False
+    next_page = filter_records(records, inhibit=True).iloc[:10]
+    print(f"[DEBUG] 編集表のキー: 書き戻し後に変更={page_key('record_editor', next_page.index) != key}, "
+          f"同じ行では同じ={page_key('record_editor', page.index) == key}")
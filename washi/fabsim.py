@@ -0,0 +1,851 @@
+"""装置汎用化シミュレーションの参照実装（離散イベントシミュレーション）
+
+sim_enc.sim と同じ sim(database_path, parameter_path, equipment_path) で呼び出せ、
+Windows用の拡張モジュールがない環境（Linuxの計算ノード等）でもシミュレーションできる。
+
+- 工程順（ルート）: uflow（合同フロー）から作成し、ない場合はLOGの処理順から推定する
+- 処理可能な装置: 最新の FlowInfo（ALL_EQP_ID から INHIBIT_EQP_ID を除外）に装置汎用化設定CSVを適用する
+- 処理時間: パラメータファイルの process_time、ない場合はLOGの RUN_TIME の中央値
+- ロット投入: plan（投入計画）、ない場合はLOGの各ロットを最初の処理から最後の処理まで再現する
+- バッチ処理: eqp_batch（同時着工数）の装置は同じOPE_NOのロットをまとめて処理する（washi.batching）
+- 制約時間: Qtime の区間内にあるロットは期限の早い順に優先して着工する（washi.qtime）
+
+イベントはヒープで時刻順に処理し、ロット・装置の状態はnumpy配列で保持する。
+装置の割り当ては到着順（Q-time区間内のロットは期限順）で、空いている装置が複数あれば処理時間の短い装置を選ぶ。
+時間はLOGの RUN_TIME / WAIT_TIME と同じ単位で扱い、結果の WAIT_TIME も同じ単位で出力する。
+"""
+import heapq
+import itertools
+import os
+import pickle
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from washi.batching import (
+    DEFAULT_BATCH_POLICY, BatchQueue, choose_batch_equipment, fill_threshold
+)
+from washi.bulkload import quote_identifier, table_exists
+from washi.equipment import has_capability_index, load_step_equipment
+from washi.indexes import find_column, get_columns
+from washi.qtime import QtimeIndex, load_qtime_rules
+from washi.queries import LOG_COLUMNS, build_log_query
+from washi.schema import decoded_view_name, is_typed_table
+
+# スキーマが決まっていないテーブルのカラム候補（先頭から順に探す）
+PLAN_TIME_COLUMNS = ["RELEASE_DATETIME", "START_DATETIME", "PLAN_DATE", "START_DATE", "DATE", "STIME", "投入日時", "投入日", "日付"]
+PLAN_TYPE_COLUMNS = ["PROD_TYPE", "TYPE", "製品", "品種"]
+PLAN_QTY_COLUMNS = ["LOT_QTY", "LOT_COUNT", "QTY", "ロット数", "投入数", "数量"]
+UFLOW_TYPE_COLUMNS = ["PROD_TYPE", "TYPE", "製品", "品種"]
+UFLOW_ORDER_COLUMNS = ["SEQ_NO", "SEQ", "STEP_NO", "STEP", "ORDER_NO", "順番", "NO"]
+UFLOW_OPE_COLUMNS = ["OPE_NO", "工程"]
+BATCH_EQP_COLUMNS = ["EQP_ID", "設備名", "装置", "EQP"]
+BATCH_GROUP_COLUMNS = ["EQP_GRP_CONV", "EQP_GRP", "EQP_GROUP", "設備グループ"]
+BATCH_MAX_COLUMNS = ["MAX_BATCH", "MAX_BATCH_SIZE", "BATCH_SIZE", "MAX_LOT", "MAX_LOT_NUM", "CAPACITY",
+                     "同時着工数", "最大着工数", "最大同時着工数"]
+BATCH_MIN_COLUMNS = ["MIN_BATCH", "MIN_BATCH_SIZE", "MIN_LOT", "MIN_LOT_NUM", "最小着工数", "最小同時着工数"]
+
+# パラメータファイル（pickleの辞書）のキー
+PROCESS_TIME_KEY = "process_time"      # DataFrame: TYPE, OPE_NO, EQP_ID, RUN_TIME
+TRANSFER_TIME_KEY = "transfer_time"    # 工程間の搬送時間（LOGの時間単位）
+TIME_UNIT_KEY = "time_unit_seconds"    # LOGの時間単位（秒）
+BATCH_POLICY_KEY = "batch_policy"      # バッチの着工方針（washi.batching.BATCH_POLICIES）
+BATCH_MAX_WAIT_KEY = "batch_max_wait_seconds"  # バッチを待つ最大時間（秒）
+PROCESS_TIME_COLUMNS = ["TYPE", "OPE_NO", "EQP_ID", "RUN_TIME"]
+
+# LOGの時間単位の候補（秒・分・時間）と推定できない場合の既定値
+TIME_UNITS = (1, 60, 3600)
+DEFAULT_TIME_UNIT = 60
+
+# バッチを待つ最大時間の既定値（秒）
+DEFAULT_BATCH_MAX_WAIT = 3600
+
+# 処理時間が求められない場合の既定値（LOGの時間単位）
+DEFAULT_RUN_TIME = 1.0
+
+# 結果をまとめて出力する行数
+OUTPUT_BATCH_SIZE = 100_000
+
+# イベントの種類
+ARRIVE = 0
+FINISH = 1
+BATCH_FINISH = 2
+BATCH_WAKE = 3
+
+# 読み込み時に1回に取得する行数
+FETCH_BATCH_SIZE = 200_000
+
+
+def read_query(conn, query, schema=None):
+    """クエリ結果をpolarsのDataFrameとして読み込む"""
+    batches = list(pl.read_database(
+        query, conn, iter_batches=True, batch_size=FETCH_BATCH_SIZE, schema_overrides=schema,
+    ))
+    if not batches:
+        return pl.DataFrame(schema=schema)
+    return pl.concat(batches, how="vertical_relaxed")
+
+
+def parse_datetime(column):
+    """文字列の日時カラムをDatetimeに変換する式"""
+    return pl.col(column).cast(pl.String).str.to_datetime(strict=False, time_unit="us")
+
+
+def log_source(conn):
+    """LOGの読み込み元（型付きスキーマの場合は復号ビュー）"""
+    if is_typed_table(conn, "LOG") and table_exists_or_view(conn, decoded_view_name("LOG")):
+        return decoded_view_name("LOG")
+    return "LOG"
+
+
+def load_log(conn, columns=LOG_COLUMNS, sample_lots=None):
+    """LOGを読み込む（型付きスキーマの場合は復号ビューから読み込む）
+
+    columns で読み込むカラムを限定できる（STIME を含む場合はDatetimeに変換する）。
+    sample_lots を指定すると先頭から指定数のロットのみを読み込む。
+    """
+    source = log_source(conn)
+    available = set(get_columns(conn, source))
+    schema = {col: pl.Float64 if col in ("RUN_TIME", "WAIT_TIME") else pl.String for col in columns}
+    selected = [col for col in columns if col in available]
+    log = read_query(
+        conn, build_log_query(source, selected, sample_lots=sample_lots),
+        {col: schema[col] for col in selected},
+    )
+    for col in columns:
+        if col not in log.columns:
+            log = log.with_columns(pl.lit(None, dtype=schema[col]).alias(col))
+    if "STIME" in columns:
+        log = log.with_columns(parse_datetime("STIME").alias("STIME")).filter(pl.col("STIME").is_not_null())
+    print(f"[DEBUG] LOG読み込み: {source} {len(log):,}行")
+    return log.select(columns)
+
+
+def table_exists_or_view(conn, name):
+    """テーブルまたはビューの存在を確認する"""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def infer_time_unit(log):
+    """LOGの RUN_TIME / WAIT_TIME の単位（秒）を推定する
+
+    同じロットの連続する処理の開始時刻の間隔は、前の処理時間と次の待ち時間の和に近いため、
+    その比に最も近い単位（秒・分・時間）を選ぶ。
+    """
+    steps = log.select("LOT_ID", "STIME", "RUN_TIME", "WAIT_TIME").drop_nulls().sort(["LOT_ID", "STIME"])
+    steps = steps.with_columns(
+        (pl.col("STIME").shift(-1).over("LOT_ID") - pl.col("STIME")).dt.total_seconds().alias("gap"),
+        (pl.col("RUN_TIME") + pl.col("WAIT_TIME").shift(-1).over("LOT_ID")).alias("elapsed"),
+    ).filter((pl.col("gap") > 0) & (pl.col("elapsed") > 0))
+    if steps.is_empty():
+        return DEFAULT_TIME_UNIT
+    ratio = steps["gap"].median() / steps["elapsed"].median()
+    return min(TIME_UNITS, key=lambda unit: abs(np.log(ratio / unit)))
+
+
+def load_routes(conn, log):
+    """製品TYPEごとの工程順（OPE_NOのリスト）を返す"""
+    if table_exists(conn, "uflow"):
+        columns = get_columns(conn, "uflow")
+        type_col = find_column(columns, UFLOW_TYPE_COLUMNS)
+        order_col = find_column(columns, UFLOW_ORDER_COLUMNS)
+        ope_col = find_column(columns, UFLOW_OPE_COLUMNS)
+        if type_col and order_col and ope_col:
+            flow = pd.read_sql(
+                f"SELECT {quote_identifier(type_col)} AS TYPE, {quote_identifier(order_col)} AS SEQ, "
+                f"{quote_identifier(ope_col)} AS OPE_NO FROM uflow",
+                conn
+            ).dropna()
+            flow["SEQ"] = pd.to_numeric(flow["SEQ"], errors="coerce")
+            flow = flow.dropna().sort_values(["TYPE", "SEQ"])
+            routes = {
+                str(type_val): list(dict.fromkeys(group["OPE_NO"].astype(str)))
+                for type_val, group in flow.groupby("TYPE", sort=False)
+            }
+            if routes:
+                print(f"[DEBUG] 工程順: uflow から{len(routes)}種類")
+                return routes
+
+    # LOGで処理数が最も多いロットの処理順を、そのTYPEの工程順とみなす
+    lots = log.drop_nulls("PROD_TYPE").group_by("PROD_TYPE", "LOT_ID").len()
+    representative = lots.sort(["PROD_TYPE", "len", "LOT_ID"], descending=[False, True, False]).unique(
+        "PROD_TYPE", keep="first", maintain_order=True
+    )
+    steps = log.join(representative.select("PROD_TYPE", "LOT_ID"), on=["PROD_TYPE", "LOT_ID"]).sort(["PROD_TYPE", "STIME"])
+    routes = {}
+    for (type_val,), group in steps.group_by("PROD_TYPE", maintain_order=True):
+        routes[str(type_val)] = list(dict.fromkeys(group["OPE_NO"].to_list()))
+    print(f"[DEBUG] 工程順: LOGから{len(routes)}種類を推定")
+    return routes
+
+
+def latest_flowinfo_table(conn):
+    """最新の FlowInfo_YYYYMMDD テーブル名を返す（なければNone）"""
+    rows = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'FlowInfo_%'"
+    ).fetchall()
+    return max((name for (name,) in rows), default=None)
+
+
+def load_eligibility(conn, log):
+    """(TYPE, OPE_NO) ごとの処理可能な装置の集合を返す"""
+    eligible = {}
+    table = latest_flowinfo_table(conn)
+    if table is not None and has_capability_index(conn, table):
+        # FlowInfo の保存時に作成した装置索引があれば文字列の分割は不要
+        eligible = load_step_equipment(conn, table)
+        print(f"[DEBUG] 処理可能な装置: {table} の装置索引から{len(eligible):,}件")
+    elif table is not None:
+        flow = pd.read_sql(
+            f"SELECT TYPE, OPE_NO, ALL_EQP_ID, INHIBIT_EQP_ID FROM {quote_identifier(table)} "
+            "WHERE TYPE IS NOT NULL AND OPE_NO IS NOT NULL",
+            conn
+        )
+        # 使用禁止装置は装置索引と同じく (TYPE, OPE_NO) ごとに最初の行を採用する
+        inhibits = {}
+        for type_val, ope_no, all_eqp, inhibit in flow.itertuples(index=False):
+            key = (str(type_val), str(ope_no))
+            eligible.setdefault(key, set()).update(all_eqp.split() if isinstance(all_eqp, str) else ())
+            inhibits.setdefault(key, set(inhibit.split()) if isinstance(inhibit, str) else set())
+        for key, inhibit_set in inhibits.items():
+            eligible[key] -= inhibit_set
+        print(f"[DEBUG] 処理可能な装置: {table} から{len(eligible):,}件")
+
+    # FlowInfo にない工程はLOGで処理実績のある装置を使う
+    observed = log.drop_nulls(["PROD_TYPE", "OPE_NO", "EQP_ID"]).select("PROD_TYPE", "OPE_NO", "EQP_ID").unique()
+    for type_val, ope_no, eqp_id in observed.iter_rows():
+        key = (type_val, ope_no)
+        if key not in eligible or not eligible[key]:
+            eligible.setdefault(key, set()).add(eqp_id)
+    return eligible
+
+
+def load_equipment_groups(conn, equipment_path=None):
+    """装置名→設備グループ（EQP_GRP_CONV）の対応を返す（FlowInfo と装置汎用化設定から）"""
+    groups = {}
+    table = latest_flowinfo_table(conn)
+    if table is not None and "EQP_GRP_CONV" in get_columns(conn, table):
+        rows = conn.execute(
+            f"SELECT DISTINCT EQP_GRP_CONV, ALL_EQP_ID FROM {quote_identifier(table)} "
+            "WHERE EQP_GRP_CONV IS NOT NULL AND ALL_EQP_ID IS NOT NULL"
+        )
+        for group, all_eqp in rows:
+            for eqp in str(all_eqp).split():
+                groups.setdefault(eqp, str(group))
+    if equipment_path is None:
+        return groups
+    settings = pd.read_csv(equipment_path, encoding="utf-8-sig", dtype=str)
+    if {"設備名", "設備グループ"} <= set(settings.columns):
+        for name, group in settings[["設備名", "設備グループ"]].dropna().itertuples(index=False):
+            groups.setdefault(name, group)
+    return groups
+
+
+def load_batch_capacity(conn, eqp_groups):
+    """同時着工数（eqp_batch）を読み込み、装置名→(最大着工数, 最小着工数) を返す
+
+    装置名の列があれば装置ごと、設備グループの列があればグループ内の全装置に適用する。
+    最大着工数が1以下の装置はバッチ処理しない（戻り値に含めない）。
+    """
+    if not table_exists(conn, "eqp_batch"):
+        return {}
+    columns = get_columns(conn, "eqp_batch")
+    eqp_col = find_column(columns, BATCH_EQP_COLUMNS)
+    group_col = find_column(columns, BATCH_GROUP_COLUMNS)
+    max_col = find_column(columns, BATCH_MAX_COLUMNS)
+    min_col = find_column(columns, BATCH_MIN_COLUMNS)
+    if max_col is None or (eqp_col is None and group_col is None):
+        print(f"[DEBUG] eqp_batch の列を判別できないため、バッチ処理は行いません: {columns}")
+        return {}
+
+    table = pd.read_sql("SELECT * FROM eqp_batch", conn)
+    table["MAX_BATCH"] = pd.to_numeric(table[max_col], errors="coerce")
+    table["MIN_BATCH"] = pd.to_numeric(table[min_col], errors="coerce") if min_col else 1
+    table = table.dropna(subset=["MAX_BATCH"])
+    table["MIN_BATCH"] = table["MIN_BATCH"].fillna(1)
+
+    by_group = {}
+    capacity = {}
+    for row in table.to_dict("records"):
+        value = (int(row["MAX_BATCH"]), int(row["MIN_BATCH"]))
+        if eqp_col and isinstance(row.get(eqp_col), str):
+            capacity[row[eqp_col]] = value
+        elif group_col and isinstance(row.get(group_col), str):
+            by_group[row[group_col]] = value
+    for eqp, group in eqp_groups.items():
+        if group in by_group:
+            capacity.setdefault(eqp, by_group[group])
+    capacity = {eqp: value for eqp, value in capacity.items() if value[0] > 1}
+    print(f"[DEBUG] 同時着工数: バッチ装置 {len(capacity):,}台")
+    return capacity
+
+
+def apply_equipment_settings(eligible, equipment_path):
+    """装置汎用化設定CSV（設定アプリの出力）を適用する（INHIBIT=0は追加、1は除外）"""
+    settings = pd.read_csv(equipment_path, encoding="utf-8-sig", dtype=str)
+    required = ["設備名", "TYPE", "OPE_NO", "INHIBIT"]
+    missing = [col for col in required if col not in settings.columns]
+    if missing:
+        raise ValueError(f"装置汎用化設定に必要な列がありません: {missing}")
+    for name, type_val, ope_no, inhibit in settings[required].itertuples(index=False):
+        key = (str(type_val), str(ope_no))
+        if int(float(inhibit)) == 0:
+            eligible.setdefault(key, set()).add(str(name))
+        else:
+            eligible.get(key, set()).discard(str(name))
+    print(f"[DEBUG] 装置汎用化設定を適用: {os.path.basename(equipment_path)} {len(settings)}件")
+    return eligible
+
+
+def estimate_process_times(log):
+    """LOGの RUN_TIME の中央値から (TYPE, OPE_NO, EQP_ID) ごとの処理時間を求める"""
+    times = (
+        log.filter(pl.col("RUN_TIME") > 0)
+        .group_by("PROD_TYPE", "OPE_NO", "EQP_ID")
+        .agg(pl.col("RUN_TIME").median())
+    )
+    return pd.DataFrame(times.rows(), columns=PROCESS_TIME_COLUMNS)
+
+
+def load_parameters(parameter_path):
+    """パラメータファイルを読み込む（本モジュールの形式でない場合は空の辞書）"""
+    try:
+        with open(parameter_path, "rb") as f:
+            parameter = pickle.load(f)
+    except Exception as e:
+        print(f"[DEBUG] パラメータファイルを読み込めません（LOGから推定します）: {e}")
+        return {}
+    if isinstance(parameter, dict) and isinstance(parameter.get(PROCESS_TIME_KEY), pd.DataFrame):
+        return parameter
+    print("[DEBUG] パラメータファイルに処理時間がないため、LOGから推定します")
+    return {}
+
+
+def load_releases(conn, log, routes, horizon_days=None):
+    """投入するロットの一覧（LOT_ID, TYPE, DeviceGp, SUB_LOT_TYPE, RELEASE_TIME, START_STEP, END_STEP）を返す
+
+    END_STEP は処理を終える工程の次の位置（工程順の添字）。plan のロットは工程順の最後まで処理し、
+    LOGから再現するロットはLOGで最後に処理された工程で終える（期間の終了時点の仕掛品は途中で終わる）。
+    """
+    device_of_type = dict(
+        log.drop_nulls(["PROD_TYPE", "PROD_GRP_ID"])
+        .group_by("PROD_TYPE").agg(pl.col("PROD_GRP_ID").mode().first())
+        .iter_rows()
+    )
+
+    releases = None
+    if table_exists(conn, "plan"):
+        columns = get_columns(conn, "plan")
+        time_col = find_column(columns, PLAN_TIME_COLUMNS)
+        type_col = find_column(columns, PLAN_TYPE_COLUMNS)
+        qty_col = find_column(columns, PLAN_QTY_COLUMNS)
+        if time_col and type_col:
+            plan = pd.read_sql("SELECT * FROM plan", conn)
+            plan["RELEASE_TIME"] = pd.to_datetime(plan[time_col], errors="coerce")
+            plan["TYPE"] = plan[type_col].astype(str)
+            plan["QTY"] = pd.to_numeric(plan[qty_col], errors="coerce").fillna(1).astype(int) if qty_col else 1
+            plan = plan.dropna(subset=["RELEASE_TIME"])
+            plan = plan[plan["QTY"] > 0]
+            # 同じ行の複数ロットは1日に均等に投入する
+            repeated = plan.loc[plan.index.repeat(plan["QTY"]), ["RELEASE_TIME", "TYPE", "QTY"]]
+            order = repeated.groupby(level=0).cumcount()
+            repeated["RELEASE_TIME"] += pd.to_timedelta(order * 86400 / repeated["QTY"], unit="s")
+            releases = repeated.sort_values("RELEASE_TIME").reset_index(drop=True)
+            releases["LOT_ID"] = [f"SIM{i:07d}" for i in range(len(releases))]
+            releases["SUB_LOT_TYPE"] = "P0"
+            releases["START_STEP"] = 0
+            releases["END_STEP"] = [len(routes.get(type_val, ())) for type_val in releases["TYPE"]]
+            print(f"[DEBUG] ロット投入: plan から{len(releases):,}ロット")
+
+    if releases is None:
+        # LOGの各ロットを最初に処理された時刻・工程から再現する（期間の開始時点の仕掛品を含む）
+        first = (
+            log.sort("STIME").group_by("LOT_ID", maintain_order=True)
+            .agg(pl.col("STIME").first(), pl.col("PROD_TYPE").first(),
+                 pl.col("SUB_LOT_TYPE").first(), pl.col("OPE_NO").first())
+        )
+        releases = pd.DataFrame(first.rows(), columns=["LOT_ID", "RELEASE_TIME", "TYPE", "SUB_LOT_TYPE", "OPE_NO"])
+        position = {
+            type_val: {ope_no: i for i, ope_no in enumerate(route)} for type_val, route in routes.items()
+        }
+        releases["START_STEP"] = [
+            position.get(type_val, {}).get(ope_no, 0)
+            for type_val, ope_no in zip(releases["TYPE"], releases["OPE_NO"])
+        ]
+
+        # 工程順の中でLOGに処理のある最も後の工程で終える（工程順にない工程しかないロットは最後まで）
+        positions = pl.DataFrame(
+            [(type_val, ope_no, i) for type_val, route in routes.items() for i, ope_no in enumerate(route)],
+            schema={"PROD_TYPE": pl.String, "OPE_NO": pl.String, "POSITION": pl.Int64}, orient="row",
+        )
+        last = dict(
+            log.select("LOT_ID", "PROD_TYPE", "OPE_NO").join(positions, on=["PROD_TYPE", "OPE_NO"])
+            .group_by("LOT_ID").agg(pl.col("POSITION").max()).iter_rows()
+        )
+        releases["END_STEP"] = [
+            min(max(last[lot] + 1, start + 1), len(routes.get(type_val, ())))
+            if lot in last else len(routes.get(type_val, ()))
+            for lot, type_val, start in zip(releases["LOT_ID"], releases["TYPE"], releases["START_STEP"])
+        ]
+        releases["SUB_LOT_TYPE"] = releases["SUB_LOT_TYPE"].fillna("P0")
+        print(f"[DEBUG] ロット投入: LOGから{len(releases):,}ロットを再現")
+
+    releases = releases[releases["TYPE"].isin(routes)].copy()
+    releases["DeviceGp"] = releases["TYPE"].map(device_of_type).fillna(releases["TYPE"])
+    if horizon_days is not None and not releases.empty:
+        end = releases["RELEASE_TIME"].min() + pd.Timedelta(days=horizon_days)
+        releases = releases[releases["RELEASE_TIME"] < end]
+    return releases.sort_values("RELEASE_TIME", kind="stable").reset_index(drop=True)
+
+
+class FabModel:
+    """シミュレーションの入力を配列にまとめたもの"""
+
+    def __init__(self, routes, eligible, process_times, releases, time_unit, transfer_time=0.0,
+                 batch_capacity=None, batch_policy=DEFAULT_BATCH_POLICY, batch_max_wait=DEFAULT_BATCH_MAX_WAIT,
+                 qtime_rules=None):
+        self.time_unit = time_unit
+        self.transfer_time = float(transfer_time)
+
+        # 工程（TYPE, OPE_NO）と装置に番号を振る
+        step_keys = sorted({(type_val, ope_no) for type_val, route in routes.items() for ope_no in route})
+        step_index = {key: i for i, key in enumerate(step_keys)}
+        eqp_names = sorted({eqp for key in step_keys for eqp in eligible.get(key, ())})
+        eqp_index = {name: i for i, name in enumerate(eqp_names)}
+        self.step_ope = np.array([ope_no for _, ope_no in step_keys], dtype=object)
+        self.eqp_names = np.array(eqp_names, dtype=object)
+
+        # 処理時間: 装置別 → 工程の中央値 → OPE_NOの中央値 → 全体の中央値 の順に使う
+        times = process_times.dropna(subset=["RUN_TIME"])
+        times = times[times["RUN_TIME"] > 0].astype({"TYPE": str, "OPE_NO": str, "EQP_ID": str})
+        by_eqp = {(t, o, e): v for t, o, e, v in times[PROCESS_TIME_COLUMNS].itertuples(index=False)}
+        by_step = times.groupby(["TYPE", "OPE_NO"])["RUN_TIME"].median().to_dict()
+        by_ope = times.groupby("OPE_NO")["RUN_TIME"].median().to_dict()
+        overall = float(times["RUN_TIME"].median()) if not times.empty else DEFAULT_RUN_TIME
+
+        # 工程ごとの装置は処理時間の短い順に並べる（空いている装置から先頭を選ぶ）
+        self.step_eqps = []
+        self.step_times = []
+        eqp_steps = [[] for _ in eqp_names]
+        for step, (type_val, ope_no) in enumerate(step_keys):
+            default = by_step.get((type_val, ope_no), by_ope.get(ope_no, overall))
+            pairs = sorted(
+                (by_eqp.get((type_val, ope_no, eqp), default), eqp_index[eqp])
+                for eqp in eligible.get((type_val, ope_no), ())
+            )
+            self.step_eqps.append([eqp for _, eqp in pairs])
+            self.step_times.append([float(t) for t, _ in pairs])
+            for _, eqp in pairs:
+                eqp_steps[eqp].append(step)
+        self.eqp_steps = eqp_steps
+        self.step_positions = [{eqp: i for i, eqp in enumerate(eqps)} for eqps in self.step_eqps]
+
+        # バッチ装置の最大着工数と、着工方針から求めた待たずに着工できるロット数
+        batch_capacity = batch_capacity or {}
+        self.eqp_capacity = np.ones(len(eqp_names), dtype=np.int32)
+        self.eqp_threshold = np.ones(len(eqp_names), dtype=np.int32)
+        for name, (capacity, min_batch) in batch_capacity.items():
+            if name in eqp_index:
+                self.eqp_capacity[eqp_index[name]] = capacity
+                self.eqp_threshold[eqp_index[name]] = fill_threshold(batch_policy, capacity, min_batch)
+        self.batch_max_wait = None if batch_max_wait is None else batch_max_wait / time_unit
+
+        # 制約時間の区間（工程番号で引けるようにする）
+        self.qtime = QtimeIndex(qtime_rules, step_index, time_unit) if qtime_rules is not None else None
+
+        # ロットごとの工程の並び（工程番号の配列）
+        route_ids = {type_val: i for i, type_val in enumerate(routes)}
+        self.routes = [np.array([step_index[(type_val, ope_no)] for ope_no in route], dtype=np.int32)
+                       for type_val, route in routes.items()]
+
+        self.t0 = releases["RELEASE_TIME"].min() if not releases.empty else pd.Timestamp(0)
+        self.lot_ids = releases["LOT_ID"].astype(str).to_numpy(dtype=object)
+        self.lot_route = releases["TYPE"].map(route_ids).to_numpy(dtype=np.int32)
+        self.lot_start_step = releases["START_STEP"].to_numpy(dtype=np.int32)
+        self.lot_end_step = releases["END_STEP"].to_numpy(dtype=np.int32)
+        self.lot_release = ((releases["RELEASE_TIME"] - self.t0).dt.total_seconds() / time_unit).to_numpy(dtype=np.float64)
+        self.lot_device = releases["DeviceGp"].astype(str).to_numpy(dtype=object)
+        self.lot_sub_type = releases["SUB_LOT_TYPE"].astype(str).to_numpy(dtype=object)
+
+
+def build_model(database_path, parameter_path, equipment_path, horizon_days=None,
+                batch_policy=None, batch_max_wait=None):
+    """データベース・パラメータ・装置汎用化設定からシミュレーションの入力を作成する"""
+    parameter = load_parameters(parameter_path)
+    conn = sqlite3.connect(database_path)
+    try:
+        log = load_log(conn)
+        routes = load_routes(conn, log)
+        eligible = apply_equipment_settings(load_eligibility(conn, log), equipment_path)
+        releases = load_releases(conn, log, routes, horizon_days)
+        batch_capacity = load_batch_capacity(conn, load_equipment_groups(conn, equipment_path))
+        qtime_rules = load_qtime_rules(conn)
+    finally:
+        conn.close()
+
+    process_times = parameter.get(PROCESS_TIME_KEY)
+    if process_times is None:
+        process_times = estimate_process_times(log)
+    time_unit = parameter.get(TIME_UNIT_KEY) or infer_time_unit(log)
+    del log
+    print(f"[DEBUG] 時間単位: {time_unit}秒, ロット数: {len(releases):,}, 制約時間: {len(qtime_rules):,}件")
+    return FabModel(
+        routes, eligible, process_times, releases, time_unit, parameter.get(TRANSFER_TIME_KEY, 0.0),
+        batch_capacity,
+        batch_policy or parameter.get(BATCH_POLICY_KEY, DEFAULT_BATCH_POLICY),
+        batch_max_wait if batch_max_wait is not None else parameter.get(BATCH_MAX_WAIT_KEY, DEFAULT_BATCH_MAX_WAIT),
+        qtime_rules,
+    )
+
+
+class OperationRecorder:
+    """処理の開始記録を配列にため、一定件数ごとに結果のDataFrameとして出力する"""
+
+    def __init__(self, model, sink=None, batch_size=OUTPUT_BATCH_SIZE):
+        self.model = model
+        self.sink = sink
+        self.batch_size = batch_size
+        self.frames = []
+        self._reset()
+
+    def _reset(self):
+        self.lots, self.steps, self.eqps, self.starts, self.waits = [], [], [], [], []
+
+    def record(self, lot, step, eqp, start, wait):
+        self.lots.append(lot)
+        self.steps.append(step)
+        self.eqps.append(eqp)
+        self.starts.append(start)
+        self.waits.append(wait)
+        if len(self.lots) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ためた記録を結果のDataFrameに変換して出力する"""
+        if not self.lots:
+            return
+        model = self.model
+        lots = np.asarray(self.lots, dtype=np.int64)
+        starts = np.asarray(self.starts, dtype=np.float64) * model.time_unit
+        frame = pd.DataFrame({
+            "LOT_ID": model.lot_ids[lots],
+            "OPE_START_DATETIME": model.t0 + pd.to_timedelta(np.round(starts), unit="s"),
+            "WAIT_TIME": np.asarray(self.waits, dtype=np.float64),
+            "EQP_ID": model.eqp_names[np.asarray(self.eqps, dtype=np.int64)],
+            "OPE_NO": model.step_ope[np.asarray(self.steps, dtype=np.int64)],
+            "SUB_LOT_TYPE": model.lot_sub_type[lots],
+            "MRC": "MASTER",
+            "DeviceGp": model.lot_device[lots],
+        })
+        self._reset()
+        if self.sink is not None:
+            self.sink.push_frame(frame)
+        else:
+            self.frames.append(frame)
+
+    def result(self):
+        """sink を使わない場合の結果（全件のDataFrame）"""
+        self.flush()
+        if not self.frames:
+            return pd.DataFrame(columns=["LOT_ID", "OPE_START_DATETIME", "WAIT_TIME", "EQP_ID",
+                                         "OPE_NO", "SUB_LOT_TYPE", "MRC", "DeviceGp"])
+        return pd.concat(self.frames, ignore_index=True)
+
+
+def run_simulation(model, recorder):
+    """イベントを時刻順に処理してシミュレーションを実行する
+
+    工程の待ち行列は (Q-timeの期限, 到着時刻, ロット) のヒープで、区間内のロットを期限順、
+    それ以外を到着順に着工する。
+    バッチ装置を含む工程では、空いている通常の装置がなければバッチ装置の待ち行列に入れる。
+    戻り値: 処理した工程数
+    """
+    n_lots = len(model.lot_ids)
+    lot_step = model.lot_start_step.copy()
+    lot_end_step = model.lot_end_step
+    lot_arrival = np.zeros(n_lots, dtype=np.float64)
+    eqp_busy = np.zeros(len(model.eqp_names), dtype=bool)
+    queues = [[] for _ in model.step_eqps]
+    routes = model.routes
+    lot_route = model.lot_route
+    step_eqps = model.step_eqps
+    step_times = model.step_times
+    step_positions = model.step_positions
+    step_ope = model.step_ope
+    eqp_steps = model.eqp_steps
+    transfer_time = model.transfer_time
+    record = recorder.record
+
+    # バッチ装置の待ち行列（レシピ=OPE_NO別）と、実行中のバッチ
+    is_batch = model.eqp_capacity > 1
+    batch_queues = {
+        eqp: BatchQueue(model.eqp_capacity[eqp], model.eqp_threshold[eqp]) for eqp in np.flatnonzero(is_batch)
+    }
+    step_batch_eqps = [[eqp for eqp in eqps if is_batch[eqp]] for eqps in step_eqps]
+    max_wait = model.batch_max_wait
+    wake_at = np.full(len(model.eqp_names), np.inf)
+    running = {}
+    batch_ids = itertools.count()
+
+    # Q-time区間: ロット→{終了する工程番号: 期限}
+    qtime = model.qtime if model.qtime else None
+    lot_windows = {}
+    violations = 0
+
+    counter = itertools.count()
+    heap = [(float(model.lot_release[lot]), next(counter), ARRIVE, lot, -1) for lot in range(n_lots)]
+    heapq.heapify(heap)
+    push = heapq.heappush
+    pop = heapq.heappop
+
+    def track_qtime(lot, step, now):
+        """着工時にQ-time区間を閉じ（期限超過を数え）、この工程から始まる区間を開く"""
+        nonlocal violations
+        windows = lot_windows.get(lot)
+        if windows is not None and qtime.closes[step]:
+            deadline = windows.pop(step, None)
+            if deadline is not None and now > deadline:
+                violations += 1
+            if not windows:
+                del lot_windows[lot]
+        for to_step, limit in qtime.opens[step]:
+            windows = lot_windows.setdefault(lot, {})
+            windows[to_step] = min(windows.get(to_step, np.inf), now + limit)
+
+    def deadline_of(lot):
+        """ロットの最も早いQ-timeの期限（区間外は無限大）"""
+        windows = lot_windows.get(lot)
+        return min(windows.values()) if windows else np.inf
+
+    def advance(lot, now):
+        """ロットを次の工程へ進める（終了する工程を処理し終えたロットはそこで完了）"""
+        lot_step[lot] += 1
+        if lot_step[lot] < lot_end_step[lot]:
+            push(heap, (now + transfer_time, next(counter), ARRIVE, lot, -1))
+
+    def start_batch(eqp, now):
+        """バッチ装置で着工できるバッチがあれば処理を開始する（処理したロット数を返す）"""
+        lots, wake = batch_queues[eqp].select(now, max_wait)
+        if not lots:
+            if wake is not None and wake < wake_at[eqp]:
+                wake_at[eqp] = wake
+                push(heap, (wake, next(counter), BATCH_WAKE, -1, eqp))
+            return 0
+        duration = 0.0
+        for batch_lot in lots:
+            step = routes[lot_route[batch_lot]][lot_step[batch_lot]]
+            record(batch_lot, step, eqp, now, now - lot_arrival[batch_lot])
+            if qtime is not None:
+                track_qtime(batch_lot, step, now)
+            duration = max(duration, step_times[step][step_positions[step][eqp]])
+        eqp_busy[eqp] = True
+        batch_id = next(batch_ids)
+        running[batch_id] = lots
+        push(heap, (now + duration, next(counter), BATCH_FINISH, batch_id, eqp))
+        return len(lots)
+
+    operations = 0
+    skipped = 0
+    batches = 0
+    while heap:
+        now, _, kind, lot, eqp = pop(heap)
+
+        if kind == BATCH_FINISH:
+            eqp_busy[eqp] = False
+            for batch_lot in running.pop(lot):
+                advance(batch_lot, now)
+            started = start_batch(eqp, now)
+            operations += started
+            batches += started > 0
+            continue
+
+        if kind == BATCH_WAKE:
+            # 最大待ち時間に達したバッチを着工する
+            if now >= wake_at[eqp]:
+                wake_at[eqp] = np.inf
+            if not eqp_busy[eqp]:
+                started = start_batch(eqp, now)
+                operations += started
+                batches += started > 0
+            continue
+
+        if kind == FINISH:
+            eqp_busy[eqp] = False
+            advance(lot, now)
+
+            # この装置で処理できる工程の待ち行列から、期限・到着の最も早いロットを選ぶ
+            best_step = -1
+            best_key = None
+            for step in eqp_steps[eqp]:
+                queue = queues[step]
+                if queue and (best_key is None or queue[0] < best_key):
+                    best_step = step
+                    best_key = queue[0]
+            if best_step >= 0:
+                next_lot = heapq.heappop(queues[best_step])[2]
+                eqp_busy[eqp] = True
+                record(next_lot, best_step, eqp, now, now - lot_arrival[next_lot])
+                if qtime is not None:
+                    track_qtime(next_lot, best_step, now)
+                push(heap, (now + step_times[best_step][step_positions[best_step][eqp]],
+                            next(counter), FINISH, next_lot, eqp))
+                operations += 1
+            continue
+
+        # 到着: 空いている装置があれば処理を開始し、なければ待ち行列に入れる
+        route = routes[lot_route[lot]]
+        if lot_step[lot] >= lot_end_step[lot]:
+            continue
+        step = route[lot_step[lot]]
+        lot_arrival[lot] = now
+        candidates = step_eqps[step]
+        if not candidates:
+            # 処理できる装置がない工程は飛ばす
+            skipped += 1
+            lot_step[lot] += 1
+            if lot_step[lot] < lot_end_step[lot]:
+                push(heap, (now, next(counter), ARRIVE, lot, -1))
+            continue
+        for position, candidate in enumerate(candidates):
+            if not eqp_busy[candidate] and not is_batch[candidate]:
+                eqp_busy[candidate] = True
+                record(lot, step, candidate, now, 0.0)
+                if qtime is not None:
+                    track_qtime(lot, step, now)
+                push(heap, (now + step_times[step][position], next(counter), FINISH, lot, candidate))
+                operations += 1
+                break
+        else:
+            if step_batch_eqps[step]:
+                target = choose_batch_equipment(batch_queues, step_batch_eqps[step], step_ope[step], eqp_busy)
+                batch_queues[target].add(lot, step_ope[step], now)
+                if not eqp_busy[target]:
+                    started = start_batch(target, now)
+                    operations += started
+                    batches += started > 0
+            else:
+                deadline = deadline_of(lot) if qtime is not None else np.inf
+                push(queues[step], (deadline, now, lot))
+
+    recorder.flush()
+    waiting = sum(len(queue) for queue in batch_queues.values())
+    print(f"[DEBUG] シミュレーション完了: {operations:,}工程, 装置なしで飛ばした工程 {skipped:,}件, "
+          f"バッチ {batches:,}件, バッチ待ちで終了 {waiting:,}ロット, Q-time超過 {violations:,}件")
+    return operations
+
+
+def sim(database_path, parameter_path, equipment_path, sink=None, horizon_days=None,
+        batch_policy=None, batch_max_wait=None):
+    """装置汎用化シミュレーションを実行する（sim_enc.sim と同じ引数）
+
+    sink（washi.simresult.ResultSink）を指定すると結果を逐次書き出してNoneを返し、
+    指定しない場合は結果のDataFrameを返す。horizon_days でロット投入の期間を制限できる。
+    batch_policy（greedy / min / full）と batch_max_wait（秒）はパラメータファイルの設定より優先する。
+    """
+    model = build_model(database_path, parameter_path, equipment_path, horizon_days,
+                        batch_policy, batch_max_wait)
+    recorder = OperationRecorder(model, sink)
+    run_simulation(model, recorder)
+    if sink is not None:
+        return None
+    return recorder.result()
+
+
+def make_synthetic_fab(db_file, n_lots=2000, n_types=3, n_steps=200, n_eqp_groups=40, eqps_per_group=4,
+                       n_batch_groups=5, seed=0):
+    """検証用の合成データ（LOG・FlowInfo・eqp_batch・Qtime）を作成する（時間の単位は分）"""
+    rng = np.random.default_rng(seed)
+    routes = {
+        f"T{t}": [f"{s:04d}" for s in range(n_steps)] for t in range(n_types)
+    }
+    group_of_step = rng.integers(0, n_eqp_groups, n_steps)
+    run_of_step = rng.uniform(10, 120, n_steps)
+    start = pd.Timestamp("2024-01-01")
+    rows = []
+    for lot in range(n_lots):
+        type_val = f"T{lot % n_types}"
+        now = start + pd.Timedelta(minutes=float(rng.uniform(0, 60 * 24 * 30)))
+        for step, ope_no in enumerate(routes[type_val][: rng.integers(n_steps // 2, n_steps + 1)]):
+            wait = float(rng.exponential(60))
+            run = float(run_of_step[step])
+            now += pd.Timedelta(minutes=wait)
+            eqp = f"EQ{group_of_step[step]:03d}_{rng.integers(0, eqps_per_group)}"
+            rows.append(("P0", f"LOT{lot:06d}", eqp, now.strftime("%Y-%m-%d %H:%M:%S"),
+                         f"DEV{lot % n_types}", type_val, ope_no, run, wait))
+            now += pd.Timedelta(minutes=run)
+    log = pd.DataFrame(rows, columns=["SUB_LOT_TYPE", "LOT_ID", "EQP_ID", "STIME", "PROD_GRP_ID",
+                                      "PROD_TYPE", "OPE_NO", "RUN_TIME", "WAIT_TIME"])
+    flow = pd.DataFrame([
+        (type_val, ope_no, f"G{group_of_step[step]:03d}",
+         " ".join(f"EQ{group_of_step[step]:03d}_{i}" for i in range(eqps_per_group)), None, None)
+        for type_val, route in routes.items() for step, ope_no in enumerate(route)
+    ], columns=["TYPE", "OPE_NO", "EQP_GRP_CONV", "ALL_EQP_ID", "INHIBIT_EQP_ID", "EQP_ID"])
+    eqp_batch = pd.DataFrame({
+        "EQP_GRP_CONV": [f"G{g:03d}" for g in range(n_batch_groups)],
+        "MAX_BATCH": 4, "MIN_BATCH": 2,
+    })
+    qtime = pd.DataFrame({
+        "FROM_OPE_NO": [f"{s:04d}" for s in range(10, n_steps, 20)],
+        "TO_OPE_NO": [f"{s + 3:04d}" for s in range(10, n_steps, 20)],
+        "QTIME": 300,
+    })
+    conn = sqlite3.connect(db_file)
+    try:
+        log.to_sql("LOG", conn, if_exists="replace", index=False)
+        qtime.to_sql("Qtime", conn, if_exists="replace", index=False)
+        flow.to_sql("FlowInfo_20240101", conn, if_exists="replace", index=False)
+        eqp_batch.to_sql("eqp_batch", conn, if_exists="replace", index=False)
+    finally:
+        conn.close()
+    return log, flow
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    from washi.simresult import ResultSink, scan_simres
+
+    folder = tempfile.mkdtemp()
+    db_file = os.path.join(folder, "fab.db")
+    log, flow = make_synthetic_fab(db_file)
+    print(f"[DEBUG] 合成データ: LOG {len(log):,}行, FlowInfo {len(flow):,}行")
+
+    # 装置汎用化設定: 1台を禁止、1台を新規追加
+    equipment_path = os.path.join(folder, "equipment_data_test.csv")
+    pd.DataFrame({
+        "設備名": ["EQ000_0", "EQNEW_0"], "設備グループ": ["G000", "G000"],
+        "TYPE": ["T0", "T0"], "OPE_NO": [flow.loc[0, "OPE_NO"]] * 2, "INHIBIT": [1, 0],
+    }).to_csv(equipment_path, index=False, encoding="utf-8-sig")
+    parameter_path = os.path.join(folder, "parameter.pkl")
+
+    start = time.perf_counter()
+    result = sim(db_file, parameter_path, equipment_path)
+    elapsed = time.perf_counter() - start
+    print(f"[DEBUG] 戻り値: {len(result):,}行, {elapsed:.2f}秒 ({len(result) / elapsed:,.0f}工程/秒)")
+    print(result.groupby("OPE_NO")["WAIT_TIME"].mean().describe())
+
+    # 結果のQ-time区間を分析用の判定と照合
+    from washi.columnar import pandas_to_polars
+    from washi.qtime import qtime_windows, summarize_windows
+    conn = sqlite3.connect(db_file)
+    rules = load_qtime_rules(conn)
+    conn.close()
+    steps = pandas_to_polars(result[["LOT_ID", "OPE_NO", "OPE_START_DATETIME"]]).rename({"OPE_START_DATETIME": "TIME"})
+    print(summarize_windows(qtime_windows(steps, rules)).select("FROM_OPE_NO", "windows", "violations", "open"))
+
+    # バッチの着工方針ごとの待ち時間
+    for policy in ("greedy", "min", "full"):
+        result = sim(db_file, parameter_path, equipment_path, batch_policy=policy, batch_max_wait=7200)
+        print(f"[DEBUG] 着工方針 {policy}: 平均待ち時間 {result['WAIT_TIME'].mean():.1f}, {len(result):,}行")
+
+    # ResultSink への逐次書き出し
+    with ResultSink(folder, batch_size=50_000) as sink:
+        sim(db_file, parameter_path, equipment_path, sink=sink)
+    total = scan_simres(sink.path).select(pl.len()).collect().item()
+    print(f"[DEBUG] ResultSink: {total:,}行")
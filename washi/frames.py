@@ -0,0 +1,192 @@
+"""vis_b のLOG2読み込みパイプライン（polarsでバッチごとに変換、pandas版はフォールバック用）"""
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from washi.bulkload import bulk_load, iter_frame_chunks
+from washi.columnar import polars_to_pandas
+from washi.queries import build_log2_query
+from washi.schema import DICT_COLUMNS, decode_frame
+
+# データベースから1回に取得する行数
+FETCH_BATCH_SIZE = 100_000
+
+# category型に変換するカラム
+CATEGORY_COLUMNS = ("EQP_ID", "DeviceGp", "LOT_ID")
+
+# 取得結果の型（バッチごとの型推定の揺れを防ぐ）
+UNTYPED_SCHEMA = {
+    "LOT_ID": pl.String,
+    "OPE_START_DATETIME": pl.String,
+    "WAIT_TIME": pl.Float64,
+    "EQP_ID": pl.String,
+    "OPE_NO": pl.String,
+    "SUB_LOT_TYPE": pl.String,
+    "MRC": pl.String,
+    "DeviceGp": pl.String,
+}
+TYPED_SCHEMA = {
+    **UNTYPED_SCHEMA,
+    "OPE_START_DATETIME": pl.Float64,
+    **{col: pl.Int64 for col in DICT_COLUMNS},
+}
+
+
+def add_year_month(chunk, typed=False):
+    """日時変換とyear_month追加（変換できない行は除外）"""
+    if typed:
+        # 型付きスキーマではエポック秒で保存されている
+        chunk['OPE_START_DATETIME'] = pd.to_datetime(chunk['OPE_START_DATETIME'], unit='s', errors='coerce')
+    else:
+        chunk['OPE_START_DATETIME'] = pd.to_datetime(chunk['OPE_START_DATETIME'], errors='coerce')
+    chunk['year_month'] = chunk['OPE_START_DATETIME'].dt.strftime('%Y-%m')
+    return chunk.dropna(subset=['OPE_START_DATETIME', 'year_month'])
+
+
+def iter_query_batches(conn, query, typed=False, batch_size=FETCH_BATCH_SIZE):
+    """クエリ結果をバッチ単位で返すイテレータ（日付・列の絞り込みはクエリ側で行う）"""
+    return pl.read_database(
+        query, conn, iter_batches=True, batch_size=batch_size,
+        schema_overrides=TYPED_SCHEMA if typed else UNTYPED_SCHEMA,
+    )
+
+
+def log2_pipeline(lf, typed=False):
+    """日時変換・絞り込み・型変換・月キー作成を行う遅延クエリを組み立てる（バッチごとに適用する）
+
+    ym_key は年月の整数キー（YYYYMM）。集計・比較は文字列ではなくこのキーで行える。
+    """
+    if typed:
+        timestamp = pl.from_epoch(pl.col("OPE_START_DATETIME").cast(pl.Int64, strict=False), time_unit="s")
+    else:
+        timestamp = pl.col("OPE_START_DATETIME").str.to_datetime(strict=False, time_unit="us")
+
+    lf = lf.with_columns(
+        timestamp.alias("OPE_START_DATETIME"),
+        pl.col("WAIT_TIME").cast(pl.Float32, strict=False),
+    ).filter(
+        pl.col("OPE_START_DATETIME").is_not_null()
+        & pl.col("WAIT_TIME").is_not_null()
+        & (pl.col("WAIT_TIME") > 0)
+        & pl.col("DeviceGp").is_not_null()
+        & pl.col("EQP_ID").is_not_null()
+    ).with_columns(
+        (pl.col("OPE_START_DATETIME").dt.year() * 100 + pl.col("OPE_START_DATETIME").dt.month())
+        .cast(pl.Int32).alias("ym_key"),
+    )
+    return lf
+
+
+def ym_key_to_labels(keys):
+    """整数の年月キーを 'YYYY-MM' 文字列の配列に変換（ユニーク値のみ文字列化）"""
+    uniques, inverse = np.unique(keys, return_inverse=True)
+    labels = np.array([f"{key // 100:04d}-{key % 100:02d}" for key in uniques], dtype=object)
+    return labels[inverse]
+
+
+def to_vis_frame(df, conn=None, typed=False):
+    """polarsの結果を vis_b で使うpandasのDataFrameに変換する"""
+    pdf = polars_to_pandas(df, categorical_columns=CATEGORY_COLUMNS)
+    pdf["year_month"] = ym_key_to_labels(pdf["ym_key"].to_numpy())
+    if typed and conn is not None and not pdf.empty:
+        pdf = decode_frame(conn, pdf)
+    return pdf
+
+
+def load_log2_polars(conn, query, typed=False, batch_size=FETCH_BATCH_SIZE):
+    """polarsでLOG2を読み込む
+
+    取得したバッチごとに変換・絞り込みを行い、残った行だけを保持する
+    （取得結果全体をメモリに載せてから変換しない）。
+    """
+    frames = [
+        log2_pipeline(batch.lazy(), typed).collect()
+        for batch in iter_query_batches(conn, query, typed, batch_size)
+    ]
+    if frames:
+        df = pl.concat(frames, how="vertical_relaxed")
+    else:
+        df = log2_pipeline(pl.LazyFrame(schema=TYPED_SCHEMA if typed else UNTYPED_SCHEMA), typed).collect()
+    return to_vis_frame(df, conn, typed)
+
+
+def load_log2_pandas(conn, query, typed=False, chunksize=FETCH_BATCH_SIZE):
+    """pandasのチャンク読み込みでLOG2を読み込む（従来の方式）"""
+    chunks = []
+    for chunk in pd.read_sql(query, conn, chunksize=chunksize):
+        chunk = add_year_month(chunk, typed)
+        if not chunk.empty:
+            chunks.append(chunk)
+    if not chunks:
+        return pd.DataFrame()
+    df = pd.concat(chunks, ignore_index=True)
+    if typed:
+        df = decode_frame(conn, df)
+    df['WAIT_TIME'] = pd.to_numeric(df['WAIT_TIME'], errors='coerce')
+    df = df.dropna(subset=['WAIT_TIME', 'OPE_START_DATETIME', 'DeviceGp', 'EQP_ID', 'year_month'])
+    df = df[df['WAIT_TIME'] > 0]
+    df['WAIT_TIME'] = df['WAIT_TIME'].astype('float32')
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and df[col].dtype == 'object':
+            df[col] = df[col].astype('category')
+    return df
+
+
+def make_synthetic_log2(n_rows, seed=0):
+    """ベンチマーク用の合成LOG2データを作成する"""
+    rng = np.random.default_rng(seed)
+    start = np.datetime64("2023-01-01T00:00:00")
+    seconds = rng.integers(0, 2 * 365 * 86400, n_rows)
+    return pd.DataFrame({
+        "SUB_LOT_TYPE": np.where(rng.random(n_rows) < 0.9, "P0", "P1"),
+        "LOT_ID": np.char.add("LOT", rng.integers(0, 200_000, n_rows).astype(str)),
+        "EQP_ID": np.char.add("EQP", rng.integers(0, 500, n_rows).astype(str)),
+        "OPE_NO": np.char.add("OPE.", rng.integers(0, 300, n_rows).astype(str)),
+        "OPE_START_DATETIME": np.datetime_as_string(start + seconds.astype("timedelta64[s]"), unit="s"),
+        "WAIT_TIME": rng.exponential(3600, n_rows).round(1),
+        "MRC": np.where(rng.random(n_rows) < 0.95, "MASTER", "SLAVE"),
+        "DeviceGp": np.char.add("DEV", rng.integers(0, 20, n_rows).astype(str)),
+    })
+
+
+def benchmark(n_rows=10_000_000, db_file=None):
+    """合成LOG2（既定1000万行）でpolars版とpandas版の読み込み時間を比較する"""
+    cleanup = db_file is None
+    if db_file is None:
+        db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+    try:
+        print(f"[DEBUG] 合成LOG2を作成中: {n_rows:,}行")
+        data = make_synthetic_log2(n_rows)
+        data["OPE_START_DATETIME"] = data["OPE_START_DATETIME"].str.replace("T", " ")
+        bulk_load(db_file, "LOG2", iter_frame_chunks(data))
+        del data
+
+        query = build_log2_query(typed=False)
+        results = {}
+        for name, loader in (("polars", load_log2_polars), ("pandas", load_log2_pandas)):
+            conn = sqlite3.connect(db_file)
+            start = time.perf_counter()
+            df = loader(conn, query)
+            seconds = time.perf_counter() - start
+            conn.close()
+            memory_mb = df.memory_usage(deep=True).sum() / (1024 * 1024)
+            results[name] = (len(df), seconds, memory_mb)
+            print(f"[DEBUG] {name}: {len(df):,}行, {seconds:.2f}秒, {memory_mb:,.1f}MB")
+            del df
+        speedup = results["pandas"][1] / results["polars"][1]
+        print(f"[DEBUG] 高速化倍率: {speedup:.1f}倍")
+        return results
+    finally:
+        if cleanup and os.path.exists(db_file):
+            os.remove(db_file)
+
+
+if __name__ == "__main__":
+    import sys
+
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000)
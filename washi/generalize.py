@@ -0,0 +1,169 @@
+"""装置汎用化のルールによる一括設定（setting アプリの一括モード）
+
+ルールは「設備グループ X の装置（全台または一部・新規装置を含む）を、TYPE・OPE_NO の
+集合 Y について処理可能にする / 使用禁止にする」という指定で、装置 × 工程の
+直積（DataFrameのクロス結合）で一括に展開する。同じ (設備名, TYPE, OPE_NO) に
+複数のルールが当たる場合は後のルールを優先する。
+
+出力は単体設定と同じ列（設備名, 設備グループ, TYPE, OPE_NO, INHIBIT, コピー元情報）の
+1つのCSVで、そのままシミュレータ（washi.fabsim.apply_equipment_settings）に渡せる。
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+from washi.equipment import EQUIPMENT_COLUMN
+
+# ルールの操作（INHIBIT の値）
+RULE_ACTIONS = {
+    "enable": "処理可能にする（INHIBIT=0）",
+    "inhibit": "使用禁止にする（INHIBIT=1）",
+}
+ACTION_INHIBIT = {"enable": 0, "inhibit": 1}
+
+# 出力する設定ファイルのカラム（単体設定の出力と同じ）
+SETTINGS_COLUMNS = [EQUIPMENT_COLUMN, "設備グループ", "TYPE", "OPE_NO", "INHIBIT", "コピー元情報"]
+
+# 現在の FlowInfo との比較結果
+CHANGE_COLUMN = "変更区分"
+CHANGE_ENABLED = "追加"
+CHANGE_INHIBITED = "禁止"
+CHANGE_NONE = "変更なし"
+
+
+def parse_list(text):
+    """スペース・カンマ・改行区切りの文字列をリストにする（重複は除き、順序は保つ）"""
+    return list(dict.fromkeys(item for item in re.split(r"[\s,、]+", text or "") if item))
+
+
+def make_rule(group, action, equipment=None, contains="", new_equipment=None, types=None, ope_nos=None):
+    """ルールを作成する（equipment / types / ope_nos が空の場合は絞り込みなし）"""
+    if action not in RULE_ACTIONS:
+        raise ValueError(f"未対応の操作です: {action}（{', '.join(RULE_ACTIONS)}）")
+    return {
+        "group": group,
+        "action": action,
+        "equipment": list(equipment or []),
+        "contains": contains or "",
+        "new_equipment": list(new_equipment or []),
+        "types": [str(t) for t in types or []],
+        "ope_nos": [str(o) for o in ope_nos or []],
+    }
+
+
+def describe_rule(rule):
+    """ルールの内容を1行の文字列で表す"""
+    targets = f"{len(rule['equipment'])}台" if rule["equipment"] else "全台"
+    if rule["contains"]:
+        targets += f"（名前に「{rule['contains']}」を含む）"
+    if rule["new_equipment"]:
+        targets += f" + 新規{len(rule['new_equipment'])}台"
+    types = ", ".join(rule["types"]) if rule["types"] else "全TYPE"
+    ope_nos = f"{len(rule['ope_nos'])}工程" if rule["ope_nos"] else "全工程"
+    return f"{rule['group']} の{targets} × {types} / {ope_nos} → {RULE_ACTIONS[rule['action']]}"
+
+
+def rule_targets(rule, members):
+    """ルールの対象装置（設備名, 設備グループ）を返す。members は設備グループの既存装置のリスト"""
+    names = pd.Series(members, dtype=object)
+    if rule["equipment"]:
+        names = names[names.isin(rule["equipment"])]
+    if rule["contains"]:
+        names = names[names.str.contains(rule["contains"], regex=False)]
+    names = pd.concat([names, pd.Series(rule["new_equipment"], dtype=object)]).drop_duplicates()
+    return pd.DataFrame({EQUIPMENT_COLUMN: names.to_numpy(), "設備グループ": rule["group"]})
+
+
+def rule_steps(rule, steps):
+    """ルールの対象工程（TYPE, OPE_NO）を返す。steps は FlowInfo にある (TYPE, OPE_NO) の一覧"""
+    mask = np.ones(len(steps), dtype=bool)
+    if rule["types"]:
+        mask &= steps["TYPE"].isin(rule["types"]).to_numpy()
+    if rule["ope_nos"]:
+        mask &= steps["OPE_NO"].isin(rule["ope_nos"]).to_numpy()
+    return steps.loc[mask, ["TYPE", "OPE_NO"]]
+
+
+def flow_steps(df):
+    """FlowInfo から (TYPE, OPE_NO) の一覧（文字列、重複なし）を作成する"""
+    return df[["TYPE", "OPE_NO"]].astype(str).drop_duplicates(ignore_index=True)
+
+
+def expand_rules(rules, group_members, steps):
+    """ルールを装置 × 工程に展開し、1つの設定表にまとめる（後のルールを優先）
+
+    group_members(設備グループ) は設備グループの既存装置のリストを返す関数。
+    """
+    frames = []
+    for number, rule in enumerate(rules, start=1):
+        targets = rule_targets(rule, group_members(rule["group"]))
+        expanded = targets.merge(rule_steps(rule, steps), how="cross")
+        expanded["INHIBIT"] = ACTION_INHIBIT[rule["action"]]
+        expanded["コピー元情報"] = f"ルール{number}"
+        frames.append(expanded)
+    if not frames:
+        return pd.DataFrame(columns=SETTINGS_COLUMNS)
+    settings = pd.concat(frames, ignore_index=True)[SETTINGS_COLUMNS]
+    settings = settings.drop_duplicates([EQUIPMENT_COLUMN, "TYPE", "OPE_NO"], keep="last")
+    return settings.sort_values([EQUIPMENT_COLUMN, "TYPE", "OPE_NO"], ignore_index=True)
+
+
+def mark_changes(settings, current):
+    """現在の処理可能工程（current: 設備名, TYPE, OPE_NO, INHIBIT）と比べた変更区分を付ける
+
+    使用禁止でない工程は処理可能とみなす（シミュレータと同じ判定）。
+    """
+    keys = [EQUIPMENT_COLUMN, "TYPE", "OPE_NO"]
+    capable = (
+        current.assign(CAPABLE=~current["INHIBIT"].astype(bool))
+        .groupby(keys, sort=False)["CAPABLE"].max().reset_index()
+    )
+    merged = settings.merge(capable, on=keys, how="left")
+    was_capable = merged["CAPABLE"].fillna(False).astype(bool).to_numpy()
+    enable = (merged["INHIBIT"] == 0).to_numpy()
+    merged[CHANGE_COLUMN] = np.select(
+        [enable & ~was_capable, ~enable & was_capable],
+        [CHANGE_ENABLED, CHANGE_INHIBITED],
+        default=CHANGE_NONE,
+    )
+    return merged.drop(columns=["CAPABLE"])
+
+
+def settings_to_csv(settings):
+    """設定表をシミュレータ用のCSV（UTF-8 BOM付きのバイト列）にする"""
+    return settings[SETTINGS_COLUMNS].to_csv(index=False).encode("utf-8-sig")
+
+
+if __name__ == "__main__":
+    import time
+
+    from washi.equipment import EquipmentIndex, make_synthetic_flowinfo
+
+    df = make_synthetic_flowinfo(300_000)
+    index = EquipmentIndex(df)
+    steps = flow_steps(df)
+    groups = index.groups()
+    ope_nos = sorted(steps["OPE_NO"].unique())
+
+    # 30グループの全台を各50工程で処理可能にし、一部を使用禁止に戻す
+    rules = [
+        make_rule(group, "enable", ope_nos=ope_nos[i * 50:(i + 1) * 50], new_equipment=[f"NEW_{group}"])
+        for i, group in enumerate(groups[:30])
+    ]
+    rules.append(make_rule(groups[0], "inhibit", contains="1", types=["T1", "T2"]))
+
+    start = time.perf_counter()
+    settings = expand_rules(rules, index.group_equipment, steps)
+    targets = settings[EQUIPMENT_COLUMN].unique()
+    marked = mark_changes(settings, index.capability_frame(targets))
+    csv_data = settings_to_csv(marked)
+    elapsed = time.perf_counter() - start
+    print(f"[DEBUG] ルール {len(rules)}件 → 装置 {len(targets):,}台, 設定 {len(settings):,}行, "
+          f"{elapsed:.2f}秒, CSV {len(csv_data) / 1e6:.1f}MB")
+    print(marked[CHANGE_COLUMN].value_counts().to_dict())
+
+    # 後のルールが優先されることを確認
+    overridden = marked[(marked["設備グループ"] == groups[0]) & marked["TYPE"].isin(["T1", "T2"])
+                        & marked[EQUIPMENT_COLUMN].str.contains("1", regex=False)]
+    print(f"[DEBUG] 上書きされた行: {len(overridden):,}行, 全て使用禁止={bool((overridden['INHIBIT'] == 1).all())}")
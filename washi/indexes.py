@@ -0,0 +1,199 @@
+"""LOG / LOG2 のインデックス最適化（実際のクエリのEXPLAIN QUERY PLANに基づく）"""
+import re
+import sqlite3
+import time
+
+import pandas as pd
+
+from washi.bulkload import quote_identifier
+from washi.queries import (
+    LOG2_MAX_DATE_QUERY, LOG_COLUMNS, TIME_UNIT_SAMPLE_LOTS, build_log2_date_filter, build_log2_query,
+    build_log_query,
+)
+from washi.schema import decoded_view_name, is_typed_table
+
+# 計測に使用する既定の条件（vis_b の既定値: 上限10万件、期間3ヶ月）
+DEFAULT_LIMIT = 100_000
+DEFAULT_PERIOD_MONTHS = 3
+
+# 1つのクエリの計測回数（最短の時間を採用してばらつきを抑える）
+TIMING_REPEATS = 3
+
+# 候補インデックスを採用する高速化倍率の下限（これ未満は効果なしとして削除する）
+MIN_SPEEDUP = 1.2
+
+# 候補インデックス: (インデックス名, テーブル, キーカラム, 部分インデックス条件, 条件で参照するカラム)
+# LOG2 は vis_b の P0/MASTER 絞り込みに合わせた部分インデックスで、日時を先頭キーとしてMAX/期間絞り込みに使う。
+# LOG はパラメータ推定の時間単位の推定（先頭ロットの履歴の読み込み）に使う。
+# いずれも実際に計測して高速化したものだけを残す
+CANDIDATE_INDEXES = [
+    (
+        "idx_log2_p0_master_date_cover", "LOG2",
+        ["OPE_START_DATETIME", "WAIT_TIME", "DeviceGp", "EQP_ID", "OPE_NO", "LOT_ID"],
+        "SUB_LOT_TYPE = 'P0' AND MRC = 'MASTER'", ["SUB_LOT_TYPE", "MRC"],
+    ),
+    (
+        "idx_log_lot_id_stime", "LOG",
+        ["LOT_ID", "STIME"],
+        None, [],
+    ),
+]
+
+
+def get_columns(conn, table_name):
+    """テーブルのカラム一覧を返す（存在しない場合は空）"""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({quote_identifier(table_name)})")]
+
+
+def find_column(columns, candidates):
+    """候補の中で最初に存在するカラム名を返す（大文字・小文字は区別しない）"""
+    lookup = {str(col).upper(): col for col in columns}
+    for candidate in candidates:
+        if candidate.upper() in lookup:
+            return lookup[candidate.upper()]
+    return None
+
+
+def build_workload(conn):
+    """アプリが発行するクエリ一覧 (名前, SQL) を作成する"""
+    workload = []
+    if get_columns(conn, "LOG2"):
+        typed = is_typed_table(conn, "LOG2")
+        limit_clause = f"LIMIT {DEFAULT_LIMIT}"
+        workload.append(("vis_b: 最新日時", LOG2_MAX_DATE_QUERY))
+        workload.append(("vis_b: 全期間", build_log2_query(typed, "", limit_clause)))
+        max_date = conn.execute(LOG2_MAX_DATE_QUERY).fetchone()[0]
+        if max_date is not None:
+            date_filter = build_log2_date_filter(max_date, DEFAULT_PERIOD_MONTHS, typed)
+            workload.append(
+                (f"vis_b: 直近{DEFAULT_PERIOD_MONTHS}ヶ月", build_log2_query(typed, date_filter, limit_clause))
+            )
+
+    log_columns = get_columns(conn, "LOG")
+    if log_columns:
+        # washi.fabsim.load_log と同じクエリ（型付きスキーマの場合は復号ビューから読み込む）
+        source = decoded_view_name("LOG") if is_typed_table(conn, "LOG") else "LOG"
+        selected = [col for col in LOG_COLUMNS if col in log_columns]
+        workload.append((
+            "パラメータ推定: 時間単位の推定（先頭ロットの履歴）",
+            build_log_query(source, selected, sample_lots=TIME_UNIT_SAMPLE_LOTS),
+        ))
+    return workload
+
+
+def explain(conn, sql):
+    """EXPLAIN QUERY PLAN の結果を1行の文字列で返す"""
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    return " / ".join(row[-1] for row in rows)
+
+
+def time_query(conn, sql, repeats=TIMING_REPEATS):
+    """クエリを最後まで読み込んだ時間（秒、repeats 回の最短）を計測する"""
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        cursor = conn.execute(sql)
+        while cursor.fetchmany(10_000):
+            pass
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def candidate_index_sql(name, table, columns, where):
+    """候補インデックスのCREATE文を返す"""
+    cols = ", ".join(quote_identifier(col) for col in columns)
+    sql = f"CREATE INDEX IF NOT EXISTS {quote_identifier(name)} ON {quote_identifier(table)} ({cols})"
+    if where:
+        sql += f" WHERE {where}"
+    return sql
+
+
+def run_index_advisor(db_file, progress_callback=None):
+    """クエリごとの実行計画と時間を計測し、候補インデックスを作成して再計測する
+
+    候補インデックスは、それを使用するクエリのいずれかが MIN_SPEEDUP 倍以上速くなり、
+    かつ遅くなったクエリ（1 / MIN_SPEEDUP 倍未満）がない場合のみ採用し、それ以外は削除する。
+    戻り値: (クエリごとの計測結果DataFrame, 採用したインデックス名, 未使用の既存インデックス名)
+    """
+    conn = sqlite3.connect(db_file)
+    try:
+        workload = build_workload(conn)
+        if not workload:
+            return pd.DataFrame(), [], []
+
+        def notify(message):
+            if progress_callback is not None:
+                progress_callback(message)
+
+        # 変更前の計測
+        before = {}
+        for name, sql in workload:
+            notify(f"変更前を計測中: {name}")
+            before[name] = (explain(conn, sql), time_query(conn, sql))
+
+        # 候補インデックスの作成（カラムが揃っているテーブルのみ）
+        created = []
+        for index_name, table, columns, where, where_columns in CANDIDATE_INDEXES:
+            table_columns = set(get_columns(conn, table))
+            if not table_columns or not set(columns + where_columns) <= table_columns:
+                continue
+            notify(f"インデックス作成中: {index_name}")
+            conn.execute(candidate_index_sql(index_name, table, columns, where))
+            created.append((index_name, table))
+        conn.commit()
+        for table in sorted({table for _, table in created}):
+            conn.execute(f"ANALYZE {quote_identifier(table)}")
+        conn.commit()
+
+        # 変更後の計測
+        rows = []
+        speedup_of = {}
+        for name, sql in workload:
+            notify(f"変更後を計測中: {name}")
+            plan_after = explain(conn, sql)
+            seconds_after = time_query(conn, sql)
+            plan_before, seconds_before = before[name]
+            speedup_of[name] = seconds_before / max(seconds_after, 1e-9)
+            rows.append({
+                "クエリ": name,
+                "変更前の実行計画": plan_before,
+                "変更後の実行計画": plan_after,
+                "変更前(秒)": round(seconds_before, 3),
+                "変更後(秒)": round(seconds_after, 3),
+                "高速化倍率": round(seconds_before / seconds_after, 1) if seconds_after > 0 else None,
+            })
+        report = pd.DataFrame(rows)
+
+        plans = " ".join(report["変更後の実行計画"])
+
+        def used(index_name, plan=plans):
+            return re.search(rf"\b{re.escape(index_name)}\b", plan) is not None
+
+        # 使用したクエリで計測上の効果があった候補のみ残す
+        adopted = []
+        for index_name, _ in created:
+            speedups = [
+                speedup_of[row["クエリ"]] for row in rows if used(index_name, row["変更後の実行計画"])
+            ]
+            if speedups and max(speedups) >= MIN_SPEEDUP and min(speedups) >= 1 / MIN_SPEEDUP:
+                adopted.append(index_name)
+            else:
+                print(f"[DEBUG] 候補インデックスを削除: {index_name}（高速化倍率: {[round(x, 2) for x in speedups]}）")
+                conn.execute(f"DROP INDEX IF EXISTS {quote_identifier(index_name)}")
+        conn.commit()
+        report["採用"] = [
+            ", ".join(name for name in adopted if used(name, plan)) for plan in report["変更後の実行計画"]
+        ]
+
+        # 既存インデックスのうち、どのクエリにも使われていないもの（削除候補として報告のみ）
+        unused = [
+            name for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name IN ('LOG', 'LOG2') "
+                "AND sql IS NOT NULL"
+            )
+            if not used(name)
+        ]
+        return report, adopted, unused
+    finally:
+        conn.close()
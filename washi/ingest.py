@@ -0,0 +1,129 @@
+"""CSVのストリーミング取り込み（チャンク単位で読み込み、全体を保持しない）"""
+import os
+
+import pandas as pd
+
+from washi.bulkload import bulk_load
+from washi.columnar import ParquetDatasetWriter
+from washi.dedup import append_new_rows
+from washi.schema import DICT_COLUMNS, typed_load_options
+
+# 1チャンクあたりの行数（メモリ使用量はおおよそこの行数分で一定になる）
+DEFAULT_CHUNK_SIZE = 100_000
+
+# 試行するエンコーディング（先頭から順に試す）
+CSV_ENCODINGS = ("utf-8", "shift_jis")
+
+
+def _rewind(source):
+    """ファイルポインタを先頭に戻す"""
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+
+def _source_size(source):
+    """入力の総バイト数を取得（取得できない場合はNone）"""
+    size = getattr(source, "size", None)
+    if size:
+        return size
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    if hasattr(source, "getbuffer"):
+        return source.getbuffer().nbytes
+    return None
+
+
+def iter_csv_chunks(source, chunksize=DEFAULT_CHUNK_SIZE, encoding="utf-8"):
+    """CSVをチャンク単位で読み込むイテレータ
+
+    IDカラム（DICT_COLUMNS）はチャンクごとの型推定で表記が揺れないよう文字列として読み込む。
+    """
+    _rewind(source)
+    dtype = {col: str for col in DICT_COLUMNS}
+    with pd.read_csv(source, chunksize=chunksize, encoding=encoding, dtype=dtype) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def peek_csv(source, nrows=5):
+    """CSVの先頭行のみを読み込む（プレビュー用）"""
+    last_error = None
+    for encoding in CSV_ENCODINGS:
+        try:
+            _rewind(source)
+            df = pd.read_csv(source, nrows=nrows, encoding=encoding)
+            _rewind(source)
+            return df, encoding
+        except UnicodeDecodeError as e:
+            last_error = e
+    raise last_error
+
+
+def stream_csv_to_table(source, db_file, table_name, chunksize=DEFAULT_CHUNK_SIZE,
+                        replace=True, index_sqls=None, progress_callback=None,
+                        typed=False, columnar=False, observers=None, dedup=False):
+    """CSVをチャンク単位でテーブルへ書き込む（全体を1トランザクションで実行）
+
+    progress_callback(書き込み済み行数, 進捗率0.0〜1.0 または None) を各チャンク後に呼び出す。
+    エンコーディングエラーはロールバックして次のエンコーディングで再試行する。
+    typed=True の場合は型付きスキーマ（washi.schema）を適用して書き込む。
+    columnar=True の場合は同じチャンクをParquetデータセット（washi.columnar）にも書き込む。
+    observers には tee(chunks) と add(chunk) を持つオブジェクト（washi.cube.MonthCollector など）を渡せる。
+    dedup=True の場合は自然キーで取り込み済みの行を除外して追加する（washi.dedup）。
+    この場合 Parquet と observers には実際に追加された行のみが渡される。
+    戻り値は bulk_load と同じ書き込み結果の辞書（columnar=True の場合は parquet に成否を追加）。
+    """
+    path_opened = isinstance(source, (str, os.PathLike))
+    handle = open(source, "rb") if path_opened else source
+    total_size = _source_size(source)
+
+    def on_chunk(rows):
+        if progress_callback is not None:
+            fraction = None
+            if total_size and hasattr(handle, "tell"):
+                fraction = min(1.0, handle.tell() / total_size)
+            progress_callback(rows, fraction)
+
+    try:
+        last_error = None
+        for encoding in CSV_ENCODINGS:
+            # 辞書キャッシュはロールバックで無効になるため試行ごとに作り直す
+            chunks = iter_csv_chunks(handle, chunksize=chunksize, encoding=encoding)
+            writer = ParquetDatasetWriter(table_name, append=dedup or not replace) if columnar else None
+            try:
+                if dedup:
+                    sinks = [observer.add for observer in observers or []]
+                    if writer is not None:
+                        sinks.append(writer.write)
+                    result = append_new_rows(
+                        db_file, table_name, chunks, index_sqls=index_sqls,
+                        progress_callback=on_chunk, sinks=sinks
+                    )
+                else:
+                    load_options = typed_load_options() if typed else {}
+                    if writer is not None:
+                        chunks = writer.tee(chunks)
+                    for observer in observers or []:
+                        chunks = observer.tee(chunks)
+                    result = bulk_load(
+                        db_file, table_name, chunks,
+                        replace=replace, index_sqls=index_sqls, progress_callback=on_chunk,
+                        **load_options
+                    )
+            except UnicodeDecodeError as e:
+                print(f"[DEBUG] {encoding} での読み込みに失敗したため再試行します: {e}")
+                last_error = e
+                if writer is not None:
+                    writer.abort()
+                continue
+            except Exception:
+                if writer is not None:
+                    writer.abort()
+                raise
+            if writer is not None:
+                result["parquet"] = writer.commit()
+            return result
+        raise last_error
+    finally:
+        if path_opened:
+            handle.close()
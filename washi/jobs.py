@@ -0,0 +1,465 @@
+"""パラメータ推定・シミュレーションのバックグラウンド実行（SQLiteのジョブテーブル + プロセスプールのワーカー）
+
+画面（param / sim アプリ）は submit_job() でジョブを登録し、ensure_worker() でワーカーを起動するだけで、
+処理はStreamlitのリクエストとは別のプロセスで実行される。ブラウザを再読み込みしても処理は続き、
+状態・進捗・結果のパスはジョブテーブルに保存されるため、画面は list_jobs() で確認できる。
+
+ワーカーは `python -m washi.jobs` で起動する常駐プロセスで、待機中のジョブを順に取り出して
+プロセスプールで実行する（同時実行数は MAX_PARALLEL_JOBS）。待機中のジョブがなくなって
+一定時間経つと終了する。
+"""
+import importlib
+import inspect
+import json
+import os
+import pickle
+import re
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# ジョブテーブルのデータベース（loadフォルダ内）
+JOBS_DB = os.path.join("./load", "jobs.db")
+
+# ジョブの状態
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+STATUS_LABELS = {
+    QUEUED: "⏳ 待機中",
+    RUNNING: "🏃 実行中",
+    DONE: "✅ 完了",
+    FAILED: "❌ 失敗",
+    CANCELLED: "🚫 取消",
+}
+
+# ワーカーの設定
+MAX_PARALLEL_JOBS = max(1, min(2, (os.cpu_count() or 1) // 2))
+POLL_INTERVAL = 1.0
+HEARTBEAT_TIMEOUT = 30
+IDLE_EXIT_SECONDS = 60
+
+# 進捗の書き込み間隔（秒）
+PROGRESS_INTERVAL = 1.0
+
+BUSY_TIMEOUT_MS = 30_000
+
+# 結果ファイル・フォルダの名前に使える文字（英数字・日本語・_ - .、先頭の . は不可）
+NAME_PATTERN = re.compile(r"[\w\-][\w\-.]{0,99}")
+
+CREATE_JOBS_SQL = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        label TEXT,
+        args TEXT NOT NULL,
+        status TEXT NOT NULL,
+        progress REAL NOT NULL DEFAULT 0,
+        message TEXT,
+        result_path TEXT,
+        error TEXT,
+        pid INTEGER,
+        created_at TEXT NOT NULL,
+        started_at TEXT,
+        finished_at TEXT
+    )
+"""
+
+CREATE_WORKER_SQL = """
+    CREATE TABLE IF NOT EXISTS worker (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        pid INTEGER NOT NULL,
+        heartbeat REAL NOT NULL
+    )
+"""
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def connect(db_file=JOBS_DB):
+    """ジョブテーブルに接続する（複数プロセスから書き込むためWALモードを使用）"""
+    os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+    conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute(CREATE_JOBS_SQL)
+    conn.execute(CREATE_WORKER_SQL)
+    return conn
+
+
+def validate_name(name):
+    """画面で入力された結果ファイル・フォルダの名前を確認して返す（パス区切り等を含む場合は ValueError）"""
+    if not NAME_PATTERN.fullmatch(name):
+        raise ValueError(
+            f"名前に使用できない文字が含まれています: {name!r}（英数字・日本語・「_」「-」「.」で100文字以内、先頭に「.」は不可）"
+        )
+    return name
+
+
+def submit_job(kind, args, label=None, db_file=JOBS_DB):
+    """ジョブを登録してジョブIDを返す（args はJSONに変換できる辞書）"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"未対応のジョブ種別です: {kind}")
+    conn = connect(db_file)
+    try:
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, label, args, status, message, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, label, json.dumps(args, ensure_ascii=False), QUEUED, "実行待ち", _now())
+            )
+        print(f"[DEBUG] ジョブ登録: #{cursor.lastrowid} {kind} {label or ''}")
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def list_jobs(kind=None, limit=20, db_file=JOBS_DB):
+    """ジョブの一覧を新しい順に返す（辞書のリスト）"""
+    if not os.path.exists(db_file):
+        return []
+    conn = connect(db_file)
+    try:
+        where, params = "", []
+        if kind is not None:
+            where, params = "WHERE kind = ?", [kind]
+        rows = conn.execute(
+            f"SELECT * FROM jobs {where} ORDER BY job_id DESC LIMIT ?", params + [limit]
+        ).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+
+def get_job(job_id, db_file=JOBS_DB):
+    """ジョブを1件取得する（存在しない場合はNone）"""
+    conn = connect(db_file)
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+    finally:
+        conn.close()
+
+
+def cancel_job(job_id, db_file=JOBS_DB):
+    """待機中のジョブを取り消す（実行中のジョブは取り消せない）"""
+    conn = connect(db_file)
+    try:
+        with conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, message = ?, finished_at = ? WHERE job_id = ? AND status = ?",
+                (CANCELLED, "取り消されました", _now(), job_id, QUEUED)
+            )
+        return cursor.rowcount > 0
+    finally:
+        conn.close()
+
+
+def update_job(conn, job_id, **fields):
+    """ジョブの項目を更新する"""
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    with conn:
+        conn.execute(f"UPDATE jobs SET {columns} WHERE job_id = ?", list(fields.values()) + [job_id])
+
+
+class JobContext:
+    """実行中のジョブから進捗を書き込むためのオブジェクト（ジョブの処理関数に渡される）"""
+
+    def __init__(self, conn, job_id):
+        self.conn = conn
+        self.job_id = job_id
+        self.last_update = 0.0
+
+    def progress(self, fraction, message=None, force=False):
+        """進捗（0～1）とメッセージを書き込む（頻繁な書き込みは間引く）"""
+        now = time.monotonic()
+        if not force and now - self.last_update < PROGRESS_INTERVAL:
+            return
+        self.last_update = now
+        fields = {"progress": float(min(max(fraction, 0.0), 1.0))}
+        if message is not None:
+            fields["message"] = message
+        update_job(self.conn, self.job_id, **fields)
+
+
+def import_app_module(name, module_dir=None):
+    """暗号化モジュール（param_enc / sim_enc）を読み込む（アプリのフォルダを検索パスに追加）"""
+    if module_dir and module_dir not in sys.path:
+        sys.path.insert(0, module_dir)
+    return importlib.import_module(name)
+
+
+def import_estimator(module_dir=None):
+    """パラメータ推定モジュールを読み込む（param_enc がない環境では参照実装 washi.paramest を使う）"""
+    try:
+        return import_app_module("param_enc", module_dir)
+    except ImportError as e:
+        print(f"[DEBUG] param_enc を読み込めないため参照実装を使用します: {e}")
+        return importlib.import_module("washi.paramest")
+
+
+def import_simulator(module_dir=None):
+    """シミュレーションモジュールを読み込む（sim_enc がない環境では参照実装 washi.fabsim を使う）"""
+    try:
+        return import_app_module("sim_enc", module_dir)
+    except ImportError as e:
+        print(f"[DEBUG] sim_enc を読み込めないため参照実装を使用します: {e}")
+        return importlib.import_module("washi.fabsim")
+
+
+def _accepts(func, name):
+    """関数が指定の引数を受け取れるか判定する（シグネチャを取得できない場合はFalse）"""
+    try:
+        return name in inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def run_param_estimate(context, args):
+    """パラメータ推定ジョブ（結果はloadフォルダにpickleで保存）"""
+    output_path = os.path.join(args["load_folder"], f"{args.get('name', 'parameter')}.pkl")
+    progress_callback = lambda fraction, message=None: context.progress(0.1 + 0.8 * fraction, message)
+    if args.get("incremental"):
+        # 差分更新（前回の推定以降に追加されたLOGのみを十分統計量に反映する）
+        from washi.paramstats import param_update
+
+        context.progress(0.1, "パラメータを差分更新中...", force=True)
+        parameter = param_update(args["file_path"], output_path, progress_callback=progress_callback)
+    else:
+        context.progress(0.05, "パラメータ推定モジュールを読み込み中...", force=True)
+        param_enc = import_estimator(args.get("module_dir"))
+
+        context.progress(0.1, "パラメータ推定を実行中...", force=True)
+        kwargs = {}
+        if _accepts(param_enc.param_estimate, "progress_callback"):
+            # 進捗を報告できる実装の場合は 10%～90% の範囲で反映する
+            kwargs["progress_callback"] = progress_callback
+        parameter = param_enc.param_estimate(args["file_path"], **kwargs)
+
+    context.progress(0.9, "結果を保存中...", force=True)
+    with open(output_path, "wb") as f:
+        pickle.dump(parameter, f)
+    return output_path
+
+
+def run_simulation(context, args):
+    """シミュレーションジョブ（逐次書き出しに対応していればパートファイル、それ以外はArrow IPC）"""
+    from washi.simresult import SIMRES_NAME, ResultSink, accepts_sink, write_simres
+
+    context.progress(0.05, "シミュレーションモジュールを読み込み中...", force=True)
+    sim_enc = import_simulator(args.get("module_dir"))
+    sim_args = (args["database_path"], args["parameter_path"], args["equipment_path"])
+    name = args.get("name", SIMRES_NAME)
+
+    context.progress(0.1, "シミュレーションを実行中...", force=True)
+    if accepts_sink(sim_enc.sim):
+        # 件数の総数は不明なため、進捗は書き出し済みの行数で表示する
+        with ResultSink(
+            args["load_folder"], name=name,
+            progress_callback=lambda rows, parts: context.progress(0.5, f"シミュレーションを実行中...（書き出し済み {rows:,}行）")
+        ) as sink:
+            sim_enc.sim(*sim_args, sink=sink)
+        return sink.path
+
+    simres = sim_enc.sim(*sim_args)
+    context.progress(0.9, "結果を保存中...", force=True)
+    return write_simres(simres, args["load_folder"], name=name)
+
+
+def run_simulation_sweep(context, args):
+    """複数シナリオのスイープジョブ（全コアで並列実行し、比較表を保存）"""
+    from washi.sweep import run_sweep
+
+    context.progress(0.02, "スナップショットを作成中...", force=True)
+    return run_sweep(
+        args["database_path"], args["parameter_path"], args["scenario_dir"], args["output_dir"],
+        module_dir=args.get("module_dir"),
+        progress_callback=lambda done, total, scenario: context.progress(
+            done / total, f"{done}/{total} シナリオ完了（{scenario}）", force=True
+        ),
+    )
+
+
+# ジョブ種別ごとの処理関数（プロセスプールで実行するためモジュールの最上位に定義する）
+JOB_HANDLERS = {
+    "param_estimate": run_param_estimate,
+    "simulation": run_simulation,
+    "sweep": run_simulation_sweep,
+}
+
+
+def run_job(job_id, db_file=JOBS_DB):
+    """ジョブを1件実行する（プロセスプールの子プロセスで実行される）"""
+    conn = connect(db_file)
+    try:
+        job = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        update_job(conn, job_id, pid=os.getpid())
+        context = JobContext(conn, job_id)
+        try:
+            result_path = JOB_HANDLERS[job["kind"]](context, json.loads(job["args"]))
+        except Exception as e:
+            print(f"[DEBUG] ジョブ失敗: #{job_id} {type(e).__name__}: {e}")
+            update_job(conn, job_id, status=FAILED, message="エラーで終了しました",
+                       error=f"{type(e).__name__}: {e}", finished_at=_now())
+            return False
+        update_job(conn, job_id, status=DONE, progress=1.0, message="完了",
+                   result_path=result_path, finished_at=_now())
+        print(f"[DEBUG] ジョブ完了: #{job_id} {result_path}")
+        return True
+    finally:
+        conn.close()
+
+
+def claim_next_job(conn):
+    """待機中のジョブを1件取り出して実行中にする（なければNone）"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT job_id FROM jobs WHERE status = ? ORDER BY job_id LIMIT 1", (QUEUED,)
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = ?, message = ?, started_at = ? WHERE job_id = ?",
+            (RUNNING, "開始待ち", _now(), row["job_id"])
+        )
+        conn.execute("COMMIT")
+        return row["job_id"]
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def worker_alive(db_file=JOBS_DB):
+    """ワーカーが動いているか確認する（一定時間ハートビートがなければ停止とみなす）"""
+    if not os.path.exists(db_file):
+        return False
+    conn = connect(db_file)
+    try:
+        row = conn.execute("SELECT heartbeat FROM worker WHERE id = 1").fetchone()
+        return row is not None and time.time() - row["heartbeat"] < HEARTBEAT_TIMEOUT
+    finally:
+        conn.close()
+
+
+def _register_worker(conn):
+    """このプロセスをワーカーとして登録する（他のワーカーが動いている場合はFalse）"""
+    conn.execute("BEGIN IMMEDIATE")
+    row = conn.execute("SELECT pid, heartbeat FROM worker WHERE id = 1").fetchone()
+    if row is not None and row["pid"] != os.getpid() and time.time() - row["heartbeat"] < HEARTBEAT_TIMEOUT:
+        conn.execute("ROLLBACK")
+        return False
+    conn.execute(
+        "INSERT OR REPLACE INTO worker (id, pid, heartbeat) VALUES (1, ?, ?)", (os.getpid(), time.time())
+    )
+    # 前回のワーカーが停止した時点で実行中だったジョブは再開できないため失敗にする
+    conn.execute(
+        "UPDATE jobs SET status = ?, message = ?, error = ?, finished_at = ? WHERE status = ?",
+        (FAILED, "ワーカーの停止により中断されました", "interrupted", _now(), RUNNING)
+    )
+    conn.execute("COMMIT")
+    return True
+
+
+def _retire_worker(conn):
+    """待機中のジョブがなければワーカーの登録を解除する（解除した場合はTrue）
+
+    確認と解除を1つの書き込みトランザクションで行うため、解除前に登録されたジョブはこのワーカーが実行し、
+    解除後に登録されたジョブは ensure_worker() が新しいワーカーを起動して実行する。
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        queued = conn.execute("SELECT 1 FROM jobs WHERE status = ? LIMIT 1", (QUEUED,)).fetchone()
+        if queued is None:
+            conn.execute("DELETE FROM worker WHERE id = 1 AND pid = ?", (os.getpid(),))
+        conn.execute("COMMIT")
+        return queued is None
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def worker_loop(db_file=JOBS_DB, max_workers=MAX_PARALLEL_JOBS, idle_exit=IDLE_EXIT_SECONDS):
+    """待機中のジョブを取り出してプロセスプールで実行する"""
+    conn = connect(db_file)
+    if not _register_worker(conn):
+        print("[DEBUG] 他のワーカーが実行中のため終了します")
+        conn.close()
+        return
+    print(f"[DEBUG] ワーカー開始: pid={os.getpid()} 同時実行数={max_workers}")
+
+    running = {}
+    idle_since = time.monotonic()
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            while True:
+                with conn:
+                    conn.execute("UPDATE worker SET heartbeat = ? WHERE id = 1", (time.time(),))
+
+                for job_id, future in list(running.items()):
+                    if future.done():
+                        if future.exception() is not None:
+                            # 子プロセスの異常終了など、ジョブ内で記録できなかったエラー
+                            update_job(conn, job_id, status=FAILED, message="エラーで終了しました",
+                                       error=str(future.exception()), finished_at=_now())
+                        del running[job_id]
+
+                while len(running) < max_workers:
+                    job_id = claim_next_job(conn)
+                    if job_id is None:
+                        break
+                    running[job_id] = pool.submit(run_job, job_id, os.path.abspath(db_file))
+                    print(f"[DEBUG] ジョブ開始: #{job_id}")
+
+                if running:
+                    idle_since = time.monotonic()
+                elif time.monotonic() - idle_since > idle_exit:
+                    if _retire_worker(conn):
+                        print("[DEBUG] 待機中のジョブがないためワーカーを終了します")
+                        break
+                    # 最後の取り出しの後に登録されたジョブがあれば続けて実行する
+                    continue
+                time.sleep(POLL_INTERVAL)
+    finally:
+        with conn:
+            conn.execute("DELETE FROM worker WHERE id = 1 AND pid = ?", (os.getpid(),))
+        conn.close()
+
+
+def ensure_worker(db_file=JOBS_DB):
+    """ワーカーが動いていなければ、画面から独立したプロセスとして起動する"""
+    if worker_alive(db_file):
+        return False
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cmd = [sys.executable, "-m", "washi.jobs", "--db", os.path.abspath(db_file)]
+    options = {"cwd": os.getcwd(), "stdin": subprocess.DEVNULL}
+    if os.name == "nt":
+        options["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.DETACHED_PROCESS
+    else:
+        options["start_new_session"] = True
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [repo_root, env.get("PYTHONPATH")]))
+    subprocess.Popen(cmd, env=env, **options)
+    print(f"[DEBUG] ワーカーを起動しました: {' '.join(cmd)}")
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="WASHI ジョブワーカー")
+    parser.add_argument("--db", default=JOBS_DB, help="ジョブテーブルのデータベース")
+    parser.add_argument("--workers", type=int, default=MAX_PARALLEL_JOBS, help="同時実行数")
+    parser.add_argument("--idle-exit", type=float, default=IDLE_EXIT_SECONDS, help="待機ジョブがない場合に終了するまでの秒数")
+    options = parser.parse_args()
+    worker_loop(options.db, options.workers, options.idle_exit)
@@ -0,0 +1,40 @@
+"""ジョブの状態表示（param / sim アプリ共通のStreamlit部品）
+
+washi.jobs はワーカーのプロセスからも読み込まれるため、Streamlitを使う表示部分はこのモジュールに分ける。
+"""
+import streamlit as st
+
+from washi.jobs import DONE, FAILED, QUEUED, RUNNING, STATUS_LABELS, cancel_job, list_jobs
+
+
+def show_result_path(job, latest=False):
+    """完了したジョブの結果ファイルを表示する（既定の表示）"""
+    st.success(f"📁 結果: {job['result_path']}")
+
+
+def show_job_status(kind, show_result=show_result_path):
+    """ジョブの一覧と進捗を表示（待機中・実行中のジョブがあればTrue）
+
+    show_result(job, latest) は完了したジョブの結果を表示する関数（latest は最新のジョブかどうか）。
+    """
+    jobs = list_jobs(kind)
+    if not jobs:
+        st.info("登録されたジョブはありません。")
+        return False
+
+    active = False
+    for job in jobs:
+        st.write(f"**#{job['job_id']} {job['label'] or ''}** {STATUS_LABELS.get(job['status'], job['status'])}（登録: {job['created_at']}）")
+        if job['status'] == RUNNING:
+            active = True
+            st.progress(job['progress'], text=job['message'] or "")
+        elif job['status'] == QUEUED:
+            active = True
+            if st.button("🚫 取り消し", key=f"cancel_{job['job_id']}"):
+                cancel_job(job['job_id'])
+                st.rerun()
+        elif job['status'] == DONE:
+            show_result(job, job is jobs[0])
+        elif job['status'] == FAILED:
+            st.error(f"❌ {job['message']}: {job['error']}")
+    return active
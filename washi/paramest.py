@@ -0,0 +1,242 @@
+"""パラメータ推定の参照実装（param_enc.param_estimate と同じ呼び出し方）
+
+LOGテーブルから (EQP_ID, OPE_NO, PROD_TYPE) ごとの処理時間・待ち時間の分布を
+polarsのグループ集計でまとめて求める。結果は辞書としてpickleで保存され、
+washi.fabsim はこのうち process_time と time_unit_seconds を使用する。
+
+複数コアで実行する場合は、LOGを1回だけ読み込んでから設備グループ（FlowInfo の EQP_GRP_CONV）
+単位のパーティションにメモリ上で分け、プロセスプールで並列に集計して結合する。集計キーに EQP_ID を
+含むため、パーティションの結果を連結するだけで全体を一括で集計した結果と一致する。
+"""
+import heapq
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import polars as pl
+
+from washi.columnar import polars_to_pandas
+from washi.fabsim import (
+    PROCESS_TIME_COLUMNS, PROCESS_TIME_KEY, TIME_UNIT_KEY,
+    infer_time_unit, load_equipment_groups, load_log
+)
+from washi.queries import TIME_UNIT_SAMPLE_LOTS
+
+# パラメータの集計キー
+PARAMETER_KEYS = ["EQP_ID", "OPE_NO", "PROD_TYPE"]
+
+# パラメータファイル（辞書）のキー
+DISTRIBUTION_KEY = "distributions"   # DataFrame: キーごとの処理時間・待ち時間の分布
+SOURCE_KEY = "source"
+ROWS_KEY = "rows"
+ESTIMATED_AT_KEY = "estimated_at"
+ESTIMATOR_KEY = "estimator"          # 作成したモジュール（param_enc の結果にはない）
+
+# 1プロセスあたりのパーティション数（大きいグループによる偏りをならす）
+PARTITIONS_PER_WORKER = 2
+
+# 分布として求める分位点
+QUANTILES = {"q1": 0.25, "median": 0.5, "q3": 0.75, "p95": 0.95}
+
+
+def distribution_exprs(column):
+    """1カラム分の分布の集計式（件数・平均・標準偏差・分位点・対数正規分布のパラメータ）"""
+    value = pl.col(column)
+    positive = value.filter(value > 0)
+    exprs = [
+        value.mean().alias(f"{column}_mean"),
+        value.std().alias(f"{column}_std"),
+        value.min().alias(f"{column}_min"),
+        value.max().alias(f"{column}_max"),
+        (value <= 0).mean().alias(f"{column}_zero_rate"),
+        # 正の値を対数正規分布で近似した場合の平均・標準偏差（対数）
+        positive.log().mean().alias(f"{column}_log_mean"),
+        positive.log().std().alias(f"{column}_log_std"),
+    ]
+    exprs += [
+        value.quantile(q, interpolation="linear").alias(f"{column}_{name}")
+        for name, q in QUANTILES.items()
+    ]
+    return exprs
+
+
+def estimate_distributions(log):
+    """LOGをキーごとに集計し、処理時間・待ち時間の分布を返す（polarsのDataFrame）"""
+    return (
+        log.lazy()
+        .drop_nulls(PARAMETER_KEYS)
+        .group_by(PARAMETER_KEYS)
+        .agg(
+            pl.len().alias("count"),
+            *distribution_exprs("RUN_TIME"),
+            *distribution_exprs("WAIT_TIME"),
+        )
+        .sort(PARAMETER_KEYS)
+        .collect()
+    )
+
+
+def to_process_times(distributions):
+    """分布から fabsim 用の処理時間（中央値）の表を作成する"""
+    return polars_to_pandas(
+        distributions.filter(pl.col("RUN_TIME_median") > 0).select(
+            pl.col("PROD_TYPE").alias("TYPE"),
+            "OPE_NO",
+            "EQP_ID",
+            pl.col("RUN_TIME_median").alias("RUN_TIME"),
+        )
+    )[PROCESS_TIME_COLUMNS]
+
+
+def plan_partitions(conn, log, n_partitions):
+    """装置を設備グループ単位でパーティションに分け、装置名→パーティション番号の辞書を返す
+
+    グループの行数が大きい順に、行数の最も少ないパーティションへ割り当てる。
+    FlowInfo にない装置は装置ごとに1グループとして扱う。
+    """
+    counts = log.drop_nulls("EQP_ID").group_by("EQP_ID").len()
+    eqp_groups = load_equipment_groups(conn)
+    groups = {}
+    for eqp, count in counts.iter_rows():
+        members = groups.setdefault(eqp_groups.get(eqp, f"装置:{eqp}"), [[], 0])
+        members[0].append(eqp)
+        members[1] += count
+
+    partitions = [(0, i, []) for i in range(max(1, min(n_partitions, len(groups))))]
+    heapq.heapify(partitions)
+    for eqps, count in sorted(groups.values(), key=lambda item: item[1], reverse=True):
+        rows, index, members = heapq.heappop(partitions)
+        members.extend(eqps)
+        heapq.heappush(partitions, (rows + count, index, members))
+    return {eqp: index for _, index, members in partitions for eqp in members}
+
+
+def split_partitions(log, partition_of):
+    """読み込み済みのLOGをパーティションごとのDataFrameに分ける（装置のない行は集計対象外のため除く）"""
+    return (
+        log.drop_nulls("EQP_ID")
+        .with_columns(pl.col("EQP_ID").replace_strict(partition_of, return_dtype=pl.Int64).alias("_partition"))
+        .partition_by("_partition", include_key=False)
+    )
+
+
+def estimate_partition(log):
+    """1パーティション分の分布を集計する（プロセスプールの子プロセスで実行される）"""
+    return estimate_distributions(log), len(log)
+
+
+def param_estimate(file_path, progress_callback=None, max_workers=None):
+    """データベースのLOGからパラメータを推定する（param_enc.param_estimate と同じ引数）
+
+    progress_callback(割合, メッセージ) で進捗を受け取れる。
+    max_workers=None の場合はCPUコア数で並列に集計し、1の場合は一括で集計する。
+    """
+    def report(fraction, message):
+        print(f"[DEBUG] {message}")
+        if progress_callback is not None:
+            progress_callback(fraction, message)
+
+    start = time.perf_counter()
+    max_workers = max_workers or os.cpu_count() or 1
+    report(0.0, "LOGを読み込み中...")
+    conn = sqlite3.connect(file_path)
+    try:
+        # 時間単位は一部のロットの処理順から推定する
+        time_unit = infer_time_unit(load_log(conn, sample_lots=TIME_UNIT_SAMPLE_LOTS))
+        # 集計に必要なカラムのみ1回で読み込む（パーティションごとにLOGを走査しない）
+        log = load_log(conn, PARAMETER_KEYS + ["RUN_TIME", "WAIT_TIME"])
+        partitions = []
+        if max_workers > 1:
+            partitions = split_partitions(log, plan_partitions(conn, log, max_workers * PARTITIONS_PER_WORKER))
+    finally:
+        conn.close()
+
+    if len(partitions) <= 1:
+        report(0.5, f"分布を集計中...（{len(log):,}行）")
+        distributions = estimate_distributions(log)
+        rows = len(log)
+    else:
+        report(0.1, f"分布を並列に集計中...（{len(partitions)}パーティション, {max_workers}プロセス）")
+        del log
+        results = []
+        # polarsを使用済みのプロセスをforkすると子プロセスが停止することがあるため spawn で起動する
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(partitions)),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(estimate_partition, partitions.pop()) for _ in range(len(partitions))]
+            for future in as_completed(futures):
+                results.append(future.result())
+                report(0.1 + 0.8 * len(results) / len(futures),
+                       f"パーティション集計完了: {len(results)}/{len(futures)}")
+        distributions = pl.concat([result for result, _ in results]).sort(PARAMETER_KEYS)
+        rows = sum(count for _, count in results)
+
+    report(0.9, f"パラメータを作成中...（{len(distributions):,}キー）")
+    parameter = {
+        PROCESS_TIME_KEY: to_process_times(distributions),
+        DISTRIBUTION_KEY: polars_to_pandas(distributions),
+        TIME_UNIT_KEY: time_unit,
+        SOURCE_KEY: os.path.basename(file_path),
+        ROWS_KEY: rows,
+        ESTIMATED_AT_KEY: datetime.now().isoformat(timespec="seconds"),
+        ESTIMATOR_KEY: __name__,
+    }
+    report(1.0, f"パラメータ推定完了: {len(distributions):,}キー, {time.perf_counter() - start:.1f}秒")
+    return parameter
+
+
+def make_synthetic_log(db_file, n_rows, n_eqps=2_000, n_opes=500, n_types=20, seed=0):
+    """ベンチマーク用の合成LOGを作成する（工程の並びは考慮しない）"""
+    import pandas as pd
+
+    from washi.bulkload import bulk_load, iter_frame_chunks
+
+    rng = np.random.default_rng(seed)
+    eqp = rng.integers(0, n_eqps, n_rows)
+    stime = np.datetime64("2024-01-01T00:00:00") + rng.integers(0, 365 * 86400, n_rows).astype("timedelta64[s]")
+    df = pd.DataFrame({
+        "SUB_LOT_TYPE": "P0",
+        "LOT_ID": np.char.add("LOT", (rng.integers(0, n_rows // 200 + 1, n_rows)).astype(str)),
+        "EQP_ID": np.char.add("EQ", eqp.astype(str)),
+        "STIME": pd.to_datetime(stime).strftime("%Y-%m-%d %H:%M:%S"),
+        "PROD_GRP_ID": np.char.add("DEV", (eqp % 7).astype(str)),
+        "PROD_TYPE": np.char.add("T", rng.integers(0, n_types, n_rows).astype(str)),
+        "OPE_NO": np.char.add("OPE", (eqp % n_opes).astype(str)),
+        "RUN_TIME": rng.lognormal(3.5, 0.5, n_rows).round(1),
+        "WAIT_TIME": rng.exponential(60, n_rows).round(1),
+    })
+    bulk_load(db_file, "LOG", iter_frame_chunks(df), replace=True)
+    return df
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    folder = tempfile.mkdtemp()
+    db_file = os.path.join(folder, "log.db")
+    n_rows = 2_000_000
+    df = make_synthetic_log(db_file, n_rows)
+
+    start = time.perf_counter()
+    parameter = param_estimate(db_file, max_workers=1)
+    elapsed = time.perf_counter() - start
+    print(f"[DEBUG] 参照実装（一括）: {n_rows:,}行, {elapsed:.1f}秒 ({n_rows / elapsed:,.0f}行/秒)")
+
+    # パーティション分割による並列集計（結果は一括集計と一致する）
+    start = time.perf_counter()
+    partitioned = param_estimate(db_file, max_workers=4)
+    elapsed = time.perf_counter() - start
+    print(f"[DEBUG] 参照実装（並列4プロセス）: {elapsed:.1f}秒, "
+          f"一致={partitioned[DISTRIBUTION_KEY].equals(parameter[DISTRIBUTION_KEY])}")
+    print(parameter[DISTRIBUTION_KEY].head())
+
+    # pandasのgroupbyによる集計との比較（読み込み済みのデータに対する集計時間のみ）
+    start = time.perf_counter()
+    expected = df.groupby(PARAMETER_KEYS)["RUN_TIME"].agg(["count", "median"]).add_prefix("pandas_")
+    print(f"[DEBUG] pandas groupby（集計のみ）: {time.perf_counter() - start:.1f}秒")
+    merged = parameter[DISTRIBUTION_KEY].set_index(PARAMETER_KEYS).join(expected)
+    print(f"[DEBUG] 件数の一致: {(merged['count'] == merged['pandas_count']).all()}, "
+          f"中央値の最大誤差: {(merged['RUN_TIME_median'] - merged['pandas_median']).abs().max():.6f}")
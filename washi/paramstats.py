@@ -0,0 +1,338 @@
+"""パラメータの差分更新（LOGに追加された行のみを反映する）
+
+パラメータのキーごとに十分統計量（件数・合計・二乗和・最小/最大・スケッチ）を
+パラメータファイルの隣（<名前>.stats.pkl）に保存し、前回処理したLOGのROWIDを記録する。
+次回はROWIDがそれより大きい行だけを集計して統計量に加算し、
+追加行のあったキーの分布のみを再計算する。
+
+分位点はスケッチ（washi.sketch、相対誤差1%）から求めるため、一括推定（washi.paramest）の
+分位点とは完全には一致しない。LOGが作り直された場合（テーブルの世代・記録済みの行数・
+最後に処理した行の内容のいずれかが合わない場合）や、別のDBを指定した場合は全件から作り直す。
+
+差分更新は参照実装（washi.paramest）と同じ分布を作るため、param_enc で推定された
+パラメータファイルは上書きせずにエラーとする（別の出力ファイル名を指定する）。
+"""
+import os
+import pickle
+import sqlite3
+import time
+from datetime import datetime
+
+import numpy as np
+import polars as pl
+
+from washi.bulkload import table_generation
+from washi.columnar import polars_to_pandas
+from washi.fabsim import PROCESS_TIME_KEY, TIME_UNIT_KEY, infer_time_unit, load_log
+from washi.paramest import (
+    DISTRIBUTION_KEY, ESTIMATED_AT_KEY, ESTIMATOR_KEY, PARAMETER_KEYS, QUANTILES, ROWS_KEY, SOURCE_KEY,
+    TIME_UNIT_SAMPLE_LOTS, to_process_times,
+)
+from washi.schema import DICT_COLUMNS, is_typed_table, load_dictionary
+from washi.sketch import build_sketches, merge_quantiles, merge_sketches
+
+# 十分統計量のファイルの拡張子（パラメータファイル名の拡張子を置き換える）
+STATS_SUFFIX = ".stats.pkl"
+
+# 統計量を持つカラム
+VALUE_COLUMNS = ("RUN_TIME", "WAIT_TIME")
+
+# 差分を読み込む際に1回に取得する行数
+FETCH_BATCH_SIZE = 200_000
+
+# パラメータファイル（辞書）に記録する差分更新の情報
+INCREMENTAL_KEY = "incremental"
+
+
+def stats_path(parameter_path):
+    """パラメータファイルに対応する十分統計量のファイルパス"""
+    return os.path.splitext(parameter_path)[0] + STATS_SUFFIX
+
+
+# 差分更新で上書きしてよいパラメータファイルを作成したモジュール
+REFERENCE_ESTIMATORS = ("washi.paramest", __name__)
+
+
+def check_estimator(parameter_path):
+    """既存のパラメータファイルが参照実装で作成されたものか確認する（それ以外はValueError）"""
+    if not os.path.exists(parameter_path):
+        return
+    with open(parameter_path, "rb") as f:
+        parameter = pickle.load(f)
+    estimator = parameter.get(ESTIMATOR_KEY) if isinstance(parameter, dict) else None
+    if estimator not in REFERENCE_ESTIMATORS:
+        raise ValueError(
+            f"{os.path.basename(parameter_path)} は参照実装以外（param_enc など）で推定されたため差分更新できません。"
+            "別の出力ファイル名を指定するか、差分更新を使わずに推定してください"
+        )
+
+
+def load_state(path):
+    """前回の十分統計量を読み込む（ない場合はNone）"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def save_state(state, path):
+    """十分統計量を保存する（一時ファイルに書いてから置き換える）"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(state, f)
+    os.replace(temp_path, path)
+
+
+def load_new_rows(conn, watermark):
+    """ROWIDが watermark より大きいLOGの行を読み込み、(行, 新しいwatermark) を返す
+
+    型付きスキーマの場合は元テーブルから読み込み、辞書でIDを復号する。
+    """
+    typed = is_typed_table(conn, "LOG")
+    id_type = pl.Int64 if typed else pl.String
+    schema = {
+        **{col: id_type if col in DICT_COLUMNS else pl.String for col in PARAMETER_KEYS},
+        **{col: pl.Float64 for col in VALUE_COLUMNS},
+    }
+    query = (
+        f"SELECT {', '.join(PARAMETER_KEYS + list(VALUE_COLUMNS))} FROM LOG "
+        f"WHERE ROWID > {int(watermark)} AND {' AND '.join(f'{col} IS NOT NULL' for col in PARAMETER_KEYS)}"
+    )
+    frames = list(pl.read_database(query, conn, iter_batches=True, batch_size=FETCH_BATCH_SIZE,
+                                   schema_overrides=schema))
+    rows = pl.concat(frames) if frames else pl.DataFrame(schema=schema)
+    new_watermark = conn.execute("SELECT MAX(ROWID) FROM LOG").fetchone()[0] or 0
+    if typed:
+        rows = rows.with_columns(
+            pl.Series(load_dictionary(conn, col), dtype=pl.String).gather(rows[col]).alias(col)
+            for col in PARAMETER_KEYS if col in DICT_COLUMNS
+        )
+    return rows, max(int(watermark), int(new_watermark))
+
+
+def accumulate(rows):
+    """行をキーごとに集計し、十分統計量（加算可能な値とスケッチ）を返す"""
+    keys = rows.select(PARAMETER_KEYS).unique(maintain_order=True).with_row_index("_group")
+    keyed = rows.join(keys, on=PARAMETER_KEYS)
+    exprs = [pl.len().alias("count")]
+    for column in VALUE_COLUMNS:
+        value = pl.col(column)
+        positive = value.filter(value > 0)
+        exprs += [
+            value.count().alias(f"{column}_n"),
+            value.sum().alias(f"{column}_sum"),
+            (value * value).sum().alias(f"{column}_sumsq"),
+            value.min().alias(f"{column}_min"),
+            value.max().alias(f"{column}_max"),
+            (value <= 0).sum().alias(f"{column}_zero"),
+            positive.count().alias(f"{column}_pos"),
+            positive.log().sum().alias(f"{column}_logsum"),
+            (positive.log() * positive.log()).sum().alias(f"{column}_logsumsq"),
+        ]
+    stats = keyed.group_by("_group").agg(exprs).sort("_group")
+
+    # スケッチはグループ番号順に作成して結合する
+    for column in VALUE_COLUMNS:
+        valid = keyed.filter(pl.col(column).is_not_null())
+        blobs = build_sketches(valid["_group"].to_numpy(), valid[column].to_numpy(), len(keys))
+        stats = stats.with_columns(pl.Series(f"{column}_sketch", blobs, dtype=pl.Binary))
+    return keys.join(stats, on="_group").drop("_group")
+
+
+def merge_stats(old, new):
+    """前回の統計量に差分の統計量を加算し、(統計量, 更新されたキー) を返す"""
+    touched = new.select(PARAMETER_KEYS)
+    if old is None or old.is_empty():
+        return new, touched
+    additive = ["count"] + [
+        f"{column}_{name}" for column in VALUE_COLUMNS
+        for name in ("n", "sum", "sumsq", "zero", "pos", "logsum", "logsumsq")
+    ]
+    both = old.join(new, on=PARAMETER_KEYS, how="inner", suffix="_new")
+    merged = both.select(
+        *PARAMETER_KEYS,
+        *[(pl.col(col) + pl.col(f"{col}_new")).alias(col) for col in additive],
+        *[pl.min_horizontal(f"{column}_min", f"{column}_min_new").alias(f"{column}_min") for column in VALUE_COLUMNS],
+        *[pl.max_horizontal(f"{column}_max", f"{column}_max_new").alias(f"{column}_max") for column in VALUE_COLUMNS],
+    )
+    for column in VALUE_COLUMNS:
+        # スケッチの合算は更新されたキーの分のみ行う
+        blobs = [
+            merge_sketches([a, b])
+            for a, b in zip(both[f"{column}_sketch"].to_list(), both[f"{column}_sketch_new"].to_list())
+        ]
+        merged = merged.with_columns(pl.Series(f"{column}_sketch", blobs, dtype=pl.Binary))
+
+    untouched = old.join(touched, on=PARAMETER_KEYS, how="anti")
+    added = new.join(old.select(PARAMETER_KEYS), on=PARAMETER_KEYS, how="anti")
+    stats = pl.concat([untouched, merged.select(old.columns), added.select(old.columns)])
+    return stats, touched
+
+
+def derive_distributions(stats):
+    """十分統計量から分布（washi.paramest と同じ列）を求める"""
+    exprs = [pl.col("count")]
+    for column in VALUE_COLUMNS:
+        n = pl.col(f"{column}_n")
+        total = pl.col(f"{column}_sum")
+        pos = pl.col(f"{column}_pos")
+        logsum = pl.col(f"{column}_logsum")
+        exprs += [
+            (total / n).alias(f"{column}_mean"),
+            # 1件のキーの標準偏差は washi.paramest と同じく null とする
+            pl.when(n > 1)
+            .then(((pl.col(f"{column}_sumsq") - total * total / n) / (n - 1)).clip(lower_bound=0).sqrt())
+            .alias(f"{column}_std"),
+            pl.col(f"{column}_min"),
+            pl.col(f"{column}_max"),
+            (pl.col(f"{column}_zero") / n).alias(f"{column}_zero_rate"),
+            (logsum / pos).alias(f"{column}_log_mean"),
+            pl.when(pos > 1)
+            .then(((pl.col(f"{column}_logsumsq") - logsum * logsum / pos) / (pos - 1)).clip(lower_bound=0).sqrt())
+            .alias(f"{column}_log_std"),
+        ]
+    distributions = stats.select(*PARAMETER_KEYS, *exprs)
+
+    # 分位点はキーごとのスケッチから求める
+    n_keys = len(stats)
+    for column in VALUE_COLUMNS:
+        _, quantiles = merge_quantiles(
+            np.arange(n_keys), stats[f"{column}_sketch"].to_list(), n_keys, tuple(QUANTILES.values())
+        )
+        distributions = distributions.with_columns(
+            pl.Series(f"{column}_{name}", quantiles[q]) for name, q in QUANTILES.items()
+        )
+    return distributions
+
+
+def watermark_row(conn, watermark):
+    """最後に処理した行（ROWID = watermark）のキーと値（LOGの置換の検出用、ない場合はNone）"""
+    row = conn.execute(
+        f"SELECT {', '.join(PARAMETER_KEYS + list(VALUE_COLUMNS))} FROM LOG WHERE ROWID = {int(watermark)}"
+    ).fetchone()
+    return tuple(row) if row is not None else None
+
+
+def param_update(file_path, parameter_path, progress_callback=None):
+    """前回の推定以降にLOGへ追加された行を反映してパラメータを更新する
+
+    十分統計量のファイルがない場合、またはLOGが作り直されている場合は全件から作成する。
+    既存のパラメータファイルが参照実装以外で推定されたものの場合は ValueError とする。
+    戻り値はパラメータの辞書（保存は呼び出し側で行う）。十分統計量はこの関数で保存する。
+    """
+    def report(fraction, message):
+        print(f"[DEBUG] {message}")
+        if progress_callback is not None:
+            progress_callback(fraction, message)
+
+    start = time.perf_counter()
+    check_estimator(parameter_path)
+    path = stats_path(parameter_path)
+    state = load_state(path)
+    source = os.path.abspath(file_path)
+    conn = sqlite3.connect(file_path)
+    try:
+        generation = table_generation(conn, "LOG")
+        if state is not None and state.get("source") != source:
+            report(0.0, "前回と異なるDBのため全件から作り直します")
+            state = None
+        if state is not None:
+            # 置換でROWIDが振り直された場合や記録済みの範囲が変わった場合は全件から作り直す
+            rows_before = conn.execute(
+                f"SELECT COUNT(*) FROM LOG WHERE ROWID <= {int(state['watermark'])}"
+            ).fetchone()[0]
+            if (state.get("generation") != generation or rows_before != state["log_rows"]
+                    or watermark_row(conn, state["watermark"]) != state.get("watermark_row")):
+                report(0.0, "LOGが更新されているため全件から作り直します")
+                state = None
+        watermark = state["watermark"] if state else 0
+        report(0.1, f"追加された行を読み込み中...（ROWID > {watermark:,}）")
+        rows, new_watermark = load_new_rows(conn, watermark)
+        log_rows = conn.execute(f"SELECT COUNT(*) FROM LOG WHERE ROWID <= {int(new_watermark)}").fetchone()[0]
+        last_row = watermark_row(conn, new_watermark)
+        if state is None:
+            time_unit = infer_time_unit(load_log(conn, sample_lots=TIME_UNIT_SAMPLE_LOTS))
+        else:
+            time_unit = state[TIME_UNIT_KEY]
+    finally:
+        conn.close()
+
+    report(0.5, f"統計量を更新中...（追加 {len(rows):,}行）")
+    if state is None:
+        stats = accumulate(rows)
+        distributions = derive_distributions(stats)
+        touched = len(stats)
+    else:
+        stats, touched_keys = merge_stats(state["stats"], accumulate(rows))
+        touched = len(touched_keys)
+        if touched:
+            # 追加行のあったキーのみ分布を再計算する
+            updated = derive_distributions(stats.join(touched_keys, on=PARAMETER_KEYS))
+            distributions = pl.concat([
+                state["distributions"].join(touched_keys, on=PARAMETER_KEYS, how="anti"),
+                updated.select(state["distributions"].columns),
+            ])
+        else:
+            distributions = state["distributions"]
+    distributions = distributions.sort(PARAMETER_KEYS)
+
+    report(0.9, f"パラメータを作成中...（更新 {touched:,}キー / 全 {len(distributions):,}キー）")
+    save_state({
+        "watermark": new_watermark,
+        "log_rows": log_rows,
+        "watermark_row": last_row,
+        "generation": generation,
+        "source": source,
+        "stats": stats,
+        "distributions": distributions,
+        TIME_UNIT_KEY: time_unit,
+    }, path)
+    parameter = {
+        PROCESS_TIME_KEY: to_process_times(distributions),
+        DISTRIBUTION_KEY: polars_to_pandas(distributions),
+        TIME_UNIT_KEY: time_unit,
+        SOURCE_KEY: os.path.basename(file_path),
+        ROWS_KEY: log_rows,
+        ESTIMATED_AT_KEY: datetime.now().isoformat(timespec="seconds"),
+        ESTIMATOR_KEY: __name__,
+        INCREMENTAL_KEY: {"added_rows": len(rows), "updated_keys": touched, "watermark": new_watermark},
+    }
+    report(1.0, f"差分更新完了: 追加 {len(rows):,}行, 更新 {touched:,}キー, {time.perf_counter() - start:.1f}秒")
+    return parameter
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    import pandas as pd
+
+    from washi.bulkload import bulk_load, iter_frame_chunks
+    from washi.paramest import make_synthetic_log, param_estimate
+
+    folder = tempfile.mkdtemp()
+    db_file = os.path.join(folder, "log.db")
+    parameter_path = os.path.join(folder, "parameter.pkl")
+
+    # 初回（全件）
+    base = make_synthetic_log(db_file, 2_000_000)
+    param_update(db_file, parameter_path)
+
+    # 1日分（一部の装置のみ）を追加して差分更新
+    day = make_synthetic_log(os.path.join(folder, "day.db"), 20_000, n_eqps=50, seed=1)
+    bulk_load(db_file, "LOG", iter_frame_chunks(day), replace=False)
+    start = time.perf_counter()
+    updated = param_update(db_file, parameter_path)
+    print(f"[DEBUG] 差分更新: {time.perf_counter() - start:.1f}秒, {updated[INCREMENTAL_KEY]}")
+
+    # 一括推定との比較（件数・平均は一致、分位点はスケッチの誤差の範囲）
+    start = time.perf_counter()
+    full = param_estimate(db_file, max_workers=1)[DISTRIBUTION_KEY].set_index(PARAMETER_KEYS)
+    print(f"[DEBUG] 一括推定: {time.perf_counter() - start:.1f}秒")
+    incremental = updated[DISTRIBUTION_KEY].set_index(PARAMETER_KEYS).loc[full.index]
+    exact = (
+        pd.concat([base, day]).groupby(PARAMETER_KEYS)["RUN_TIME"]
+        .quantile(0.5, interpolation="lower").loc[full.index]
+    )
+    print(f"[DEBUG] 件数の一致: {(full['count'] == incremental['count']).all()}, "
+          f"平均の最大誤差: {(full['RUN_TIME_mean'] - incremental['RUN_TIME_mean']).abs().max():.2e}, "
+          f"中央値の最大相対誤差: {((exact - incremental['RUN_TIME_median']).abs() / exact).max():.4f}")
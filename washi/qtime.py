@@ -0,0 +1,253 @@
+"""制約時間（Q-time、テーブル Qtime）の判定
+
+Q-time は、ロットがある工程（FROM_OPE_NO）を開始してから、後の工程（TO_OPE_NO）を
+開始するまでの時間の上限。LOG2 とシミュレーション結果は工程の開始時刻のみを持つため、
+開始時刻どうしの間隔で判定する。
+
+- 分析: 制約ごとに FROM 工程と TO 工程の開始を結合し（ロット・制約ごとの as-of 結合）、
+  全ロットの区間をまとめて判定する
+- シミュレーション: 工程ごとに「開始する区間」と「終了する区間」を引けるようにし、
+  期限の近いロットを優先して着工する（washi.fabsim）
+"""
+import numpy as np
+import polars as pl
+
+from washi.bulkload import quote_identifier, table_exists
+from washi.indexes import find_column, get_columns
+from washi.queries import LOG2_MAX_DATE_QUERY, build_log2_date_filter
+from washi.schema import is_typed_table, load_dictionary
+
+QTIME_TABLE = "Qtime"
+
+# Qtime テーブルのカラム候補（先頭から順に探す）
+QTIME_TYPE_COLUMNS = ["PROD_TYPE", "TYPE", "製品", "品種"]
+QTIME_FROM_COLUMNS = ["FROM_OPE_NO", "START_OPE_NO", "OPE_NO_FROM", "FROM_OPE", "開始工程", "起点工程"]
+QTIME_TO_COLUMNS = ["TO_OPE_NO", "END_OPE_NO", "OPE_NO_TO", "TO_OPE", "終了工程", "終点工程"]
+QTIME_LIMIT_COLUMNS = ["QTIME", "Q_TIME", "LIMIT", "MAX_TIME", "LIMIT_TIME", "制約時間", "上限時間"]
+
+# LOG2 の製品TYPEの列候補（ない場合は製品別の制約を判定しない）
+LOG2_TYPE_COLUMNS = ["PROD_TYPE", "TYPE", "製品", "品種"]
+
+# 制約時間の単位（秒）。テーブルに単位の情報がないため分として扱う
+QTIME_UNIT_SECONDS = 60
+
+# 判定結果の状態
+STATUS_OK = "OK"
+STATUS_VIOLATION = "違反"
+STATUS_OPEN = "未完了"
+
+RULE_SCHEMA = {
+    "RULE_ID": pl.Int32,
+    "TYPE": pl.String,
+    "FROM_OPE_NO": pl.String,
+    "TO_OPE_NO": pl.String,
+    "LIMIT_SECONDS": pl.Float64,
+}
+
+
+def load_qtime_rules(conn, unit_seconds=QTIME_UNIT_SECONDS):
+    """Qtime テーブルを読み込み、制約の一覧（RULE_SCHEMA）を返す
+
+    製品TYPEの列がない、または空の制約は全製品に適用する。
+    """
+    if not table_exists(conn, QTIME_TABLE):
+        return pl.DataFrame(schema=RULE_SCHEMA)
+    columns = get_columns(conn, QTIME_TABLE)
+    type_col = find_column(columns, QTIME_TYPE_COLUMNS)
+    from_col = find_column(columns, QTIME_FROM_COLUMNS)
+    to_col = find_column(columns, QTIME_TO_COLUMNS)
+    limit_col = find_column(columns, QTIME_LIMIT_COLUMNS)
+    if not (from_col and to_col and limit_col):
+        raise ValueError(f"Qtime の列を判別できません（開始工程・終了工程・制約時間が必要です）: {columns}")
+
+    select = [
+        f"{quote_identifier(type_col)} AS TYPE" if type_col else "NULL AS TYPE",
+        f"{quote_identifier(from_col)} AS FROM_OPE_NO",
+        f"{quote_identifier(to_col)} AS TO_OPE_NO",
+        f"{quote_identifier(limit_col)} AS LIMIT_TIME",
+    ]
+    rows = conn.execute(f"SELECT {', '.join(select)} FROM {quote_identifier(QTIME_TABLE)}").fetchall()
+    rules = pl.DataFrame(
+        rows, schema=["TYPE", "FROM_OPE_NO", "TO_OPE_NO", "LIMIT_TIME"], orient="row", infer_schema_length=None,
+    ).select(
+        pl.col("TYPE").cast(pl.String),
+        pl.col("FROM_OPE_NO").cast(pl.String),
+        pl.col("TO_OPE_NO").cast(pl.String),
+        (pl.col("LIMIT_TIME").cast(pl.String).cast(pl.Float64, strict=False) * unit_seconds).alias("LIMIT_SECONDS"),
+    ).drop_nulls(["FROM_OPE_NO", "TO_OPE_NO", "LIMIT_SECONDS"]).with_columns(
+        pl.when(pl.col("TYPE").str.strip_chars() == "").then(None).otherwise(pl.col("TYPE")).alias("TYPE"),
+    )
+    return rules.with_row_index("RULE_ID").with_columns(pl.col("RULE_ID").cast(pl.Int32)).select(list(RULE_SCHEMA))
+
+
+def applicable_rules(steps, rules):
+    """工程データで判定できる制約を返す
+
+    工程に TYPE がない場合、どの製品の工程か分からないため製品別の制約は除く
+    （全製品に適用すると他製品の工程まで判定してしまう）。
+    """
+    if "TYPE" in steps.collect_schema().names():
+        return rules
+    return rules.filter(pl.col("TYPE").is_null())
+
+
+def _events(steps, rules, ope_column, time_alias):
+    """工程の開始を、その工程を起点（または終点）とする制約と結合する"""
+    events = steps.join(rules.lazy(), left_on="OPE_NO", right_on=ope_column)
+    if "TYPE" in steps.collect_schema().names():
+        # 制約側の TYPE は結合で TYPE_right になる
+        events = events.filter(pl.col("TYPE_right").is_null() | (pl.col("TYPE_right") == pl.col("TYPE")))
+    return events.select("LOT_ID", "RULE_ID", pl.col("TIME").alias(time_alias))
+
+
+def qtime_windows(steps, rules, as_of=None):
+    """ロット・制約ごとのQ-time区間を求める
+
+    steps: LOT_ID, OPE_NO, TIME（工程の開始時刻）を持つ DataFrame / LazyFrame（TYPE は任意）
+    FROM 工程の開始ごとに、その後で最初の TO 工程の開始を対応させる。
+    TO 工程がまだない区間は as_of（既定はデータの最終時刻）までの経過時間で判定し、
+    上限を超えていれば違反、超えていなければ未完了とする。
+    steps に TYPE がない場合、製品別の制約は判定しない（applicable_rules）。
+    """
+    rules = applicable_rules(steps, rules)
+    steps = steps.lazy().select(
+        [col for col in ("LOT_ID", "OPE_NO", "TIME", "TYPE") if col in steps.collect_schema().names()]
+    ).with_columns(pl.col("LOT_ID").cast(pl.String), pl.col("OPE_NO").cast(pl.String))
+    if as_of is None:
+        as_of = steps.select(pl.col("TIME").max()).collect().item()
+
+    starts = _events(steps, rules, "FROM_OPE_NO", "FROM_TIME").sort("FROM_TIME").collect()
+    ends = _events(steps, rules, "TO_OPE_NO", "TO_TIME").sort("TO_TIME").collect()
+    windows = starts.join_asof(
+        ends, left_on="FROM_TIME", right_on="TO_TIME", by=["LOT_ID", "RULE_ID"], strategy="forward",
+        allow_exact_matches=False, check_sortedness=False,
+    ).join(rules.select("RULE_ID", "FROM_OPE_NO", "TO_OPE_NO", "LIMIT_SECONDS"), on="RULE_ID")
+
+    end_time = pl.coalesce(pl.col("TO_TIME"), pl.lit(as_of))
+    elapsed = (end_time - pl.col("FROM_TIME")).dt.total_seconds(fractional=True)
+    return windows.with_columns(elapsed.alias("ELAPSED_SECONDS")).with_columns(
+        pl.when(pl.col("ELAPSED_SECONDS") > pl.col("LIMIT_SECONDS")).then(pl.lit(STATUS_VIOLATION))
+        .when(pl.col("TO_TIME").is_null()).then(pl.lit(STATUS_OPEN))
+        .otherwise(pl.lit(STATUS_OK)).alias("STATUS"),
+        (pl.col("ELAPSED_SECONDS") - pl.col("LIMIT_SECONDS")).alias("EXCESS_SECONDS"),
+    ).sort(["RULE_ID", "FROM_TIME"])
+
+
+def summarize_windows(windows):
+    """制約ごとの区間数・違反数・違反率・経過時間の分布をまとめる"""
+    return windows.group_by("RULE_ID", "FROM_OPE_NO", "TO_OPE_NO", "LIMIT_SECONDS").agg(
+        pl.len().alias("windows"),
+        (pl.col("STATUS") == STATUS_VIOLATION).sum().alias("violations"),
+        (pl.col("STATUS") == STATUS_OPEN).sum().alias("open"),
+        pl.col("ELAPSED_SECONDS").median().alias("median_seconds"),
+        pl.col("ELAPSED_SECONDS").quantile(0.95, interpolation="linear").alias("p95_seconds"),
+        pl.col("ELAPSED_SECONDS").max().alias("max_seconds"),
+    ).with_columns(
+        (pl.col("violations") / pl.col("windows")).alias("violation_rate"),
+    ).sort(["violation_rate", "violations"], descending=True)
+
+
+def load_log2_steps(conn, period_months=None):
+    """LOG2 の P0/MASTER の工程開始（LOT_ID, OPE_NO, TIME）を読み込む
+
+    製品TYPEの列（LOG2_TYPE_COLUMNS）があれば TYPE として読み込む。
+    型付きスキーマの場合は整数のまま絞り込み、辞書でIDを復号する。
+    period_months を指定すると最新データから指定月数分に絞り込む。
+    """
+    typed = is_typed_table(conn, "LOG2")
+    where = ""
+    if period_months is not None:
+        max_date = conn.execute(LOG2_MAX_DATE_QUERY).fetchone()[0]
+        if max_date is not None:
+            where = build_log2_date_filter(max_date, period_months, typed)
+    if typed:
+        schema = {"LOT_ID": pl.Int64, "OPE_NO": pl.Int64, "OPE_START_DATETIME": pl.Int64}
+    else:
+        schema = {"LOT_ID": pl.String, "OPE_NO": pl.String, "OPE_START_DATETIME": pl.String}
+    select = ["LOT_ID", "OPE_NO", "OPE_START_DATETIME"]
+    type_col = find_column(get_columns(conn, "LOG2"), LOG2_TYPE_COLUMNS)
+    if type_col is not None:
+        select.append(f"CAST({quote_identifier(type_col)} AS TEXT) AS TYPE")
+        schema["TYPE"] = pl.String
+    query = f"""
+        SELECT {', '.join(select)}
+        FROM LOG2
+        WHERE SUB_LOT_TYPE = 'P0' AND MRC = 'MASTER'
+        AND LOT_ID IS NOT NULL AND OPE_NO IS NOT NULL AND OPE_START_DATETIME IS NOT NULL
+        {where}
+    """
+    frames = list(pl.read_database(query, conn, iter_batches=True, batch_size=200_000, schema_overrides=schema))
+    steps = pl.concat(frames) if frames else pl.DataFrame(schema=schema)
+    type_select = [pl.col("TYPE")] if type_col is not None else []
+    if typed:
+        lot_ids = pl.Series(load_dictionary(conn, "LOT_ID"), dtype=pl.String)
+        ope_nos = pl.Series(load_dictionary(conn, "OPE_NO"), dtype=pl.String)
+        return steps.select(
+            lot_ids.gather(steps["LOT_ID"]).alias("LOT_ID"),
+            ope_nos.gather(steps["OPE_NO"]).alias("OPE_NO"),
+            pl.from_epoch(steps["OPE_START_DATETIME"], time_unit="s").alias("TIME"),
+            *type_select,
+        )
+    return steps.select(
+        "LOT_ID", "OPE_NO",
+        pl.col("OPE_START_DATETIME").str.to_datetime(strict=False, time_unit="us").alias("TIME"),
+        *type_select,
+    ).drop_nulls("TIME")
+
+
+class QtimeIndex:
+    """シミュレーション用に、工程番号から開始・終了するQ-time区間を引く索引
+
+    opens[step] は (終了する工程番号, 上限) のリスト、closes[step] はその工程で
+    区間が終了するか。上限はシミュレーションの時間単位に換算する。
+    """
+
+    def __init__(self, rules, step_index, time_unit):
+        n_steps = len(step_index)
+        self.opens = [[] for _ in range(n_steps)]
+        self.closes = np.zeros(n_steps, dtype=bool)
+        types = sorted({type_val for type_val, _ in step_index})
+        for type_val, from_ope, to_ope, limit in rules.select(
+            "TYPE", "FROM_OPE_NO", "TO_OPE_NO", "LIMIT_SECONDS"
+        ).iter_rows():
+            for target in (types if type_val is None else [type_val]):
+                from_step = step_index.get((target, from_ope))
+                to_step = step_index.get((target, to_ope))
+                if from_step is None or to_step is None:
+                    continue
+                self.opens[from_step].append((to_step, limit / time_unit))
+                self.closes[to_step] = True
+        self.rules = sum(len(opens) for opens in self.opens)
+
+    def __bool__(self):
+        return self.rules > 0
+
+
+if __name__ == "__main__":
+    import time
+
+    # 合成データで区間判定の速度を確認（1,000万工程）
+    rng = np.random.default_rng(0)
+    n_lots, n_steps = 50_000, 200
+    lot = np.repeat(np.arange(n_lots), n_steps)
+    ope = np.tile(np.arange(n_steps), n_lots)
+    gaps = rng.exponential(120, len(lot))
+    offsets = np.cumsum(gaps) - np.repeat(np.cumsum(gaps)[::n_steps], n_steps)
+    times = (np.datetime64("2024-01-01") + offsets.astype("timedelta64[s]")).astype("datetime64[us]")
+    steps = pl.DataFrame({
+        "LOT_ID": pl.Series(lot).cast(pl.String),
+        "OPE_NO": pl.Series(ope).cast(pl.String),
+        "TIME": times,
+    })
+    rules = pl.DataFrame({
+        "RULE_ID": pl.Series(range(20), dtype=pl.Int32),
+        "TYPE": pl.Series([None] * 20, dtype=pl.String),
+        "FROM_OPE_NO": [str(i * 10) for i in range(20)],
+        "TO_OPE_NO": [str(i * 10 + 3) for i in range(20)],
+        "LIMIT_SECONDS": [500.0] * 20,
+    })
+    start = time.perf_counter()
+    windows = qtime_windows(steps, rules)
+    summary = summarize_windows(windows)
+    print(f"[DEBUG] {len(steps):,}工程, {len(windows):,}区間: {time.perf_counter() - start:.2f}秒")
+    print(summary.head(5))
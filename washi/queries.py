@@ -0,0 +1,103 @@
+"""各アプリが発行するLOG / LOG2 のクエリ（インデックス最適化の対象としても使用）"""
+import pandas as pd
+
+from washi.bulkload import quote_identifier
+from washi.schema import epoch_seconds
+
+# パラメータ推定・シミュレーションでLOGから読み込むカラム
+LOG_COLUMNS = [
+    "LOT_ID", "STIME", "PROD_GRP_ID", "PROD_TYPE", "OPE_NO",
+    "EQP_ID", "RUN_TIME", "WAIT_TIME", "SUB_LOT_TYPE",
+]
+
+# LOGの時間単位の推定に使うロット数（全件は読み込まない）
+TIME_UNIT_SAMPLE_LOTS = 1_000
+
+
+def build_log_query(source, selected, sample_lots=None):
+    """パラメータ推定・シミュレーションのLOG読み込みクエリを返す（washi.fabsim.load_log）
+
+    sample_lots を指定すると先頭から指定数のロットのみを読み込む。
+    """
+    table = quote_identifier(source)
+    conditions = ["OPE_NO IS NOT NULL", "EQP_ID IS NOT NULL"]
+    if "STIME" in selected:
+        conditions.append("STIME IS NOT NULL")
+    if sample_lots is not None:
+        conditions.append(f"LOT_ID IN (SELECT DISTINCT LOT_ID FROM {table} LIMIT {int(sample_lots)})")
+    return (
+        f"SELECT {', '.join(quote_identifier(col) for col in selected)} FROM {table} "
+        f"WHERE {' AND '.join(conditions)}"
+    )
+
+# vis_b: P0/MASTER の最新日時
+LOG2_MAX_DATE_QUERY = """
+    SELECT MAX(OPE_START_DATETIME)
+    FROM LOG2
+    WHERE SUB_LOT_TYPE = 'P0' AND MRC = 'MASTER'
+    AND OPE_START_DATETIME IS NOT NULL
+"""
+
+
+def build_log2_date_filter(max_date_value, period_months, typed=False):
+    """最新日時から period_months ヶ月分に絞り込む条件を返す"""
+    if typed:
+        # 数値比較で絞り込めるよう閾値をエポック秒で計算
+        max_date = pd.to_datetime(max_date_value, unit='s')
+        threshold = epoch_seconds(max_date - pd.DateOffset(months=period_months))
+        return f"AND OPE_START_DATETIME >= {threshold}"
+    return f"AND OPE_START_DATETIME >= datetime('{max_date_value}', '-{period_months} months')"
+
+
+def build_log2_query(typed=False, date_filter="", limit_clause=""):
+    """vis_b の待ち時間データ取得クエリを返す"""
+    if typed:
+        # 型付きスキーマでは文字列比較やCASTが不要
+        return f"""
+        SELECT
+            LOT_ID,
+            OPE_START_DATETIME,
+            WAIT_TIME,
+            EQP_ID,
+            OPE_NO,
+            SUB_LOT_TYPE,
+            MRC,
+            DeviceGp
+        FROM LOG2
+        WHERE SUB_LOT_TYPE = 'P0'
+        AND MRC = 'MASTER'
+        AND WAIT_TIME > 0
+        AND DeviceGp IS NOT NULL
+        AND EQP_ID IS NOT NULL
+        AND OPE_START_DATETIME IS NOT NULL
+        {date_filter}
+        ORDER BY ROWID DESC
+        {limit_clause}
+        """
+    return f"""
+        SELECT
+            LOT_ID,
+            OPE_START_DATETIME,
+            CAST(WAIT_TIME as REAL) as WAIT_TIME,
+            EQP_ID,
+            OPE_NO,
+            SUB_LOT_TYPE,
+            MRC,
+            DeviceGp
+        FROM LOG2
+        WHERE SUB_LOT_TYPE = 'P0'
+        AND MRC = 'MASTER'
+        AND WAIT_TIME IS NOT NULL
+        AND WAIT_TIME != ''
+        AND WAIT_TIME != '0'
+        AND CAST(WAIT_TIME as REAL) > 0
+        AND DeviceGp IS NOT NULL
+        AND DeviceGp != ''
+        AND EQP_ID IS NOT NULL
+        AND EQP_ID != ''
+        AND OPE_START_DATETIME IS NOT NULL
+        AND OPE_START_DATETIME != ''
+        {date_filter}
+        ORDER BY ROWID DESC
+        {limit_clause}
+        """
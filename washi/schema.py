@@ -0,0 +1,244 @@
+"""LOG / LOG2 テーブルの型付きスキーマ（日時の整数化・IDの辞書化）"""
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from washi.bulkload import (
+    bulk_load, drop_table_indexes, open_bulk_connection, quote_identifier
+)
+
+# 型付きスキーマを適用するテーブル
+TYPED_TABLES = ("LOG", "LOG2")
+
+# 整数のエポック秒（UTCとして扱う）で保存する日時カラム
+TIMESTAMP_COLUMNS = ("OPE_START_DATETIME", "STIME")
+
+# REALで保存する数値カラム（空文字や数値以外はNULLになる）
+REAL_COLUMNS = ("WAIT_TIME", "RUN_TIME")
+
+# 辞書テーブル（DICT_<カラム名>）の整数コードで保存するカラム
+DICT_COLUMNS = ("EQP_ID", "DeviceGp", "OPE_NO", "LOT_ID")
+
+
+def id_text(series):
+    """IDカラムを文字列にする（欠損を含むチャンクで小数になった整数IDは整数の表記に戻す）
+
+    pandasの型推定はチャンクごとに行われるため、同じIDが '1000' と '1000.0' にならないようにする。
+    欠損はNoneのまま残す。
+    """
+    text = series.astype(str).to_numpy(dtype=object)
+    if pd.api.types.is_float_dtype(series):
+        values = series.to_numpy(dtype="float64", na_value=np.nan)
+        integral = np.isfinite(values) & (values == np.round(values))
+        text[integral] = values[integral].astype("int64").astype(str)
+    text[series.isna().to_numpy()] = None
+    return pd.Series(text, index=series.index, dtype=object)
+
+
+def dict_table_name(column):
+    """辞書テーブル名を返す"""
+    return f"DICT_{column}"
+
+
+# 型付きスキーマの宣言型（カラム名→SQLite型）
+TYPED_COLUMN_TYPES = {
+    **{col: "INTEGER" for col in TIMESTAMP_COLUMNS + DICT_COLUMNS},
+    **{col: "REAL" for col in REAL_COLUMNS},
+}
+
+# 既存テーブル変換時の読み込み行数
+CONVERT_CHUNK_SIZE = 100_000
+
+
+def ensure_dict_tables(conn, columns):
+    """辞書テーブルを作成する（code は 0 から連番）"""
+    for col in columns:
+        if col in DICT_COLUMNS:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {quote_identifier(dict_table_name(col))} "
+                "(code INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)"
+            )
+
+
+def load_dictionary(conn, column):
+    """辞書テーブルを code 順の値配列として読み込む"""
+    rows = conn.execute(
+        f"SELECT code, value FROM {quote_identifier(dict_table_name(column))} ORDER BY code"
+    ).fetchall()
+    return np.array([value for _, value in rows], dtype=object)
+
+
+class TypedEncoder:
+    """チャンクを型付きスキーマに変換する（辞書はロード中メモリにキャッシュ）"""
+
+    def __init__(self):
+        self.code_maps = {}
+
+    def _code_map(self, conn, column):
+        if column not in self.code_maps:
+            values = load_dictionary(conn, column)
+            self.code_maps[column] = {value: code for code, value in enumerate(values)}
+        return self.code_maps[column]
+
+    def _encode_column(self, conn, column, series):
+        code_map = self._code_map(conn, column)
+        values = id_text(series)
+
+        # 未登録の値を辞書に追加
+        new_values = [v for v in pd.unique(values.dropna()) if v not in code_map]
+        if new_values:
+            start = len(code_map)
+            new_rows = [(start + i, v) for i, v in enumerate(new_values)]
+            conn.executemany(
+                f"INSERT INTO {quote_identifier(dict_table_name(column))} (code, value) VALUES (?, ?)",
+                new_rows
+            )
+            code_map.update({v: code for code, v in new_rows})
+
+        # 欠損はNaN（SQLiteにはNULLとして保存される）
+        return values.map(code_map).astype("float64")
+
+    def __call__(self, conn, chunk):
+        """bulk_load の transform として使用する"""
+        chunk = chunk.copy()
+        ensure_dict_tables(conn, chunk.columns)
+        for col in chunk.columns:
+            if col in TIMESTAMP_COLUMNS:
+                parsed = pd.to_datetime(chunk[col], errors="coerce")
+                # NaTはNaN（NULL）、それ以外はエポック秒
+                seconds = parsed.astype("datetime64[s]").astype("int64").astype("float64")
+                chunk[col] = seconds.where(parsed.notna(), np.nan)
+            elif col in REAL_COLUMNS:
+                chunk[col] = pd.to_numeric(chunk[col], errors="coerce").astype("float64")
+            elif col in DICT_COLUMNS:
+                chunk[col] = self._encode_column(conn, col, chunk[col])
+        return chunk
+
+
+def is_typed_table(conn, table_name):
+    """テーブルが型付きスキーマで保存されているか判定する"""
+    rows = conn.execute(f"PRAGMA table_info({quote_identifier(table_name)})").fetchall()
+    declared = {row[1]: (row[2] or "").upper() for row in rows}
+    dict_cols = [col for col in DICT_COLUMNS if col in declared]
+    if not dict_cols or any(declared[col] != "INTEGER" for col in dict_cols):
+        return False
+    for col in dict_cols:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+            (dict_table_name(col),)
+        ).fetchone()
+        if exists is None:
+            return False
+    return True
+
+
+def decoded_view_name(table_name):
+    """元の文字列表現で参照するためのビュー名"""
+    return f"{table_name}_DECODED"
+
+
+def create_decoded_view(conn, table_name):
+    """辞書コードと整数日時を元の表現に戻すビューを作成する（既存ツールからの参照用）"""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({quote_identifier(table_name)})")]
+    select_cols = []
+    joins = []
+    for col in columns:
+        q = quote_identifier(col)
+        if col in DICT_COLUMNS:
+            alias = quote_identifier(f"d_{col}")
+            joins.append(
+                f"LEFT JOIN {quote_identifier(dict_table_name(col))} {alias} ON {alias}.code = t.{q}"
+            )
+            select_cols.append(f"{alias}.value AS {q}")
+        elif col in TIMESTAMP_COLUMNS:
+            select_cols.append(f"datetime(t.{q}, 'unixepoch') AS {q}")
+        else:
+            select_cols.append(f"t.{q}")
+
+    view = quote_identifier(decoded_view_name(table_name))
+    conn.execute(f"DROP VIEW IF EXISTS {view}")
+    conn.execute(
+        f"CREATE VIEW {view} AS SELECT {', '.join(select_cols)} "
+        f"FROM {quote_identifier(table_name)} t {' '.join(joins)}"
+    )
+
+
+def drop_decoded_view(conn, table_name):
+    """復号ビューを削除する"""
+    conn.execute(f"DROP VIEW IF EXISTS {quote_identifier(decoded_view_name(table_name))}")
+
+
+def refresh_decoded_view(db_file, table_name):
+    """型付きテーブルなら復号ビューを作成し、そうでなければ削除する"""
+    conn = sqlite3.connect(db_file)
+    try:
+        if is_typed_table(conn, table_name):
+            create_decoded_view(conn, table_name)
+        else:
+            drop_decoded_view(conn, table_name)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def typed_load_options():
+    """bulk_load に渡す型付きスキーマ用の引数を返す"""
+    return {"transform": TypedEncoder(), "column_types": TYPED_COLUMN_TYPES}
+
+
+def convert_table_to_typed(db_file, table_name, chunksize=CONVERT_CHUNK_SIZE,
+                           progress_callback=None):
+    """既存テーブルを型付きスキーマへ変換する（一時テーブルに書き込んでから置き換え）"""
+    tmp_table = f"{table_name}__typed"
+    read_conn = sqlite3.connect(db_file)
+    try:
+        chunks = pd.read_sql_query(
+            f"SELECT * FROM {quote_identifier(table_name)}", read_conn, chunksize=chunksize
+        )
+        result = bulk_load(
+            db_file, tmp_table, chunks, replace=True,
+            progress_callback=progress_callback, **typed_load_options()
+        )
+    finally:
+        read_conn.close()
+
+    # 元テーブルを置き換え、インデックスを作り直す
+    conn = open_bulk_connection(db_file)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        drop_decoded_view(conn, table_name)
+        index_sqls = drop_table_indexes(conn, table_name)
+        conn.execute(f"DROP TABLE {quote_identifier(table_name)}")
+        conn.execute(
+            f"ALTER TABLE {quote_identifier(tmp_table)} RENAME TO {quote_identifier(table_name)}"
+        )
+        for index_sql in index_sqls:
+            conn.execute(index_sql)
+        create_decoded_view(conn, table_name)
+        conn.execute("COMMIT")
+        conn.execute(f"ANALYZE {quote_identifier(table_name)}")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return result
+
+
+def decode_frame(conn, df):
+    """型付きテーブルから読み込んだDataFrameを復号する（IDはcategory型、日時はdatetime64）"""
+    for col in df.columns:
+        if col in DICT_COLUMNS:
+            categories = load_dictionary(conn, col)
+            codes = df[col].fillna(-1).astype("int64").to_numpy()
+            df[col] = pd.Categorical.from_codes(codes, categories=categories).remove_unused_categories()
+        elif col in TIMESTAMP_COLUMNS and pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], unit="s", errors="coerce")
+    return df
+
+
+def epoch_seconds(timestamp):
+    """Timestampをエポック秒（整数）に変換する"""
+    return int(pd.Timestamp(timestamp).value // 10**9)
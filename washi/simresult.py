@@ -0,0 +1,262 @@
+"""シミュレーション結果（simres）の受け渡し用ファイル（Arrow IPC形式）
+
+sim アプリが結果を非圧縮のArrow IPCファイルとして保存し、vis_a はメモリマップで
+必要な列・行のみを読み込む。pickleと違い、ファイル全体を展開せずに読み込める。
+シミュレーション中に結果を逐次書き出す場合は ResultSink を使う（パートファイルのディレクトリ）。
+"""
+import inspect
+import json
+import os
+import pickle
+import shutil
+from datetime import datetime
+
+import pandas as pd
+import polars as pl
+
+from washi.columnar import pandas_to_polars
+
+# 保存先の既定のファイル名（loadフォルダ内、拡張子なし）
+SIMRES_NAME = "simres"
+
+# 逐次書き出し時のパートファイルのディレクトリの拡張子（拡張子で結果ディレクトリと判定する）
+PARTS_SUFFIX = ".parts"
+
+# シミュレーション完了時に書き込む情報ファイル（ない場合は実行中または中断）
+COMPLETE_MARKER = "_complete.json"
+
+# 結果のカラム（イベントにないカラムはNULLになる）
+SIMRES_COLUMNS = [
+    "LOT_ID", "OPE_START_DATETIME", "WAIT_TIME", "EQP_ID",
+    "OPE_NO", "SUB_LOT_TYPE", "MRC", "DeviceGp",
+]
+
+# ResultSink がパートファイルを書き出す行数
+SINK_BATCH_SIZE = 100_000
+
+# 結果ファイルの拡張子
+RESULT_EXTENSIONS = (".arrow", ".feather", ".ipc")
+
+# 値の種類が少ないカラム（辞書エンコードして保存する）
+CATEGORICAL_COLUMNS = ("EQP_ID", "DeviceGp", "OPE_NO", "SUB_LOT_TYPE", "MRC")
+
+# 1バッチあたりの行数（読み込み時の単位）
+RECORD_BATCH_SIZE = 1_000_000
+
+
+def is_result_file(file_name):
+    """Arrow IPC形式の結果ファイルか判定する"""
+    return file_name.lower().endswith(RESULT_EXTENSIONS)
+
+
+def is_result_parts(path):
+    """ResultSink が書き出したパートファイルのディレクトリか判定する"""
+    return path.rstrip("/\\").endswith(PARTS_SUFFIX) and os.path.isdir(path)
+
+
+def is_complete(path):
+    """結果が完成しているか判定する（パートファイルのディレクトリは完了の情報ファイルで判定）"""
+    if is_result_parts(path):
+        return os.path.exists(os.path.join(path, COMPLETE_MARKER))
+    return os.path.exists(path)
+
+
+def part_files(path):
+    """パートファイルの一覧を書き出し順に返す"""
+    if not os.path.isdir(path):
+        return []
+    return sorted(
+        os.path.join(path, name) for name in os.listdir(path)
+        if name.startswith("part-") and name.endswith(".arrow")
+    )
+
+
+def to_result_frame(simres):
+    """シミュレーション結果をpolarsのDataFrameに変換する（表形式でない場合はNone）"""
+    if isinstance(simres, pl.DataFrame):
+        df = simres
+    elif isinstance(simres, pd.DataFrame):
+        df = pandas_to_polars(simres)
+    else:
+        return None
+    return df.with_columns(
+        pl.col(col).cast(pl.String).cast(pl.Categorical)
+        for col in CATEGORICAL_COLUMNS if col in df.columns
+    )
+
+
+def write_simres(simres, load_folder="./load", name=SIMRES_NAME):
+    """シミュレーション結果を保存し、保存先のパスを返す
+
+    表形式の結果はArrow IPC（非圧縮・メモリマップ可能）で保存する。
+    表形式でない結果は従来どおりpickleで保存する。
+    一時ファイルに書き込んでから置き換えるため、書き込み途中のファイルが読まれることはない。
+    name はシナリオごとに結果を分ける場合のファイル名（拡張子なし）。
+    """
+    df = to_result_frame(simres)
+    if df is None:
+        output_path = os.path.join(load_folder, f"{name}.pkl")
+        with open(output_path, "wb") as f:
+            pickle.dump(simres, f)
+        print(f"[DEBUG] シミュレーション結果（表形式以外）をpickleで保存: {output_path}")
+        return output_path
+
+    output_path = os.path.join(load_folder, f"{name}.arrow")
+    temp_path = f"{output_path}.tmp"
+    df.write_ipc(temp_path, compression="uncompressed", record_batch_size=RECORD_BATCH_SIZE)
+    os.replace(temp_path, output_path)
+    print(f"[DEBUG] シミュレーション結果を保存: {output_path} {len(df):,}行")
+    return output_path
+
+
+def scan_simres(file_path):
+    """結果ファイルをLazyFrameとして開く（メモリマップで読み込まれる）
+
+    パートファイルのディレクトリの場合は、その時点で書き出し済みのパートのみを読み込む。
+    数値カラムはパートごとに整数・小数が分かれることがあるため、共通の型に揃えて結合する。
+    """
+    if is_result_parts(file_path):
+        files = part_files(file_path)
+        if not files:
+            return pl.LazyFrame(schema=to_result_frame(pd.DataFrame(columns=SIMRES_COLUMNS)).schema)
+        return pl.concat([pl.scan_ipc(path) for path in files], how="diagonal_relaxed")
+    return pl.scan_ipc(file_path)
+
+
+class ResultSink:
+    """シミュレーション中のイベント（ロット・工程ごとの結果）を受け取り、一定行数ごとにファイルへ書き出す
+
+    メモリに保持するのは最大 batch_size 行分のみ。パートファイルは一時ファイルに書いてから
+    置き換えるため、vis_a は実行中でも書き出し済みのパートを読み込める。
+    close() で残りを書き出して完了の情報ファイルを作成する。with 文で使用でき、
+    例外で終了した場合は完了の情報ファイルを作らない（書き出し済みのパートは残す）。
+    """
+
+    def __init__(self, load_folder="./load", batch_size=SINK_BATCH_SIZE, columns=None,
+                 name=SIMRES_NAME, progress_callback=None):
+        self.path = os.path.join(load_folder, f"{name}{PARTS_SUFFIX}")
+        self.progress_callback = progress_callback
+        self.batch_size = batch_size
+        self.columns = list(columns or SIMRES_COLUMNS)
+        self.buffer = {col: [] for col in self.columns}
+        self.buffered = 0
+        self.part_count = 0
+        self.rows = 0
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+
+        # 前回の結果を削除して書き出し先を作り直す
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+
+    def push(self, event):
+        """イベント1件（カラム名をキーとする辞書）を追加する"""
+        for col in self.columns:
+            self.buffer[col].append(event.get(col))
+        self.buffered += 1
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+    def push_frame(self, df):
+        """複数件のイベント（pandasのDataFrame）をまとめて追加する"""
+        if df.empty:
+            return
+        self.flush()
+        for start in range(0, len(df), self.batch_size):
+            self._write_part(df.iloc[start:start + self.batch_size].reindex(columns=self.columns))
+
+    def flush(self):
+        """バッファのイベントをパートファイルに書き出す"""
+        if self.buffered == 0:
+            return
+        df = pd.DataFrame(self.buffer, columns=self.columns)
+        self.buffer = {col: [] for col in self.columns}
+        self.buffered = 0
+        self._write_part(df)
+
+    def _write_part(self, df):
+        """1パート分を書き出す"""
+        frame = to_result_frame(df)
+        part_path = os.path.join(self.path, f"part-{self.part_count:06d}.arrow")
+        temp_path = os.path.join(self.path, f".part-{self.part_count:06d}.tmp")
+        frame.write_ipc(temp_path, compression="uncompressed")
+        os.replace(temp_path, part_path)
+        self.part_count += 1
+        self.rows += len(frame)
+        print(f"[DEBUG] シミュレーション結果の書き出し: {os.path.basename(part_path)} 累計{self.rows:,}行")
+        if self.progress_callback is not None:
+            self.progress_callback(self.rows, self.part_count)
+
+    def close(self):
+        """残りを書き出し、完了の情報ファイルを作成する"""
+        self.flush()
+        with open(os.path.join(self.path, COMPLETE_MARKER), "w", encoding="utf-8") as f:
+            json.dump({
+                "rows": self.rows,
+                "parts": self.part_count,
+                "started_at": self.started_at,
+                "completed_at": datetime.now().isoformat(timespec="seconds"),
+            }, f, ensure_ascii=False)
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # 中断時もそれまでの結果は読めるよう書き出しておく
+            self.flush()
+        return False
+
+
+def accepts_sink(func):
+    """シミュレーション関数が sink 引数（ResultSink）を受け取れるか判定する"""
+    try:
+        return "sink" in inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        # 拡張モジュール等でシグネチャを取得できない場合は従来どおり戻り値で受け取る
+        return False
+
+
+def result_columns(file_path):
+    """結果ファイルのカラム一覧を返す（データは読み込まない）"""
+    return scan_simres(file_path).collect_schema().names()
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    from washi.frames import make_synthetic_log2
+
+    # pickleとの読み込み時間の比較
+    folder = tempfile.mkdtemp()
+    data = make_synthetic_log2(2_000_000)
+    data["OPE_START_DATETIME"] = pd.to_datetime(data["OPE_START_DATETIME"])
+    arrow_path = write_simres(data, folder)
+    pickle_path = os.path.join(folder, f"{SIMRES_NAME}.pkl")
+    with open(pickle_path, "wb") as f:
+        pickle.dump(data, f)
+
+    start = time.perf_counter()
+    with open(pickle_path, "rb") as f:
+        loaded = pickle.load(f)
+    loaded = loaded[(loaded["SUB_LOT_TYPE"] == "P0") & (loaded["MRC"] == "MASTER")]
+    print(f"[DEBUG] pickle: {len(loaded):,}行, {time.perf_counter() - start:.2f}秒")
+
+    start = time.perf_counter()
+    loaded = scan_simres(arrow_path).filter(
+        (pl.col("SUB_LOT_TYPE") == "P0") & (pl.col("MRC") == "MASTER")
+    ).select(["OPE_START_DATETIME", "WAIT_TIME", "EQP_ID", "DeviceGp"]).collect()
+    print(f"[DEBUG] Arrow IPC: {len(loaded):,}行, {time.perf_counter() - start:.2f}秒")
+
+    # ResultSink による逐次書き出しと実行中の読み込み
+    with ResultSink(folder, batch_size=300_000) as sink:
+        for event in data.head(500_000).to_dict("records"):
+            sink.push(event)
+        partial = scan_simres(sink.path).select(pl.len()).collect().item()
+        print(f"[DEBUG] 実行中の読み込み: {partial:,}行, 完了={is_complete(sink.path)}")
+    total = scan_simres(sink.path).select(pl.len()).collect().item()
+    print(f"[DEBUG] 完了後の読み込み: {total:,}行, 完了={is_complete(sink.path)}")
@@ -0,0 +1,141 @@
+"""待ち時間の分位点スケッチ（対数ビンのヒストグラム、グループ間で合算可能）
+
+値を相対誤差 RELATIVE_ACCURACY 以内の対数ビンに振り分けて件数のみを保持する（DDSketch方式）。
+ビンごとの件数を足し合わせるだけで月・DeviceGpをまたいだ集約ができ、
+集約後の中央値・第三四分位点も同じ相対誤差の範囲で求められる。
+"""
+import numpy as np
+import pandas as pd
+
+from washi.stats import group_starts
+
+# 分位点の相対誤差（1%）
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = np.log(GAMMA)
+
+# 0以下の値は最小のビンに入れる（待ち時間は正の値のみを対象とする）
+MIN_VALUE = 1e-9
+
+
+def bucket_index(values):
+    """値を対数ビンの番号に変換する"""
+    values = np.maximum(np.asarray(values, dtype=np.float64), MIN_VALUE)
+    return np.ceil(np.log(values) / LOG_GAMMA).astype(np.int32)
+
+
+def bucket_value(index):
+    """ビンの代表値（ビン内のどの値とも相対誤差 RELATIVE_ACCURACY 以内）"""
+    return 2 * GAMMA ** np.asarray(index, dtype=np.float64) / (GAMMA + 1)
+
+
+def encode_sketch(indexes, counts):
+    """スケッチをBLOB用のバイト列に変換する（ビン番号と件数をint32で連結）"""
+    return np.concatenate([
+        np.asarray(indexes, dtype="<i4"), np.asarray(counts, dtype="<i4")
+    ]).tobytes()
+
+
+def decode_sketch(blob):
+    """バイト列からスケッチ（ビン番号, 件数）を復元する"""
+    data = np.frombuffer(blob, dtype="<i4")
+    half = len(data) // 2
+    return data[:half], data[half:]
+
+
+def build_sketches(group_codes, values, n_groups):
+    """グループごとのスケッチを作成し、グループ番号順のバイト列のリストを返す"""
+    group_codes = np.asarray(group_codes, dtype=np.int64)
+    buckets = bucket_index(values)
+    order = np.lexsort((buckets, group_codes))
+    group_codes = group_codes[order]
+    buckets = buckets[order]
+
+    starts = group_starts(group_codes, buckets)
+    counts = np.diff(np.append(starts, len(buckets)))
+    pair_groups = group_codes[starts]
+    pair_buckets = buckets[starts]
+
+    bounds = np.searchsorted(pair_groups, np.arange(n_groups + 1))
+    return [
+        encode_sketch(pair_buckets[start:end], counts[start:end])
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def frame_sketches(df, keys, value="WAIT_TIME"):
+    """DataFrameをキーごとに集約したスケッチ（キー列 + sketch列）を返す"""
+    if df.empty:
+        return pd.DataFrame(columns=list(keys) + ["sketch"])
+    key_frame = df[list(keys)].astype(str)
+    codes, uniques = pd.factorize(pd.MultiIndex.from_frame(key_frame))
+    sketches = build_sketches(codes, df[value].to_numpy(), len(uniques))
+    result = pd.MultiIndex.from_tuples(uniques, names=list(keys)).to_frame(index=False)
+    result["sketch"] = sketches
+    return result
+
+
+def merge_sketches(blobs):
+    """複数のスケッチを1つのスケッチに合算する"""
+    decoded = [decode_sketch(blob) for blob in blobs if blob]
+    if not decoded:
+        return encode_sketch([], [])
+    indexes = np.concatenate([indexes for indexes, _ in decoded])
+    counts = np.concatenate([counts for _, counts in decoded]).astype(np.int64)
+    merged, inverse = np.unique(indexes, return_inverse=True)
+    return encode_sketch(merged, np.bincount(inverse, weights=counts, minlength=len(merged)))
+
+
+def merge_quantiles(group_codes, blobs, n_groups, quantiles=(0.5, 0.75)):
+    """スケッチをグループごとに合算し、件数と分位点を求める
+
+    group_codes[i] は blobs[i] の集約先グループ番号。
+    戻り値: (件数の配列, {q: 分位点の配列})
+    """
+    decoded = [decode_sketch(blob) for blob in blobs]
+    lengths = np.array([len(indexes) for indexes, _ in decoded], dtype=np.int64)
+    groups = np.repeat(np.asarray(group_codes, dtype=np.int64), lengths)
+    buckets = np.concatenate([indexes for indexes, _ in decoded]) if decoded else np.array([], dtype=np.int32)
+    counts = np.concatenate([c for _, c in decoded]).astype(np.int64) if decoded else np.array([], dtype=np.int64)
+
+    totals = np.bincount(groups, weights=counts, minlength=n_groups).astype(np.int64)
+    results = {q: np.full(n_groups, np.nan) for q in quantiles}
+    if len(buckets) == 0:
+        return totals, results
+
+    # 同じグループ・同じビンの件数を合算
+    order = np.lexsort((buckets, groups))
+    groups = groups[order]
+    buckets = buckets[order]
+    counts = counts[order]
+    starts = group_starts(groups, buckets)
+    groups = groups[starts]
+    buckets = buckets[starts]
+    counts = np.add.reduceat(counts, starts)
+
+    # 各グループの累積件数が順位を超える最初のビンが分位点
+    cumulative = np.cumsum(counts)
+    present = np.flatnonzero(totals > 0)
+    offsets = cumulative[np.searchsorted(groups, present)] - counts[np.searchsorted(groups, present)]
+    for q in quantiles:
+        rank = np.floor(q * (totals[present] - 1))
+        position = np.searchsorted(cumulative, offsets + rank, side="right")
+        results[q][present] = bucket_value(buckets[position])
+    return totals, results
+
+
+if __name__ == "__main__":
+    # 合成データで相対誤差を確認
+    rng = np.random.default_rng(0)
+    n_groups = 1000
+    codes = rng.integers(0, n_groups, 1_000_000)
+    values = rng.exponential(3600, len(codes)) + 1
+    blobs = build_sketches(codes, values, n_groups)
+
+    # 10グループずつ合算した分位点と、元データから求めた分位点を比較
+    rollup = np.arange(n_groups) // 10
+    totals, merged = merge_quantiles(rollup, blobs, rollup.max() + 1)
+    exact = pd.Series(values).groupby(codes // 10).quantile(0.75, interpolation="lower").to_numpy()
+    error = np.abs(merged[0.75] - exact) / exact
+    print(f"[DEBUG] Q3の最大相対誤差: {error.max():.4f}（許容値 {RELATIVE_ACCURACY}）")
+    print(f"[DEBUG] スケッチサイズ: 平均 {np.mean([len(b) for b in blobs]):.0f}バイト/グループ")
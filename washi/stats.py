@@ -0,0 +1,164 @@
+"""待ち時間の月次統計（ソートによる一括集計）"""
+import numpy as np
+import pandas as pd
+
+# 統計のキー（DeviceGp別）と全DeviceGp統合時の値
+STATS_KEYS = ["year_month", "DeviceGp", "EQP_ID"]
+ALL_DEVICES = "ALL"
+
+# 統計値のカラム（sum は月をまたぐ集計・割合の計算用）
+STATS_COLUMNS = ["count", "sum", "mean", "median", "q3"]
+
+
+def group_starts(*keys):
+    """ソート済みのキー配列から、各グループの先頭位置を返す"""
+    changed = np.zeros(len(keys[0]), dtype=bool)
+    changed[:1] = True  # 空の配列では先頭なし
+    for key in keys:
+        changed[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(changed)
+
+
+def _sorted_quantile(values, starts, counts, q):
+    """グループ内が昇順に並んだ配列から分位点を求める（np.percentile の linear と同じ補間）"""
+    position = (counts - 1) * q
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, counts - 1)
+    t = position - lower
+    a = values[starts + lower]
+    b = values[starts + upper]
+    diff = b - a
+    # numpy と同じく t >= 0.5 では上側から補間して誤差を抑える
+    return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+
+def sorted_group_stats(values, starts):
+    """グループ内が昇順に並んだ配列から件数・合計・平均・中央値・第三四分位点を求める"""
+    counts = np.diff(np.append(starts, len(values)))
+    sums = np.add.reduceat(values, starts)
+    return {
+        "count": counts,
+        "sum": sums,
+        "mean": sums / counts,
+        "median": _sorted_quantile(values, starts, counts, 0.5),
+        "q3": _sorted_quantile(values, starts, counts, 0.75),
+    }
+
+
+def monthly_wait_stats(df, value="WAIT_TIME"):
+    """年月・DeviceGp・EQP_ID別と、全DeviceGp統合（DeviceGp='ALL'）の待ち時間統計を求める
+
+    (年月, EQP_ID, 待ち時間) で1回ソートし、全DeviceGp統合の統計はそのまま求める。
+    DeviceGp別は同じ並びをDeviceGpで安定ソートするだけで、グループ内の昇順が保たれる。
+    戻り値のカラム: year_month, DeviceGp, EQP_ID, count, sum, mean, median, q3
+    """
+    columns = STATS_KEYS + STATS_COLUMNS
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+
+    ym_codes, ym_values = pd.factorize(df["year_month"], sort=True)
+    dev_codes, dev_values = pd.factorize(df["DeviceGp"], sort=True)
+    eqp_codes, eqp_values = pd.factorize(df["EQP_ID"], sort=True)
+    values = df[value].to_numpy(dtype=np.float64)
+
+    # (年月, EQP_ID) の複合キーで待ち時間昇順に並べる
+    month_eqp = ym_codes.astype(np.int64) * len(eqp_values) + eqp_codes
+    order = np.lexsort((values, month_eqp))
+    month_eqp = month_eqp[order]
+    dev_sorted = dev_codes[order]
+    values = values[order]
+
+    # 全DeviceGp統合
+    all_starts = group_starts(month_eqp)
+    all_stats = sorted_group_stats(values, all_starts)
+    all_keys = month_eqp[all_starts]
+
+    # DeviceGp別（安定ソートのためグループ内の昇順は維持される）
+    device_order = np.argsort(month_eqp * len(dev_values) + dev_sorted, kind="stable")
+    month_eqp = month_eqp[device_order]
+    dev_sorted = dev_sorted[device_order]
+    values = values[device_order]
+    device_starts = group_starts(month_eqp, dev_sorted)
+    device_stats = sorted_group_stats(values, device_starts)
+    device_keys = month_eqp[device_starts]
+    device_devs = dev_sorted[device_starts]
+
+    # 出力順は (年月, DeviceGp, EQP_ID)
+    ym_labels = np.asarray(ym_values, dtype=object)
+    dev_labels = np.asarray(dev_values, dtype=object)
+    eqp_labels = np.asarray(eqp_values, dtype=object)
+    device_ym = device_keys // len(eqp_values)
+    device_eqp = device_keys % len(eqp_values)
+    output_order = np.lexsort((device_eqp, device_devs, device_ym))
+    device_frame = pd.DataFrame({
+        "year_month": ym_labels[device_ym[output_order]],
+        "DeviceGp": dev_labels[device_devs[output_order]],
+        "EQP_ID": eqp_labels[device_eqp[output_order]],
+        **{name: stat[output_order] for name, stat in device_stats.items()},
+    })
+    all_frame = pd.DataFrame({
+        "year_month": ym_labels[all_keys // len(eqp_values)],
+        "DeviceGp": ALL_DEVICES,
+        "EQP_ID": eqp_labels[all_keys % len(eqp_values)],
+        **all_stats,
+    })
+
+    combined = pd.concat([device_frame, all_frame], ignore_index=True)[columns]
+    combined["count"] = combined["count"].astype("int32")
+    for col in ["mean", "median", "q3"]:
+        combined[col] = combined[col].astype("float32")
+    return combined
+
+
+def reference_monthly_wait_stats(df, value="WAIT_TIME"):
+    """グループごとにループする従来の計算（monthly_wait_stats の検証用）"""
+    rows = []
+    for (year_month, device_gp, eqp_id), group in df.groupby(STATS_KEYS, observed=True)[value]:
+        wait_times = group.values
+        rows.append((year_month, device_gp, eqp_id, len(wait_times), np.mean(wait_times),
+                     np.median(wait_times), np.percentile(wait_times, 75)))
+    for (year_month, eqp_id), group in df.groupby(["year_month", "EQP_ID"], observed=True)[value]:
+        wait_times = group.values
+        rows.append((year_month, ALL_DEVICES, eqp_id, len(wait_times), np.mean(wait_times),
+                     np.median(wait_times), np.percentile(wait_times, 75)))
+    result = pd.DataFrame(rows, columns=STATS_KEYS + ["count", "mean", "median", "q3"])
+    result["count"] = result["count"].astype("int32")
+    for col in ["mean", "median", "q3"]:
+        result[col] = result[col].astype("float32")
+    return result
+
+
+def verify_monthly_wait_stats(df, value="WAIT_TIME", rtol=1e-5):
+    """一括集計の結果が従来の計算と一致するか確認する（平均・分位点はfloat32の精度で比較）"""
+    expected = reference_monthly_wait_stats(df, value)
+    actual = monthly_wait_stats(df, value)
+    if len(expected) != len(actual):
+        return False
+    for col in STATS_KEYS:
+        if not (expected[col].astype(str).to_numpy() == actual[col].astype(str).to_numpy()).all():
+            return False
+    if not (expected["count"].to_numpy() == actual["count"].to_numpy()).all():
+        return False
+    return all(
+        np.allclose(expected[col].to_numpy(), actual[col].to_numpy(), rtol=rtol, atol=0)
+        for col in ["mean", "median", "q3"]
+    )
+
+
+if __name__ == "__main__":
+    import time
+
+    from washi.frames import make_synthetic_log2
+
+    data = make_synthetic_log2(1_000_000)
+    data["OPE_START_DATETIME"] = pd.to_datetime(data["OPE_START_DATETIME"])
+    data["year_month"] = data["OPE_START_DATETIME"].dt.strftime("%Y-%m")
+    data["WAIT_TIME"] = data["WAIT_TIME"].astype("float32")
+    for col in ["EQP_ID", "DeviceGp"]:
+        data[col] = data[col].astype("category")
+
+    for name, func in (("一括集計", monthly_wait_stats), ("従来", reference_monthly_wait_stats)):
+        start = time.perf_counter()
+        result = func(data)
+        print(f"[DEBUG] {name}: {len(result):,}件, {time.perf_counter() - start:.2f}秒")
+    print(f"[DEBUG] 結果の一致: {verify_monthly_wait_stats(data)}")
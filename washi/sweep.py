@@ -0,0 +1,189 @@
+"""装置汎用化設定の複数シナリオを並列にシミュレーションし、結果を比較する（スイープ）
+
+設定CSV（setting アプリの出力）を置いたフォルダを指定すると、CSVごとに1シナリオとして
+プロセスプールで並列に実行する。データベースとパラメータは実行前に読み取り専用の
+スナップショットへコピーし、全シナリオで共有する（実行中に元ファイルが更新されても影響しない）。
+各シナリオの結果から待ち時間の要約を求め、1つの比較表（summary.csv）にまとめる。
+"""
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import stat
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import polars as pl
+
+from washi.simresult import ResultSink, accepts_sink, scan_simres, write_simres
+
+# スイープ結果の保存先（loadフォルダ内の sweep_<名前>）
+SWEEP_PREFIX = "sweep_"
+SNAPSHOT_DIR = "_snapshot"
+SUMMARY_FILE = "summary.csv"
+
+# 要約の列（シナリオ名・設定ファイルの後に並ぶ）
+SUMMARY_COLUMNS = [
+    "rows", "lots", "equipments", "total_wait", "mean_wait",
+    "median_wait", "q3_wait", "p95_wait", "max_wait",
+]
+
+SUMMARY_LABELS = {
+    "scenario": "シナリオ",
+    "equipment_file": "設定ファイル",
+    "status": "状態",
+    "rows": "レコード数",
+    "lots": "ロット数",
+    "equipments": "装置数",
+    "total_wait": "総待ち時間",
+    "mean_wait": "平均待ち時間",
+    "median_wait": "中央値",
+    "q3_wait": "第三四分位点",
+    "p95_wait": "95%点",
+    "max_wait": "最大待ち時間",
+    "error": "エラー",
+}
+
+
+def sweep_dir(name, load_folder="./load"):
+    """スイープ結果のフォルダを返す"""
+    return os.path.join(load_folder, f"{SWEEP_PREFIX}{name}")
+
+
+def list_scenarios(directory):
+    """フォルダ内の設定CSVを (シナリオ名, パス) のリストで返す（スイープの比較表は除く）"""
+    if not os.path.isdir(directory):
+        return []
+    return [
+        (os.path.splitext(name)[0], os.path.join(directory, name))
+        for name in sorted(os.listdir(directory))
+        if name.lower().endswith(".csv") and name != SUMMARY_FILE
+        and os.path.isfile(os.path.join(directory, name))
+    ]
+
+
+def _make_read_only(path):
+    """ファイルを読み取り専用にする"""
+    os.chmod(path, stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
+
+
+def prepare_snapshot(database_path, parameter_path, output_dir):
+    """データベースとパラメータの読み取り専用スナップショットを作成し、そのパスを返す
+
+    データベースはSQLiteのバックアップAPIでコピーするため、書き込み中でも一貫した状態になる。
+    """
+    snapshot_dir = os.path.join(output_dir, SNAPSHOT_DIR)
+    if os.path.exists(snapshot_dir):
+        for name in os.listdir(snapshot_dir):
+            os.chmod(os.path.join(snapshot_dir, name), stat.S_IREAD | stat.S_IWRITE)
+        shutil.rmtree(snapshot_dir)
+    os.makedirs(snapshot_dir)
+
+    db_snapshot = os.path.join(snapshot_dir, os.path.basename(database_path))
+    source = sqlite3.connect(f"file:{os.path.abspath(database_path)}?mode=ro", uri=True)
+    target = sqlite3.connect(db_snapshot)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+    param_snapshot = os.path.join(snapshot_dir, os.path.basename(parameter_path))
+    shutil.copyfile(parameter_path, param_snapshot)
+
+    for path in (db_snapshot, param_snapshot):
+        _make_read_only(path)
+    print(f"[DEBUG] スナップショット作成: {snapshot_dir}")
+    return db_snapshot, param_snapshot
+
+
+def summarize_result(result_path):
+    """シミュレーション結果（P0/MASTER）の待ち時間を要約する"""
+    lf = scan_simres(result_path).filter(
+        (pl.col("SUB_LOT_TYPE") == "P0") & (pl.col("MRC") == "MASTER")
+        & pl.col("WAIT_TIME").is_not_null()
+    )
+    wait = pl.col("WAIT_TIME").cast(pl.Float64)
+    row = lf.select(
+        pl.len().alias("rows"),
+        pl.col("LOT_ID").n_unique().alias("lots"),
+        pl.col("EQP_ID").n_unique().alias("equipments"),
+        wait.sum().alias("total_wait"),
+        wait.mean().alias("mean_wait"),
+        wait.median().alias("median_wait"),
+        wait.quantile(0.75, interpolation="linear").alias("q3_wait"),
+        wait.quantile(0.95, interpolation="linear").alias("p95_wait"),
+        wait.max().alias("max_wait"),
+    ).collect().row(0, named=True)
+    return row
+
+
+def run_scenario(scenario, equipment_path, database_path, parameter_path, output_dir, module_dir=None):
+    """1シナリオを実行して要約を返す（プロセスプールの子プロセスで実行される）"""
+    from washi.jobs import import_simulator
+
+    summary = {"scenario": scenario, "equipment_file": os.path.basename(equipment_path)}
+    try:
+        sim_enc = import_simulator(module_dir)
+        if accepts_sink(sim_enc.sim):
+            with ResultSink(output_dir, name=scenario) as sink:
+                sim_enc.sim(database_path, parameter_path, equipment_path, sink=sink)
+            result_path = sink.path
+        else:
+            result_path = write_simres(sim_enc.sim(database_path, parameter_path, equipment_path),
+                                       output_dir, name=scenario)
+        summary.update(summarize_result(result_path))
+        summary["status"] = "完了"
+    except Exception as e:
+        print(f"[DEBUG] シナリオ失敗: {scenario} {type(e).__name__}: {e}")
+        summary["status"] = "失敗"
+        summary["error"] = f"{type(e).__name__}: {e}"
+    return summary
+
+
+def write_summary(summaries, output_dir):
+    """シナリオの要約を比較表としてCSVに保存する（平均待ち時間の短い順）"""
+    columns = ["scenario", "equipment_file", "status"] + SUMMARY_COLUMNS + ["error"]
+    summary = pd.DataFrame(summaries).reindex(columns=columns)
+    summary = summary.sort_values(["mean_wait", "scenario"], na_position="last").reset_index(drop=True)
+    path = os.path.join(output_dir, SUMMARY_FILE)
+    summary.to_csv(path, index=False, encoding="utf-8-sig")
+    return path
+
+
+def read_summary(output_dir):
+    """比較表を読み込む（表示用に列名を日本語にする）"""
+    path = os.path.join(output_dir, SUMMARY_FILE)
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    return pd.read_csv(path, encoding="utf-8-sig").rename(columns=SUMMARY_LABELS)
+
+
+def run_sweep(database_path, parameter_path, scenario_dir, output_dir, module_dir=None,
+              max_workers=None, progress_callback=None):
+    """フォルダ内の全シナリオを並列に実行し、比較表のパスを返す
+
+    max_workers=None の場合はCPUコア数で実行する。
+    progress_callback(完了数, 総数, シナリオ名) で進捗を受け取れる。
+    """
+    scenarios = list_scenarios(scenario_dir)
+    if not scenarios:
+        raise ValueError(f"設定CSVが見つかりません: {scenario_dir}")
+    os.makedirs(output_dir, exist_ok=True)
+    db_snapshot, param_snapshot = prepare_snapshot(database_path, parameter_path, output_dir)
+
+    max_workers = max_workers or os.cpu_count() or 1
+    summaries = []
+    # ジョブワーカー内ではpolarsを使用済みのことがあるため、子プロセスは spawn で起動する
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(scenarios)),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {
+            pool.submit(run_scenario, scenario, path, db_snapshot, param_snapshot, output_dir, module_dir): scenario
+            for scenario, path in scenarios
+        }
+        for future in as_completed(futures):
+            summaries.append(future.result())
+            print(f"[DEBUG] シナリオ完了: {futures[future]} ({len(summaries)}/{len(scenarios)})")
+            if progress_callback is not None:
+                progress_callback(len(summaries), len(scenarios), futures[future])
+    return write_summary(summaries, output_dir)